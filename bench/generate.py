@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+"""
+Generate synthetic workloads for benchmarking
+
+Writes a corpus of random parse trees in the layout of the sample parses
+(one file of labeled bracket strings per abstract, named like
+10.1038#<n>#abs#sent#scnlp_v3.4.1.parse), a pickled pattern table, a file
+with post-processing rules and a file with tree transformations.
+
+Usage: generate.py [options] output-dir
+"""
+
+import argparse
+import os
+from os.path import join
+import random
+
+import pandas as pd
+
+
+labels = "change", "increase", "decrease"
+
+words = {
+    "DT": ["the", "a", "this", "these"],
+    "JJ": ["tropical", "global", "regular", "strong", "annual", "marine"],
+    "NN": ["climate", "change", "increase", "decrease", "cloud", "forest",
+           "temperature", "rainfall", "growth", "warming"],
+    "NNS": ["forests", "ecosystems", "cycles", "effects", "species"],
+    "IN": ["of", "in", "on", "among", "with"],
+    "VBD": ["increased", "decreased", "changed", "caused", "reduced"],
+    "VBZ": ["increases", "decreases", "changes", "causes", "shows"],
+    "VBN": ["increased", "linked", "observed", "reduced", "changed"],
+    "VBG": ["increasing", "decreasing", "changing", "simulating"],
+    "-LRB-": ["-LRB-"],
+    "-RRB-": ["-RRB-"],
+}
+
+# pattern templates, formatted with a random word
+pattern_templates = [
+    "NP < (VBN|VBD|VBG < /{stem}.*/) !$.. PP",
+    "NP > (PP <<{word} > (NP <<{word}))",
+    "NP < (NN < {word})",
+    "NP << /{stem}/ !<< PP",
+    "VP < (VBD|VBZ < /{stem}/) < NP",
+    "NP $+ (PP < (IN < {word}))",
+    "NP <, DT <- (NN|NNS < /{stem}/)",
+    "S < (NP << {word}) < VP",
+]
+
+# post-processing rules as (pattern, script)
+rule_templates = [
+    ("NP < (VBN|VBD|VBG=n1 < /.ncreas.*/) !$.. PP", "delete n1"),
+    ("NP < DT=n1 $ __", "delete n1"),
+    ("NP < (JJ=n1 $+ NN)", "delete n1"),
+    ("NP < (-LRB-=n1 $++ -RRB-=n2)", "delete n1 n2"),
+]
+
+# tree transformations as (name, pattern, operation)
+transform_templates = [
+    ("drop_determiner", "NP < DT=d", "delete d"),
+    ("drop_adjective", "NP < (JJ=j $++ NN)", "delete j"),
+    ("drop_pp", "NP < (NP $+ PP=p)", "delete p"),
+    ("drop_brackets", "NP < (-LRB-=l $++ -RRB-=r)", "delete l r"),
+]
+
+
+class TreeGenerator(object):
+    """
+    Random parse trees from a small grammar of scientific abstracts
+    """
+
+    def __init__(self, seed=0, max_depth=4):
+        self.random = random.Random(seed)
+        self.max_depth = max_depth
+
+    def word(self, tag):
+        return "({} {})".format(tag, self.random.choice(words[tag]))
+
+    def np(self, depth=0):
+        r = self.random.random()
+        if depth < self.max_depth and r < 0.3:
+            return "(NP {} {})".format(self.np(depth + 1), self.pp(depth + 1))
+        parts = []
+        if r < 0.8:
+            parts.append(self.word("DT"))
+        if self.random.random() < 0.4:
+            parts.append(self.word("JJ"))
+        if self.random.random() < 0.1:
+            parts.append(self.word("VBN"))
+        parts.append(self.word(self.random.choice(("NN", "NNS"))))
+        if self.random.random() < 0.05:
+            parts += [self.word("-LRB-"), self.word("NN"), self.word("-RRB-")]
+        return "(NP {})".format(" ".join(parts))
+
+    def pp(self, depth=0):
+        return "(PP {} {})".format(self.word("IN"), self.np(depth))
+
+    def vp(self, depth=0):
+        tag = self.random.choice(("VBD", "VBZ", "VBG"))
+        parts = [self.word(tag), self.np(depth + 1)]
+        if depth < self.max_depth and self.random.random() < 0.5:
+            parts.append(self.pp(depth + 1))
+        return "(VP {})".format(" ".join(parts))
+
+    def tree(self):
+        return "(ROOT (S {} {} (. .)))".format(self.np(), self.vp())
+
+
+def generate_corpus(parse_dir, n_files=10, n_trees=20, seed=0):
+    """
+    Write n_files files of n_trees random trees each to parse_dir
+    """
+    os.makedirs(parse_dir, exist_ok=True)
+    generator = TreeGenerator(seed)
+
+    for i in range(n_files):
+        fname = "10.1038#{}#abs#sent#scnlp_v3.4.1.parse".format(10000 + i)
+        with open(join(parse_dir, fname), "w") as outf:
+            for _ in range(n_trees):
+                outf.write(generator.tree() + " \n")
+
+
+def generate_patterns(n_patterns=10, seed=0):
+    """
+    Return a pattern table like tredev's, indexed by pattern name with
+    columns "pattern" and "label"
+    """
+    rand = random.Random(seed)
+    vocabulary = sorted(set(word for tag in ("NN", "NNS", "VBD", "VBN")
+                            for word in words[tag]))
+    names, patterns, pattern_labels = [], [], []
+
+    for i in range(n_patterns):
+        word = rand.choice(vocabulary)
+        template = pattern_templates[i % len(pattern_templates)]
+        names.append("p{}".format(i + 1))
+        patterns.append(template.format(word=word, stem=word[1:5]))
+        pattern_labels.append(rand.choice(labels))
+
+    return pd.DataFrame({"pattern": patterns, "label": pattern_labels},
+                        index=names)
+
+
+def generate_rules(rules_fname, pattern_names, n_rules=4, seed=0):
+    """
+    Write post-processing rules targeting random patterns
+    """
+    rand = random.Random(seed)
+
+    with open(rules_fname, "w") as outf:
+        outf.write("# synthetic post-processing rules\n")
+        for i in range(n_rules):
+            pattern, script = rule_templates[i % len(rule_templates)]
+            targets = rand.sample(list(pattern_names),
+                                  min(3, len(pattern_names)))
+            outf.write("\n[rule {}]\ntargets = {}\npattern = {}\n"
+                       "script = {}\n".format(i + 1, ", ".join(targets),
+                                              pattern, script))
+
+
+def generate_transforms(transform_fname, n_transforms=4):
+    """
+    Write tree transformations in the format read by transform.py
+    """
+    with open(transform_fname, "w") as outf:
+        outf.write("% synthetic tree transformations\n\n")
+        for i in range(n_transforms):
+            name, pattern, operation = transform_templates[
+                i % len(transform_templates)]
+            outf.write("{}_{}\n\n{}\n\n{}\n\n\n".format(name, i + 1,
+                                                         pattern, operation))
+
+
+def generate_workload(out_dir, n_files=10, n_trees=20, n_patterns=10,
+                      n_rules=4, n_transforms=4, seed=0):
+    """
+    Write a complete workload to out_dir
+
+    Returns
+    -------
+    dict
+        paths of the parse directory, pattern table (pickled DataFrame),
+        post-processing rules and transformations
+    """
+    paths = {"parse_dir": join(out_dir, "parses"),
+             "patterns": join(out_dir, "patterns.pkl"),
+             "rules": join(out_dir, "post_proc_rules"),
+             "transforms": join(out_dir, "transforms")}
+
+    generate_corpus(paths["parse_dir"], n_files, n_trees, seed)
+    patterns = generate_patterns(n_patterns, seed)
+    patterns.to_pickle(paths["patterns"])
+    generate_rules(paths["rules"], patterns.index, n_rules, seed)
+    generate_transforms(paths["transforms"], n_transforms)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("out_dir")
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--trees", type=int, default=20,
+                        help="trees per file")
+    parser.add_argument("--patterns", type=int, default=10)
+    parser.add_argument("--rules", type=int, default=4)
+    parser.add_argument("--transforms", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    paths = generate_workload(args.out_dir, args.files, args.trees,
+                              args.patterns, args.rules, args.transforms,
+                              args.seed)
+    for name, path in sorted(paths.items()):
+        print("{}: {}".format(name, path))
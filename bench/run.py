@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+"""
+End-to-end benchmarks of the baleen pipeline
+
+Generates a synthetic workload (see generate.py) and times each stage,
+recording wall time, peak RSS and rows per second as JSON. Every stage runs
+in a forked child process, so its peak RSS is not inflated by earlier
+stages. Unless --real-tools is given, tsurgeon.sh is replaced by a stub
+(see stubs.py), and synthetic transformations stand in for the Jython
+transformer, so only the Python side is measured.
+
+Usage:
+
+  run.py [--size small|medium|large] [--repeat N] [--out results.json]
+  run.py compare baseline.json results.json [--threshold 0.1] [--min-time 0.01]
+
+Compare mode prints the relative change of each stage and exits with
+status 1 if any stage got slower or used more memory than the threshold.
+
+tree_yield_benchmark.py is a separate micro-benchmark of tree yields.
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+from os.path import join
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from baleen.extract import Matches
+from baleen.index import TermIndex
+from baleen.postproc import post_process
+from baleen.trans.trace import print_derivations
+from baleen.trans.wrap import (export_to_tuples, matches_to_tuples,
+                               merge_matches, tuples_to_matches)
+from baleen.utils import tree_yields
+
+from generate import generate_workload
+from stubs import TreeNodes, install_stubs
+
+
+# workload sizes as keyword arguments of generate_workload
+sizes = {
+    "small": dict(n_files=20, n_trees=50, n_patterns=8),
+    "medium": dict(n_files=200, n_trees=100, n_patterns=16),
+    "large": dict(n_files=1000, n_trees=200, n_patterns=32),
+}
+
+
+def peak_rss():
+    # ru_maxrss is in kilobytes on Linux, but in bytes on Mac OS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def derive_tuples(matches, fraction=0.3, max_steps=3, seed=0):
+    """
+    Synthetic transformed tuples: the original tuples plus chains of up to
+    max_steps derived tuples for a fraction of the matches
+    """
+    rand = random.Random(seed)
+    tuples = matches_to_tuples(matches)
+    max_index = max([index for index, _, _, _ in tuples] + [-1])
+    derived = []
+
+    for index, _, _, subtree in tuples:
+        if rand.random() < fraction:
+            ancestor = index
+            for step in range(rand.randint(1, max_steps)):
+                max_index += 1
+                derived.append((max_index, ancestor,
+                                "trans{}".format(step + 1), subtree))
+                ancestor = max_index
+
+    return tuples + derived
+
+
+class Benchmark(object):
+    """
+    Benchmark of all stages on a single workload
+    """
+
+    def __init__(self, paths, repeat=3):
+        self.paths = paths
+        self.repeat = repeat
+        self.parse_dir = paths["parse_dir"]
+        self.patterns = pd.read_pickle(paths["patterns"])
+        self.nodes = TreeNodes(self.parse_dir)
+        self.tmp_dir = tempfile.mkdtemp()
+
+        # inputs of later stages are prepared once, outside the timings
+        self.tree_info = Matches.get_tree_info(self.parse_dir)
+        self.term_index = TermIndex.open(self.parse_dir)
+        self.matches = Matches.from_patterns(self.patterns, self.nodes,
+                                             self.parse_dir,
+                                             tree_info=self.tree_info,
+                                             engine="native")
+        self.trans_matches = tuples_to_matches(derive_tuples(self.matches))
+        self.merged_matches = merge_matches(self.matches, self.trans_matches)
+
+    # each stage returns the number of rows it processed
+
+    def get_tree_info(self):
+        return len(Matches.get_tree_info(self.parse_dir))
+
+    def from_patterns(self):
+        return len(Matches.from_patterns(self.patterns, self.nodes,
+                                         self.parse_dir,
+                                         tree_info=self.tree_info,
+                                         engine="native"))
+
+    def from_patterns_batched(self):
+        return len(Matches.from_patterns(self.patterns, self.nodes,
+                                         self.parse_dir,
+                                         tree_info=self.tree_info,
+                                         engine="native", batch=True))
+
+    def from_patterns_prefiltered(self):
+        return len(Matches.from_patterns(self.patterns, self.nodes,
+                                         self.parse_dir,
+                                         tree_info=self.tree_info,
+                                         engine="native",
+                                         term_index=self.term_index))
+
+    def post_process(self):
+        matches = self.matches.copy()
+        post_process(matches, self.paths["rules"])
+        return len(matches)
+
+    def tree_yield(self):
+        return len(tree_yields(self.matches["subtree"]))
+
+    def export_to_tuples(self):
+        export_to_tuples(self.matches, join(self.tmp_dir, "tuples.pkl"))
+        return len(self.matches)
+
+    def merge_matches(self):
+        return len(merge_matches(self.matches, self.trans_matches))
+
+    def print_derivations(self):
+        print_derivations(self.merged_matches, io.StringIO())
+        return len(self.merged_matches)
+
+    stages = ["get_tree_info", "from_patterns", "from_patterns_batched",
+              "from_patterns_prefiltered", "post_process", "tree_yield",
+              "export_to_tuples", "merge_matches", "print_derivations"]
+
+    def measure(self, stage):
+        """
+        Time repeated runs of a stage in a child process
+        """
+        function = getattr(self, stage)
+
+        def child(queue):
+            try:
+                baseline = peak_rss()
+                times = []
+                for _ in range(self.repeat):
+                    start = time.perf_counter()
+                    rows = function()
+                    times.append(time.perf_counter() - start)
+                best = min(times)
+                queue.put({"wall_time": times,
+                           "best": best,
+                           "rows": rows,
+                           "rows_per_s": rows / best if best else None,
+                           "peak_rss": peak_rss(),
+                           "rss_increase": peak_rss() - baseline})
+            except Exception as error:
+                queue.put({"error": repr(error)})
+
+        try:
+            context = multiprocessing.get_context("fork")
+        except ValueError:
+            # no fork (e.g. on Windows): measure in this process
+            queue = multiprocessing.Queue()
+            child(queue)
+            return queue.get()
+
+        queue = context.Queue()
+        process = context.Process(target=child, args=(queue,))
+        process.start()
+        result = queue.get()
+        process.join()
+        return result
+
+    def run(self, stages=None):
+        results = {}
+        for stage in stages or self.stages:
+            results[stage] = result = self.measure(stage)
+            if "error" in result:
+                print("{:26} ERROR {}".format(stage, result["error"]))
+            else:
+                print("{:26} {:9.4f}s {:9.1f} MB {:12.0f} rows/s".format(
+                    stage, result["best"], result["peak_rss"] / 2 ** 20,
+                    result["rows_per_s"] or 0))
+        return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    work_dir = args.work_dir or tempfile.mkdtemp()
+    workload = dict(sizes[args.size], seed=args.seed)
+
+    if not args.real_tools:
+        install_stubs(join(work_dir, "stubs"))
+
+    paths = generate_workload(join(work_dir, "workload"), **workload)
+    benchmark = Benchmark(paths, repeat=args.repeat)
+    print("{} trees, {} matches, {} transformed matches".format(
+        len(benchmark.tree_info), len(benchmark.matches),
+        len(benchmark.trans_matches)))
+
+    results = {"meta": {"size": args.size,
+                        "workload": workload,
+                        "repeat": args.repeat,
+                        "real_tools": args.real_tools,
+                        "revision": git_revision(),
+                        "python": platform.python_version(),
+                        "platform": platform.platform(),
+                        "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+               "stages": benchmark.run(args.stages)}
+
+    if args.out:
+        with open(args.out, "w") as outf:
+            json.dump(results, outf, indent=2)
+
+
+def compare(baseline, results, threshold=0.1, min_time=0.01):
+    """
+    Compare two benchmark results
+
+    Returns
+    -------
+    list of str
+        regressions, i.e. stages whose best wall time or peak RSS increase
+        grew by more than threshold (relative). Stages taking less than
+        min_time seconds in both runs are too noisy to be flagged as slower.
+    """
+    regressions = []
+    print("{:26} {:>10} {:>10} {:>8} {:>8}".format(
+        "stage", "base (s)", "new (s)", "time", "memory"))
+
+    for stage, new in results["stages"].items():
+        base = baseline["stages"].get(stage)
+        if not base or "error" in base or "error" in new:
+            print("{:26} not comparable".format(stage))
+            continue
+
+        time_change = new["best"] / base["best"] - 1 if base["best"] else 0
+        rss_change = ((new["rss_increase"] - base["rss_increase"]) /
+                      max(base["rss_increase"], 2 ** 20))
+        flags = []
+        if (time_change > threshold and
+                max(base["best"], new["best"]) >= min_time):
+            flags.append("SLOWER")
+        if rss_change > threshold:
+            flags.append("MORE MEMORY")
+        if flags:
+            regressions.append(stage)
+
+        print("{:26} {:10.4f} {:10.4f} {:+7.1%} {:+7.1%} {}".format(
+            stage, base["best"], new["best"], time_change, rss_change,
+            " ".join(flags)))
+
+    return regressions
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["compare"]:
+        parser = argparse.ArgumentParser(
+            description="compare two benchmark results")
+        parser.add_argument("baseline")
+        parser.add_argument("results")
+        parser.add_argument("--threshold", type=float, default=0.1,
+                            help="relative increase flagged as regression")
+        parser.add_argument("--min-time", type=float, default=0.01,
+                            help="shortest wall time (s) flagged as slower")
+        args = parser.parse_args(sys.argv[2:])
+
+        with open(args.baseline) as inf:
+            baseline = json.load(inf)
+        with open(args.results) as inf:
+            results = json.load(inf)
+
+        if compare(baseline, results, args.threshold, args.min_time):
+            sys.exit(1)
+    else:
+        parser = argparse.ArgumentParser(
+            description="benchmark the baleen pipeline")
+        parser.add_argument("--size", choices=sorted(sizes), default="small")
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--stages", nargs="+",
+                            choices=Benchmark.stages,
+                            help="stages to run (default: all)")
+        parser.add_argument("--out", help="file for JSON results")
+        parser.add_argument("--work-dir",
+                            help="directory for workload and stubs "
+                                 "(default: temporary directory)")
+        parser.add_argument("--real-tools", action="store_true",
+                            help="use tsurgeon.sh on the PATH instead of "
+                                 "the stub")
+        run(parser.parse_args())
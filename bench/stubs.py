@@ -0,0 +1,74 @@
+"""
+Local stand-ins for external tools, so that the Python side of each stage
+can be benchmarked on its own
+
+- TreeNodes replaces tredev.nodes.Nodes, resolving node ids from the corpus
+  parsed with baleen.tree
+- install_stubs puts a tsurgeon.sh on the PATH which returns its input trees
+  unchanged, without starting a JVM
+
+Tree matching needs no stub: Matches.from_patterns is benchmarked with the
+native engine.
+"""
+
+from bisect import bisect_right
+import os
+from os.path import join
+import stat
+
+from baleen.tree import read_corpus
+from baleen.utils import tree_yield
+
+
+tsurgeon_stub = """#!/usr/bin/env python3
+# tsurgeon.sh stub: print the trees from -treeFile unchanged
+import sys
+
+args = sys.argv[1:]
+with open(args[args.index("-treeFile") + 1]) as inf:
+    sys.stdout.write(inf.read().strip() + "\\n")
+"""
+
+
+class TreeNodes(object):
+    """
+    Nodes of all trees in directory parse_dir, with the methods of
+    tredev.nodes.Nodes used by Matches.from_patterns
+    """
+
+    def __init__(self, parse_dir):
+        self.trees = read_corpus(parse_dir)
+        # node ids number all nodes of all trees consecutively
+        self.offsets = [0]
+        for tree in self.trees:
+            self.offsets.append(self.offsets[-1] + len(tree))
+
+    def get_node_id(self, abs_tree_n, node_n):
+        return self.offsets[abs_tree_n - 1] + node_n - 1
+
+    def _locate(self, node_id):
+        tree_i = bisect_right(self.offsets, node_id) - 1
+        return self.trees[tree_i], node_id - self.offsets[tree_i]
+
+    def get_subtree(self, node_id):
+        tree, i = self._locate(node_id)
+        return tree.to_string(i)
+
+    def get_substring(self, node_id):
+        tree, i = self._locate(node_id)
+        return tree_yield(tree[i])
+
+
+def install_stubs(stub_dir):
+    """
+    Write stub executables to stub_dir and prepend it to the PATH
+    """
+    os.makedirs(stub_dir, exist_ok=True)
+    fname = join(stub_dir, "tsurgeon.sh")
+
+    with open(fname, "w") as outf:
+        outf.write(tsurgeon_stub)
+
+    os.chmod(fname, os.stat(fname).st_mode | stat.S_IXUSR | stat.S_IXGRP |
+             stat.S_IXOTH)
+    os.environ["PATH"] = stub_dir + os.pathsep + os.environ.get("PATH", "")
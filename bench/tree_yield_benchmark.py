@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+"""
+Micro-benchmark: tree yields of a million subtrees, row by row versus 
+a whole column at once with baleen.utils.tree_yields
+
+Note: run sample/setup_sample.py first to create the sample parses
+"""
+
+from glob import glob
+from os.path import dirname, join
+from time import perf_counter
+
+from tredev.nodes import Nodes
+
+from baleen.utils import tree_yields
+
+
+n_subtrees = 1000000
+
+parse_dir = join(dirname(__file__), "..", "sample", "parses")
+
+
+def row_yield(tree):
+    # tree yield as computed row by row before tree_yields
+    return " ".join(Nodes.unescape_brackets(part.rstrip(")"))
+                    for part in tree.split() 
+                    if not part.startswith("("))
+
+
+def subtrees(tree):
+    # all subtrees of a labeled bracket string
+    starts = []
+    for i, char in enumerate(tree):
+        if char == "(":
+            starts.append(i)
+        elif char == ")":
+            yield tree[starts.pop():i + 1]
+
+
+trees = [line.strip() 
+         for fname in sorted(glob(join(parse_dir, "*"))) 
+         for line in open(fname)]
+column = [subtree for tree in trees for subtree in subtrees(tree)]
+column = (column * (n_subtrees // len(column) + 1))[:n_subtrees]
+
+start = perf_counter()
+row_yields = [row_yield(subtree) for subtree in column]
+row_time = perf_counter() - start
+
+start = perf_counter()
+column_yields = tree_yields(column)
+column_time = perf_counter() - start
+
+assert row_yields == column_yields
+
+print("{} subtrees".format(len(column)))
+print("row by row:   {:.2f}s".format(row_time))
+print("whole column: {:.2f}s".format(column_time))
+print("speedup:      {:.1f}x".format(row_time / column_time))
@@ -0,0 +1,443 @@
+"""
+Persistent caches of pattern matches and tree edits
+
+Matches are cached per pattern and per tree file, keyed by the normalized
+pattern text, the engine which matched it and a hash of the file content, 
+and stored with tree numbers relative to the file. Hence after changing one pattern or adding a few tree 
+files, only the new (pattern, file) pairs are matched again, while cached 
+matches are renumbered according to the current absolute tree numbering.
+
+Edited trees from post-processing are cached per subtree and chain of 
+post-processing rules.
+"""
+
+from collections import OrderedDict
+from glob import glob
+from hashlib import sha1
+import json
+import os
+from os.path import join, exists, getsize
+import pickle
+import re
+import sqlite3
+
+import numpy as np
+
+from baleen.pattern import compile_pattern, UnsupportedPattern
+from baleen.tregex import match_files
+
+
+# regular expressions and quoted strings, in which whitespace is significant
+literal_re = re.compile(r'(/(?:[^/\\]|\\.)*/|"(?:[^"\\]|\\.)*")')
+
+
+def normalize_pattern(pattern):
+    """
+    Normalize whitespace in a Tregex pattern, except within regular 
+    expressions and quoted strings
+    """
+    parts = literal_re.split(pattern)
+    # odd parts are literals
+    return "".join(part if i % 2 else re.sub(r"\s+", " ", part)
+                   for i, part in enumerate(parts)).strip()
+
+
+def hash_file(fname):
+    """
+    Return hex digest of the file's content and its number of trees (lines)
+    """
+    with open(fname, "rb") as inf:
+        data = inf.read()
+    n_trees = data.count(b"\n") + (1 if data and not data.endswith(b"\n") 
+                                   else 0)
+    return sha1(data).hexdigest(), n_trees
+
+
+class MatchCache(object):
+    """
+    On-disk cache of matches keyed by pattern, engine and file content
+    
+    Parameters
+    ----------
+    cache_path: str
+        directory for storing cache entries; created if necessary
+    max_size: int, optional
+        maximum total size of cache entries in bytes; least recently used 
+        entries are evicted when it is exceeded 
+        
+    Attributes
+    ----------
+    hits: int
+        number of (pattern, file) pairs found in the cache
+    misses: int
+        number of (pattern, file) pairs that had to be matched
+    evictions: int
+        number of evicted cache entries
+    """
+    
+    def __init__(self, cache_path, max_size=2**30):
+        self.cache_path = cache_path
+        self.max_size = max_size
+        self.hits = self.misses = self.evictions = 0
+        os.makedirs(cache_path, exist_ok=True)
+        self.size = sum(getsize(fname) for fname in self._entries())
+        
+        if self.size > self.max_size:
+            self.evict()
+        
+    def stats(self):
+        """
+        Return dict with counters and current size of the cache
+        """
+        return dict(hits=self.hits, misses=self.misses, 
+                    evictions=self.evictions, size=self.size)
+    
+    def _entries(self):
+        return glob(join(self.cache_path, "*", "*.pkl"))
+    
+    def _fname(self, pattern, file_hash, engine):
+        key = sha1("\t".join((normalize_pattern(pattern), engine, file_hash))
+                   .encode("utf-8")).hexdigest()
+        return join(self.cache_path, key[:2], key + ".pkl")
+    
+    @staticmethod
+    def resolve_engine(pattern, engine):
+        """
+        Return the engine which matches pattern, "native" or "external"; 
+        see baleen.tregex.get_matches
+        """
+        if engine != "external":
+            try:
+                compile_pattern(pattern)
+            except UnsupportedPattern:
+                if engine == "native":
+                    raise
+            else:
+                return "native"
+        return "external"
+    
+    def get(self, pattern, file_hash, engine="external"):
+        """
+        Return cached list of (relative tree number, node number) pairs or
+        None
+        """
+        fname = self._fname(pattern, file_hash, engine)
+        try:
+            with open(fname, "rb") as inf:
+                pairs = pickle.load(inf)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        
+        self.hits += 1
+        # mark as recently used
+        os.utime(fname)
+        return pairs
+        
+    def put(self, pattern, file_hash, pairs, engine="external"):
+        """
+        Store list of (relative tree number, node number) pairs
+        """
+        fname = self._fname(pattern, file_hash, engine)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        if exists(fname):
+            self.size -= getsize(fname)
+        # write to temp file first, so concurrent readers never see a 
+        # partial entry
+        tmp_fname = "{}.{}.tmp".format(fname, os.getpid())
+        with open(tmp_fname, "wb") as outf:
+            pickle.dump(pairs, outf, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_fname, fname)
+        self.size += getsize(fname)
+        
+        if self.size > self.max_size:
+            self.evict()
+            
+    def evict(self, max_size=None):
+        """
+        Remove least recently used entries until the cache size is below 
+        max_size, which defaults to the cache's maximum size
+        """
+        if max_size is None:
+            max_size = self.max_size
+            
+        entries = []
+        for fname in self._entries():
+            stat = os.stat(fname)
+            entries.append((stat.st_mtime, stat.st_size, fname))
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        
+        for _, size, fname in entries:
+            if self.size <= max_size:
+                break
+            try:
+                os.remove(fname)
+            except OSError:
+                continue
+            self.size -= size
+            self.evictions += 1
+            
+    def clear(self):
+        """
+        Remove all entries
+        """
+        self.evict(0)
+        
+    def get_matches_multi(self, patterns, file_path, exec_path="tregex.sh",
+                          engine="external", term_index=None):
+        """
+        Match several Tregex patterns against all trees in the tree files in
+        directory file_path, matching only (pattern, file) pairs not in the 
+        cache
+        
+        Parameters
+        ----------
+        patterns: iterable of str
+            Tregex patterns
+        file_path: str
+            directory containing tree files
+        exec_path: str, optional
+            path to tregex.sh executable
+        engine: str, optional
+            see baleen.tregex.get_matches
+        term_index: baleen.index.TermIndex instance, optional
+            inverted index of the tree files; pairs which are not cached 
+            are only matched against the candidate trees of the pattern, 
+            with the same results
+            
+        Returns
+        -------
+        dict
+            mapping each pattern to a list of (int, int) tuples with 
+            absolute tree number and node number of each match
+        """
+        patterns = list(patterns)
+        # same order as Matches.get_tree_info
+        fnames = sorted(glob(join(file_path, "*")))
+        hashes = [hash_file(fname) for fname in fnames]
+        # number of trees preceding each file, and in total
+        bases = [0]
+        for _, n_trees in hashes:
+            bases.append(bases[-1] + n_trees)
+        engines = dict((pattern, self.resolve_engine(pattern, engine))
+                       for pattern in patterns)
+        # pattern -> absolute tree numbers of candidate trees
+        candidates = {}
+        
+        if term_index is not None:
+            for pattern in engines:
+                tree_ns = term_index.candidates(pattern)
+                if tree_ns is not None:
+                    candidates[pattern] = np.asarray(tree_ns)
+        
+        # (pattern, file number) -> matches with relative tree numbers
+        found = {}
+        # file number -> patterns to match
+        missing = {}
+        
+        for pattern, pattern_engine in engines.items():
+            for file_n, (file_hash, _) in enumerate(hashes):
+                pairs = self.get(pattern, file_hash, pattern_engine)
+                if pairs is not None:
+                    found[pattern, file_n] = pairs
+                elif pattern in candidates and not (
+                        (candidates[pattern] > bases[file_n]) & 
+                        (candidates[pattern] <= bases[file_n + 1])).any():
+                    # no candidate trees in this file
+                    self.put(pattern, file_hash, [], pattern_engine)
+                    found[pattern, file_n] = []
+                else:
+                    missing.setdefault(file_n, []).append(pattern)
+        
+        # pattern -> file numbers, for patterns matched by tregex.sh on all
+        # trees
+        external = {}
+        
+        def put(pattern, file_n, pairs):
+            # store matches with tree numbers relative to the file
+            base = bases[file_n]
+            file_pairs = [(tree_n - base, node_n) for tree_n, node_n in pairs
+                          if base < tree_n <= bases[file_n + 1]]
+            self.put(pattern, hashes[file_n][0], file_pairs, engines[pattern])
+            found[pattern, file_n] = file_pairs
+        
+        for file_n, file_patterns in sorted(missing.items()):
+            native = [pattern for pattern in file_patterns 
+                      if engines[pattern] == "native"]
+            
+            if native:
+                result = match_files(native, [], [fnames[file_n]], 
+                                     base=bases[file_n], 
+                                     candidates=candidates)
+                for pattern, pairs in result.items():
+                    put(pattern, file_n, pairs)
+                    
+            for pattern in file_patterns:
+                if engines[pattern] == "native":
+                    continue
+                if pattern in candidates:
+                    # tregex.sh on the candidate trees of this file only
+                    pairs = match_files([], [pattern], [fnames[file_n]], 
+                                        base=bases[file_n], 
+                                        candidates=candidates,
+                                        exec_path=exec_path)[pattern]
+                    put(pattern, file_n, pairs)
+                else:
+                    external.setdefault(pattern, []).append(file_n)
+                    
+        for pattern, file_ns in external.items():
+            # one call to tregex.sh for all files missing for this pattern
+            pairs = match_files([], [pattern], [fnames[n] for n in file_ns],
+                                exec_path=exec_path)[pattern]
+            base = 0
+            for file_n in file_ns:
+                n_trees = hashes[file_n][1]
+                # renumber from the selected files to all files
+                put(pattern, file_n, 
+                    [(tree_n - base + bases[file_n], node_n) 
+                     for tree_n, node_n in pairs
+                     if base < tree_n <= base + n_trees])
+                base += n_trees
+        
+        # renumber to absolute tree numbers
+        matches = {}
+        for pattern in patterns:
+            pairs = matches[pattern] = []
+            for file_n, base in enumerate(bases[:-1]):
+                pairs.extend((base + tree_n, node_n) 
+                             for tree_n, node_n in found[pattern, file_n])
+                
+        return matches
+
+
+class EditCache(object):
+    """
+    Cache of subtrees edited by a chain of post-processing rules
+    
+    Recently used entries are kept in memory, all entries are optionally
+    stored in an SQLite database on disk.
+    
+    Parameters
+    ----------
+    db_fname: str, optional
+        filename of SQLite database; if None, entries are only kept in 
+        memory
+    max_items: int, optional
+        maximum number of entries kept in memory
+        
+    Attributes
+    ----------
+    hits: int
+        number of subtrees found in the cache
+    misses: int
+        number of subtrees not found in the cache
+    """
+    
+    # maximum number of parameters in a single SQLite query 
+    batch_size = 500
+    
+    def __init__(self, db_fname=None, max_items=100000):
+        self.max_items = max_items
+        self.memory = OrderedDict()
+        self.hits = self.misses = 0
+        self.db = None
+        
+        if db_fname:
+            self.db = sqlite3.connect(db_fname)
+            self.db.execute("CREATE TABLE IF NOT EXISTS edits "
+                            "(chain TEXT, subtree TEXT, edited TEXT, "
+                            "PRIMARY KEY (chain, subtree))")
+            
+    @staticmethod
+    def chain_key(rules):
+        """
+        Return key for a chain of (pattern, script) rules
+        """
+        text = json.dumps([list(rule) for rule in rules])
+        return sha1(text.encode("utf-8")).hexdigest()
+            
+    def stats(self):
+        """
+        Return dict with counters and number of entries in memory
+        """
+        return dict(hits=self.hits, misses=self.misses, 
+                    in_memory=len(self.memory))
+    
+    def _remember(self, key, edited):
+        self.memory[key] = edited
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+        
+    def get_many(self, rules, subtrees):
+        """
+        Look up edited subtrees
+        
+        Parameters
+        ----------
+        rules: list of (str, str) tuples
+            chain of (pattern, script) rules
+        subtrees: list of str
+            unique subtrees
+        
+        Returns
+        -------
+        dict
+            mapping subtrees found in the cache to edited subtrees
+        """
+        chain = self.chain_key(rules)
+        found = {}
+        missing = []
+        
+        for subtree in subtrees:
+            key = chain, subtree
+            try:
+                found[subtree] = self.memory[key]
+            except KeyError:
+                missing.append(subtree)
+            else:
+                self.memory.move_to_end(key)
+                
+        if self.db and missing:
+            for i in range(0, len(missing), self.batch_size):
+                batch = missing[i:i + self.batch_size]
+                query = ("SELECT subtree, edited FROM edits WHERE chain = ? "
+                         "AND subtree IN ({})".format(
+                             ",".join("?" * len(batch))))
+                for subtree, edited in self.db.execute(query, 
+                                                       [chain] + batch):
+                    found[subtree] = edited
+                    self._remember((chain, subtree), edited)
+                    
+        self.hits += len(found)
+        self.misses += len(subtrees) - len(found)
+        return found
+    
+    def put_many(self, rules, edits):
+        """
+        Store edited subtrees
+        
+        Parameters
+        ----------
+        rules: list of (str, str) tuples
+            chain of (pattern, script) rules
+        edits: dict
+            mapping subtrees to edited subtrees
+        """
+        chain = self.chain_key(rules)
+        
+        for subtree, edited in edits.items():
+            self._remember((chain, subtree), edited)
+            
+        if self.db:
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO edits VALUES (?, ?, ?)",
+                    ((chain, subtree, edited) 
+                     for subtree, edited in edits.items()))
+                
+    def close(self):
+        if self.db:
+            self.db.close()
+            self.db = None
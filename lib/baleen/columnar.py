@@ -0,0 +1,171 @@
+"""
+Compact in-memory layout and columnar storage of matches
+"""
+
+import os
+import sys
+
+import pandas as pd
+
+from baleen.tree import as_string
+
+
+# repeated strings are stored as categories
+CATEGORICAL_COLUMNS = ["pat_name", "label", "file", "trans_name"]
+
+# tree, node and byte numbers are stored as 32-bit integers
+INTEGER_COLUMNS = ["rel_tree_n", "node_n", "tree_id", "start", "end"]
+
+# fixed width of integer columns, so that it does not depend on the values
+# in a table or chunk
+INTEGER_DTYPE = "int32"
+
+# identical strings share memory
+INTERNED_COLUMNS = ["subtree", "substr"]
+
+# canonical column order of (merged) matches
+COLUMNS = ["pat_name", "label", "file", "rel_tree_n", "node_n",
+           "tree_id", "start", "end",
+           "subtree", "substr", "trans_name",
+           "origin", "ancestor", "descendants"]
+
+# extension of pickled matches, for backward compatibility
+PICKLE_EXTENSIONS = (".pkl", ".pickle")
+
+hint = """
+Columnar storage of matches requires pyarrow, e.g.
+
+  pip install pyarrow
+
+Alternatively use a filename ending in .pkl to store pickled matches.
+"""
+
+
+def intern_strings(values):
+    return [sys.intern(value) if isinstance(value, str) else value
+            for value in values]
+
+
+def compact_matches(matches):
+    """
+    Convert matches in place to a compact layout with categorical columns,
+    32-bit integer columns and interned strings
+
+    Parameters
+    ----------
+    matches: pandas.DataFrame
+        matches from Matches.from_patterns or merged matches from
+        baleen.trans.wrap.merge_matches
+
+    Returns
+    -------
+    matches: pandas.DataFrame
+        the same matches
+    """
+    for column in CATEGORICAL_COLUMNS:
+        if (column in matches and
+                not isinstance(matches[column].dtype, pd.CategoricalDtype)):
+            matches[column] = matches[column].astype("category")
+
+    for column in INTEGER_COLUMNS:
+        if column in matches and not matches[column].isnull().any():
+            matches[column] = matches[column].astype(INTEGER_DTYPE)
+
+    for column in INTERNED_COLUMNS:
+        if column in matches and matches[column].dtype == object:
+            matches[column] = intern_strings(matches[column])
+
+    return matches
+
+
+def write_matches(matches, path, partition_cols=("label",), row_offset=0):
+    """
+    Write matches in columnar format
+
+    Parameters
+    ----------
+    matches: pandas.DataFrame
+        (merged) matches
+    path: str
+        directory for a Parquet dataset partitioned on partition_cols, or
+        a filename ending in .pkl for pickled matches
+    partition_cols: sequence of str, optional
+        columns to partition on
+    row_offset: int, optional
+        position of the first row, when appending matches to an existing
+        Parquet dataset
+    """
+    if path.endswith(PICKLE_EXTENSIONS):
+        pd.to_pickle(matches, path)
+        return
+
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError(hint)
+
+    table = matches.reset_index()
+    for column in INTEGER_COLUMNS:
+        # chunks appended to a dataset must have the same schema
+        if column in table:
+            table[column] = table[column].astype(
+                INTEGER_DTYPE.capitalize() if table[column].isnull().any()
+                else INTEGER_DTYPE)
+    for column in INTERNED_COLUMNS:
+        # parsed trees are stored as labeled bracket strings
+        if column in table and table[column].dtype == object:
+            table[column] = [as_string(value) for value in table[column]]
+    # partitioning reorders rows, so record original row order
+    table["row"] = range(row_offset, row_offset + len(table))
+    for column in CATEGORICAL_COLUMNS:
+        # the width of category codes depends on the number of categories,
+        # so write values; Parquet encodes them as dictionary anyway
+        if (column in table and column not in partition_cols and
+                isinstance(table[column].dtype, pd.CategoricalDtype)):
+            table[column] = table[column].astype(object)
+    for column in partition_cols:
+        # avoid writing empty partitions for unused categories
+        if isinstance(table[column].dtype, pd.CategoricalDtype):
+            table[column] = table[column].cat.remove_unused_categories()
+    table.to_parquet(path, engine="pyarrow", index=False,
+                     partition_cols=list(partition_cols))
+
+
+def read_matches(path, columns=None, filters=None):
+    """
+    Read matches written by write_matches
+
+    Parameters
+    ----------
+    path: str
+        directory of Parquet dataset or filename ending in .pkl
+    columns: list of str, optional
+        columns to read (Parquet only)
+    filters: list of tuples, optional
+        row filters on partition columns such as [("label", "=", "increase")]
+        (Parquet only)
+
+    Returns
+    -------
+    matches: pandas.DataFrame
+    """
+    if path.endswith(PICKLE_EXTENSIONS) or os.path.isfile(path):
+        return pd.read_pickle(path)
+
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError(hint)
+
+    if columns is not None:
+        columns = list(columns) + ["index", "row"]
+
+    table = pd.read_parquet(path, engine="pyarrow", columns=columns,
+                            filters=filters)
+    table.sort_values("row", inplace=True)
+    table.set_index("index", inplace=True)
+    table.index.name = None
+    del table["row"]
+    ordered = ([column for column in COLUMNS if column in table] +
+               [column for column in table if column not in COLUMNS])
+    return compact_matches(table.reindex(columns=ordered))
@@ -1,9 +1,16 @@
 from glob import glob
+from numbers import Integral
 from os.path import join, basename
+from time import perf_counter
 
+import numpy as np
 import pandas as pd
 
-from tredev.tregex import get_matches
+from baleen.columnar import compact_matches
+from baleen.instrument import active_collector
+from baleen.pattern import compile_pattern, UnsupportedPattern
+from baleen.tregex import (get_matches, get_matches_multi, 
+                           get_matches_parallel)
 
 
 
@@ -11,9 +18,16 @@ class Matches(pd.DataFrame):
 
     fields = ["pat_name", "label", "file", "rel_tree_n", "node_n", "subtree", "substr"]
     
+    # fields of span tables, referring to subtrees in a corpus store
+    span_fields = ["pat_name", "label", "file", "rel_tree_n", "node_n", 
+                   "tree_id", "start", "end"]
+    
     @classmethod
     def from_patterns(cls, patterns, nodes, file_path, tree_info=None,
-                      exec_path="tregex.sh", drop_duplicates=False):
+                      exec_path="tregex.sh", drop_duplicates=False,
+                      engine="external", batch=False, n_jobs=1, 
+                      executor=None, cache=None, term_index=None, 
+                      spans=False):
         """
         Collect the subtrees/substrings matching the given patterns
         
@@ -22,51 +36,256 @@ class Matches(pd.DataFrame):
         patterns: tredev.patterns.Patterns instance
             tree matching patterns
         nodes: tredev.nodes.Nodes instance
-            nodes 
+            nodes; see resolve_nodes 
         file_path: str
             directory containing tree files
-        tree_info: dict, optional
+        tree_info: dict or baleen.index.TreeIndex instance, optional
             precomputed info on relative tree numbers and original filename;
-            see Matches.get_tree_info
+            see Matches.get_tree_info. A persistent TreeIndex avoids 
+            rescanning all tree files on every run.
         exec_path: str, optional
             path to tregex.sh executable
         drop_duplicates: bool, opt
             remove duplicate matches (i.e. with identical values for
             label, file, tree number and node number)
+        engine: str, optional
+            matching engine: "external" (default), "auto" or "native";
+            see baleen.tregex.get_matches
+        batch: bool, optional
+            match all patterns in a single traversal of each tree, sharing
+            work between patterns with common root categories and 
+            sub-expressions; results are the same as when matching patterns 
+            one by one, which is the default. Only natively supported 
+            patterns are batched, so engine must be "auto" or "native", and
+            ValueError is raised if none of the patterns can be batched. 
+            Compare the stages from_patterns and from_patterns_batched of 
+            bench/run.py.
+        n_jobs: int, optional
+            number of processes to spread the matching of (pattern, file 
+            shard) work units over; output is identical to a serial run
+        executor: concurrent.futures.Executor instance, optional
+            executor to submit work units to instead of a new process pool
+        cache: baleen.cache.MatchCache instance, optional
+            persistent match cache; only (pattern, file) pairs which are not
+            cached are matched
+        term_index: baleen.index.TermIndex instance, optional
+            inverted index of the tree files; each pattern is only matched
+            against the trees containing the words and labels it requires, 
+            with the same results. With a cache, only (pattern, file) pairs
+            which are not cached are prefiltered.
+        spans: bool, optional
+            return a span table, in which subtrees are referred to by 
+            columns tree_id, start and end instead of copies of subtrees 
+            and substrings; requires a baleen.store.CorpusStore as nodes,
+            which decodes them on access
             
         Returns
         -------
         Matches instance
-            table of matching subtrees/substrings 
+            table of matching subtrees/substrings in compact layout;
+            see baleen.columnar.compact_matches
         """
         if not tree_info:
             tree_info = cls.get_tree_info(file_path)
             
-        records = []  
-        
-        for index, row in patterns.iterrows(): 
-            matches = get_matches(row["pattern"], file_path, exec_path=exec_path)
-            
-            for abs_tree_n, node_n in matches:  
-                node_id = nodes.get_node_id(abs_tree_n, node_n) 
-                rel_tree_n, fname = tree_info[abs_tree_n]
-                records.append((index, 
-                                row["label"], 
-                                fname,
-                                rel_tree_n, 
-                                node_n, 
-                                nodes.get_subtree(node_id), 
-                                nodes.get_substring(node_id)))
-            
-        matches = pd.DataFrame(records, columns=cls.fields)
+        pattern_matches = cls._iter_pattern_matches(
+            patterns, file_path, exec_path=exec_path, engine=engine, 
+            batch=batch, n_jobs=n_jobs, executor=executor, cache=cache,
+            term_index=term_index)
+        matches = pd.DataFrame(cls._resolve_columns(pattern_matches, nodes, 
+                                                    tree_info, spans),
+                               columns=cls.span_fields if spans 
+                               else cls.fields)
         
         if drop_duplicates:
             matches.drop_duplicates(
                 subset=['label', 'file', 'rel_tree_n', 'node_n'], 
                 inplace=True)
         
-        return matches
+        return compact_matches(matches)
+        
+    @classmethod
+    def _iter_pattern_matches(cls, patterns, file_path, exec_path="tregex.sh",
+                              engine="external", batch=False, n_jobs=1, 
+                              executor=None, cache=None, term_index=None):
+        # generate (pattern index, label, matches) for each pattern, 
+        # matching patterns lazily one by one unless matching is batched
+        collector = active_collector()
+        if collector:
+            start = perf_counter()
+            # time spent on each pattern before this run
+            before = dict((text, cls._match_seconds(collector, text))
+                          for text in patterns["pattern"])
+            
+        if cache is not None:
+            pattern_matches = cache.get_matches_multi(patterns["pattern"],
+                                                      file_path,
+                                                      exec_path=exec_path,
+                                                      engine=engine,
+                                                      term_index=term_index)
+        elif n_jobs > 1 or executor:
+            pattern_matches = get_matches_parallel(patterns["pattern"], 
+                                                   file_path,
+                                                   exec_path=exec_path,
+                                                   engine=engine,
+                                                   n_jobs=n_jobs,
+                                                   executor=executor,
+                                                   term_index=term_index)
+        elif batch:
+            cls._check_batch(patterns["pattern"], engine)
+            pattern_matches = get_matches_multi(patterns["pattern"], file_path,
+                                                exec_path=exec_path,
+                                                engine=engine,
+                                                term_index=term_index)
+        else:
+            pattern_matches = None
+            
+        if collector and pattern_matches is not None:
+            collector.record("from_patterns", "phase", "match", 
+                             seconds=perf_counter() - start)
+        
+        # identical patterns are matched once, so they are timed once
+        timed = set()
+            
+        for index, row in patterns.iterrows(): 
+            if pattern_matches is None:
+                matches = get_matches(row["pattern"], file_path, 
+                                      exec_path=exec_path, engine=engine,
+                                      term_index=term_index)
+            else:
+                matches = pattern_matches[row["pattern"]]
+                
+            # matching in worker processes (n_jobs, executor) or in the 
+            # cache is not timed per pattern
+            if collector and row["pattern"] not in timed:
+                timed.add(row["pattern"])
+                python_seconds, subprocess_seconds = (
+                    after - previous for after, previous in 
+                    zip(cls._match_seconds(collector, row["pattern"]),
+                        before[row["pattern"]]))
+                if python_seconds or subprocess_seconds:
+                    collector.record("from_patterns", "pattern", index,
+                                     match_seconds=python_seconds + 
+                                     subprocess_seconds,
+                                     subprocess_seconds=subprocess_seconds,
+                                     python_seconds=python_seconds)
+                
+            yield index, row["label"], matches
+            
+    @staticmethod
+    def _check_batch(patterns, engine):
+        # raise ValueError unless some patterns are matched natively
+        if engine == "external":
+            raise ValueError('batching requires engine "auto" or "native"')
+        
+        for pattern in patterns:
+            try:
+                compile_pattern(pattern)
+                return
+            except UnsupportedPattern:
+                pass
+            
+        raise ValueError("none of the patterns can be batched, as they are "
+                         "not supported by the native matcher")
+            
+    @staticmethod
+    def _match_seconds(collector, text):
+        # seconds spent on matching a pattern in Python and in subprocesses
+        # (tregex.sh or a worker); see baleen.tregex.get_matches
+        return tuple(collector.get("tregex", "pattern", text, metric)
+                     for metric in ("native_seconds", "subprocess_seconds"))
+            
+    @classmethod
+    def _resolve_columns(cls, pattern_matches, nodes, tree_info, 
+                         spans=False):
+        # resolve the matches of all patterns together, returning a dict
+        # of columns
+        collector = active_collector()
+        names, labels, counts, pairs = [], [], [], []
+        
+        for index, label, matches in pattern_matches:
+            names.append(index)
+            labels.append(label)
+            counts.append(len(matches))
+            pairs.append(np.array(matches, dtype=np.int64).reshape(-1, 2))
+            if collector:
+                collector.record("from_patterns", "pattern", index, 
+                                 matches=len(matches))
+                
+        if collector:
+            start = perf_counter()
+            
+        pairs = (np.concatenate(pairs) if pairs 
+                 else np.empty((0, 2), dtype=np.int64))
+        abs_tree_ns, node_ns = pairs[:, 0], pairs[:, 1]
+        
+        # look up each tree only once
+        tree_ns, inverse = np.unique(abs_tree_ns, return_inverse=True)
+        if hasattr(tree_info, "lookup"):
+            rel_tree_ns, fnames = tree_info.lookup(tree_ns)
+        else:
+            info = [tree_info[tree_n] for tree_n in tree_ns.tolist()]
+            rel_tree_ns = np.array([rel_tree_n for rel_tree_n, _ in info],
+                                   dtype=np.int64)
+            fnames = np.array([fname for _, fname in info], dtype=object)
+            
+        columns = {"pat_name": np.repeat(np.array(names, dtype=object), 
+                                         counts),
+                   "label": np.repeat(np.array(labels, dtype=object), counts),
+                   "file": fnames[inverse],
+                   "rel_tree_n": rel_tree_ns[inverse],
+                   "node_n": node_ns}
+        
+        if spans:
+            columns["tree_id"] = abs_tree_ns
+            columns["start"], columns["end"] = nodes.get_spans(abs_tree_ns,
+                                                               node_ns)
+        else:
+            columns["subtree"], columns["substr"] = resolve_nodes(
+                nodes, abs_tree_ns, node_ns)
+        
+        if collector:
+            collector.record("from_patterns", "phase", "resolve", 
+                             seconds=perf_counter() - start)
+        return columns
+    
+    @classmethod
+    def _iter_records(cls, pattern_matches, nodes, tree_info):
+        # generate a record for each match 
+        collector = active_collector()
+        
+        for index, label, matches in pattern_matches:
+            if not collector:
+                yield from cls._resolve_matches(index, label, matches, nodes,
+                                                tree_info)
+                continue
+            
+            # record the number of matches and the time spent on looking up
+            # their nodes
+            start = perf_counter()
+            records = list(cls._resolve_matches(index, label, matches, nodes,
+                                                tree_info))
+            seconds = perf_counter() - start
+            collector.record("from_patterns", "pattern", index, 
+                             matches=len(records), resolve_seconds=seconds)
+            yield from records
+            
+    @classmethod
+    def _resolve_matches(cls, index, label, matches, nodes, tree_info):
+        pairs = np.array(matches, dtype=np.int64).reshape(-1, 2)
+        subtrees, substrings = resolve_nodes(nodes, pairs[:, 0], pairs[:, 1])
         
+        for (abs_tree_n, node_n), subtree, substring in zip(
+                matches, subtrees, substrings):  
+            rel_tree_n, fname = tree_info[abs_tree_n]
+            yield (index, 
+                   label, 
+                   fname,
+                   rel_tree_n, 
+                   node_n, 
+                   subtree, 
+                   substring)
+                
     @classmethod   
     def get_tree_info(cls, file_path):
         """
@@ -84,10 +303,166 @@ class Matches(pd.DataFrame):
             # relative tree number, restarting at 1 for every new file
             rel_tree_n = 0
             
-            for _ in open(fname):
+            # split lines like TreeIndex, so a lone \r is no line break
+            for _ in open(fname, newline="\n"):
                 abs_tree_n += 1
                 rel_tree_n += 1
                 tree_info[abs_tree_n] = rel_tree_n, base_fname
                 
         return tree_info
-    
\ No newline at end of file
+    
+
+def resolve_nodes(nodes, abs_tree_ns, node_ns):
+    """
+    Look up the subtrees and substrings of many matching nodes at once
+    
+    If nodes provides the bulk methods get_node_ids(abs_tree_ns, node_ns),
+    get_subtrees(node_ids) and get_substrings(node_ids), taking and 
+    returning arrays, all nodes are resolved with three calls. Otherwise 
+    the scalar methods get_node_id, get_subtree and get_substring are used
+    once per distinct node, even if it is matched by several patterns.
+    
+    Parameters
+    ----------
+    nodes: tredev.nodes.Nodes instance
+        nodes
+    abs_tree_ns: array-like of int
+        absolute tree numbers, counting from 1
+    node_ns: array-like of int
+        node numbers, counting from 1
+        
+    Returns
+    -------
+    subtrees: numpy.ndarray
+        subtrees (object array)
+    substrings: numpy.ndarray
+        substrings (object array)
+    """
+    abs_tree_ns = np.asarray(abs_tree_ns, dtype=np.int64)
+    node_ns = np.asarray(node_ns, dtype=np.int64)
+    
+    if hasattr(nodes, "get_node_ids"):
+        node_ids = nodes.get_node_ids(abs_tree_ns, node_ns)
+    else:
+        node_ids = _get_node_ids(nodes, abs_tree_ns, node_ns)
+        
+    if isinstance(node_ids, np.ndarray) and node_ids.dtype != object:
+        unique_ids, inverse = np.unique(node_ids, return_inverse=True)
+    else:
+        # e.g. tuples as node ids
+        positions = {}
+        inverse = np.array([positions.setdefault(node_id, len(positions))
+                            for node_id in node_ids], dtype=np.int64)
+        unique_ids = list(positions)
+        
+    if hasattr(nodes, "get_subtrees"):
+        subtrees = nodes.get_subtrees(unique_ids)
+        substrings = nodes.get_substrings(unique_ids)
+    else:
+        subtrees = [nodes.get_subtree(node_id) for node_id in unique_ids]
+        substrings = [nodes.get_substring(node_id) 
+                      for node_id in unique_ids]
+        
+    return (_as_objects(subtrees)[inverse], 
+            _as_objects(substrings)[inverse])
+
+
+def _get_node_ids(nodes, abs_tree_ns, node_ns):
+    # look up the id of each distinct (tree, node) pair once
+    pairs, inverse = np.unique(np.column_stack([abs_tree_ns, node_ns]), 
+                               axis=0, return_inverse=True)
+    node_ids = [nodes.get_node_id(abs_tree_n, node_n)
+                for abs_tree_n, node_n in pairs.tolist()]
+    
+    if all(isinstance(node_id, Integral) for node_id in node_ids):
+        return np.array(node_ids, dtype=np.int64)[inverse.ravel()]
+    return [node_ids[i] for i in inverse.ravel().tolist()]
+
+
+def _as_objects(values):
+    if isinstance(values, pd.Series):
+        values = values.values
+    array = np.empty(len(values), dtype=object)
+    array[:] = list(values)
+    return array
+
+
+def iter_matches(patterns, nodes, file_path, tree_info=None, 
+                 exec_path="tregex.sh", drop_duplicates=False, 
+                 engine="external", chunk_size=100000, term_index=None, 
+                 flush_patterns=False):
+    """
+    Generate the subtrees/substrings matching the given patterns in chunks
+    
+    Like Matches.from_patterns, but without ever holding all matches in 
+    memory. Patterns are matched one by one and duplicates are dropped 
+    incrementally. Concatenating the chunks gives the same table as 
+    Matches.from_patterns, including its index. Chunks can be written to 
+    disk or post-processed with the sinks in baleen.sinks.
+    
+    Parameters
+    ----------
+    patterns: tredev.patterns.Patterns instance
+        tree matching patterns
+    nodes: tredev.nodes.Nodes instance
+        nodes 
+    file_path: str
+        directory containing tree files
+    tree_info: dict or baleen.index.TreeIndex instance, optional
+        see Matches.from_patterns
+    exec_path: str, optional
+        path to tregex.sh executable
+    drop_duplicates: bool, opt
+        remove duplicate matches (i.e. with identical values for
+        label, file, tree number and node number)
+    engine: str, optional
+        matching engine: "external" (default), "auto" or "native";
+        see baleen.tregex.get_matches
+    chunk_size: int, optional
+        maximum number of matches per chunk
+    term_index: baleen.index.TermIndex instance, optional
+        see Matches.from_patterns
+    flush_patterns: bool, optional
+        also end a chunk after the last match of every pattern, so that 
+        consumers can start on a pattern's matches while the next pattern
+        is being matched
+    
+    Returns
+    -------
+    generator of pandas.DataFrame
+        chunks of matches in compact layout
+    """
+    if not tree_info:
+        tree_info = Matches.get_tree_info(file_path)
+        
+    pattern_matches = Matches._iter_pattern_matches(
+        patterns, file_path, exec_path=exec_path, engine=engine, batch=False,
+        term_index=term_index)
+    records = Matches._iter_records(pattern_matches, nodes, tree_info)
+    # (label, file, rel_tree_n, node_n) of matches seen so far
+    seen = set()
+    chunk, index = [], []
+    
+    for n, record in enumerate(records):
+        if flush_patterns and chunk and record[0] != chunk[-1][0]:
+            yield compact_matches(pd.DataFrame(chunk, index=index,
+                                               columns=Matches.fields))
+            chunk, index = [], []
+            
+        if drop_duplicates:
+            key = record[1:5]
+            if key in seen:
+                continue
+            seen.add(key)
+            
+        chunk.append(record)
+        index.append(n)
+        
+        if len(chunk) == chunk_size:
+            yield compact_matches(pd.DataFrame(chunk, index=index,
+                                               columns=Matches.fields))
+            chunk, index = [], []
+            
+    if chunk:
+        yield compact_matches(pd.DataFrame(chunk, index=index,
+                                           columns=Matches.fields))
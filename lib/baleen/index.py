@@ -0,0 +1,422 @@
+"""
+Persistent indices over a directory of tree files
+
+TreeIndex locates trees by absolute tree number, whereas TermIndex is an 
+inverted index from node labels to the trees containing them, used to 
+prefilter the trees a pattern is matched against.
+"""
+
+from glob import glob
+import json
+import os
+from os.path import join, basename, exists
+import re
+
+import numpy as np
+
+from baleen.pattern import (basic_category, compile_pattern, 
+                            UnsupportedPattern)
+from baleen.tree import Tree, token_re
+
+
+# opening bracket followed by a bracket, i.e. a node without label
+missing_label_re = re.compile(r"\(\s*[()]")
+
+
+class TreeIndex(object):
+    """
+    Index mapping absolute tree numbers to file, relative tree number and
+    byte offset
+
+    The index is stored in a directory next to the corpus (by default the
+    parse directory name plus ".idx") as NumPy arrays, which are memory
+    mapped when loaded, so lookups do not require loading the corpus or the
+    whole index. It is rebuilt only when tree files are added, removed or
+    changed in size or modification time.
+
+    A TreeIndex can be used in place of the dict returned by
+    Matches.get_tree_info: indexing with an absolute tree number (counting
+    from 1) returns the pair of relative tree number and filename.
+    """
+
+    def __init__(self, file_path, index_path, files, file_ids, rel_tree_ns,
+                 offsets):
+        self.file_path = file_path
+        self.index_path = index_path
+        # list of [filename, size, mtime_ns]
+        self.files = files
+        self.fnames = [fname for fname, _, _ in files]
+        self.file_ids = file_ids
+        self.rel_tree_ns = rel_tree_ns
+        self.offsets = offsets
+
+    @staticmethod
+    def default_index_path(file_path):
+        return os.path.normpath(file_path) + ".idx"
+
+    @staticmethod
+    def scan_files(file_path):
+        """
+        Return [filename, size, mtime_ns] for each tree file, in the same
+        order as Matches.get_tree_info
+        """
+        files = []
+        for fname in sorted(glob(join(file_path, "*"))):
+            stat = os.stat(fname)
+            files.append([basename(fname), stat.st_size, stat.st_mtime_ns])
+        return files
+
+    @classmethod
+    def open(cls, file_path, index_path=None):
+        """
+        Load the index for the tree files in directory file_path, building
+        it first if it is missing or out of date
+        """
+        index_path = index_path or cls.default_index_path(file_path)
+        files = cls.scan_files(file_path)
+
+        try:
+            index = cls.load(file_path, index_path)
+        except (IOError, OSError, ValueError):
+            pass
+        else:
+            if index.files == files:
+                return index
+
+        return cls.build(file_path, index_path, files)
+
+    @classmethod
+    def load(cls, file_path, index_path=None):
+        """
+        Load a previously built index without checking if it is up to date
+        """
+        index_path = index_path or cls.default_index_path(file_path)
+
+        with open(join(index_path, "files.json")) as inf:
+            files = json.load(inf)
+
+        arrays = [np.load(join(index_path, name + ".npy"), mmap_mode="r")
+                  for name in ("file_ids", "rel_tree_ns", "offsets")]
+        return cls(file_path, index_path, files, *arrays)
+
+    @classmethod
+    def build(cls, file_path, index_path=None, files=None):
+        """
+        Build and save the index for the tree files in directory file_path
+        """
+        index_path = index_path or cls.default_index_path(file_path)
+        files = files or cls.scan_files(file_path)
+        file_ids, rel_tree_ns, offsets = [], [], []
+
+        for file_id, (fname, _, _) in enumerate(files):
+            with open(join(file_path, fname), "rb") as inf:
+                data = np.frombuffer(inf.read(), dtype=np.uint8)
+            # every line is a tree, including a last line without newline
+            starts = np.flatnonzero(data == ord("\n")) + 1
+            starts = np.concatenate(([0], starts))
+            if starts[-1] == len(data):
+                starts = starts[:-1]
+            offsets.append(starts.astype(np.int64))
+            rel_tree_ns.append(np.arange(1, len(starts) + 1, dtype=np.int32))
+            file_ids.append(np.full(len(starts), file_id, dtype=np.int32))
+
+        arrays = {}
+        for name, parts, dtype in (("file_ids", file_ids, np.int32),
+                                   ("rel_tree_ns", rel_tree_ns, np.int32),
+                                   ("offsets", offsets, np.int64)):
+            arrays[name] = (np.concatenate(parts) if parts
+                            else np.empty(0, dtype=dtype))
+
+        os.makedirs(index_path, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(join(index_path, name + ".npy"), array)
+        # write file table last, so an interrupted build is rebuilt
+        with open(join(index_path, "files.json"), "w") as outf:
+            json.dump(files, outf)
+
+        return cls.load(file_path, index_path)
+
+    def __len__(self):
+        return len(self.file_ids)
+
+    def __contains__(self, abs_tree_n):
+        return 0 < abs_tree_n <= len(self)
+
+    def __iter__(self):
+        return iter(range(1, len(self) + 1))
+
+    def __getitem__(self, abs_tree_n):
+        if abs_tree_n not in self:
+            raise KeyError(abs_tree_n)
+        i = abs_tree_n - 1
+        return int(self.rel_tree_ns[i]), self.fnames[self.file_ids[i]]
+
+    def items(self):
+        for abs_tree_n in self:
+            yield abs_tree_n, self[abs_tree_n]
+
+    def lookup(self, abs_tree_ns):
+        """
+        Vectorized lookup of relative tree numbers and filenames
+
+        Parameters
+        ----------
+        abs_tree_ns: array-like of int
+            absolute tree numbers
+
+        Returns
+        -------
+        rel_tree_ns: numpy.ndarray
+            relative tree numbers
+        fnames: numpy.ndarray
+            filenames (object array)
+        """
+        i = np.asarray(abs_tree_ns, dtype=np.int64) - 1
+        fnames = np.array(self.fnames, dtype=object)
+        return (np.asarray(self.rel_tree_ns[i]),
+                fnames[np.asarray(self.file_ids[i])])
+
+    def get_tree(self, abs_tree_n, encoding="utf-8", parse=False):
+        """
+        Read a single tree as labeled bracket string, without reading the
+        rest of the corpus, or as baleen.tree.Tree instance if parse is True
+        """
+        if abs_tree_n not in self:
+            raise KeyError(abs_tree_n)
+        i = abs_tree_n - 1
+        fname = join(self.file_path, self.fnames[self.file_ids[i]])
+
+        with open(fname, "rb") as inf:
+            inf.seek(int(self.offsets[i]))
+            lbs = inf.readline().decode(encoding).rstrip("\r\n")
+
+        return Tree.from_string(lbs) if parse else lbs
+
+
+class TermIndex(object):
+    """
+    Inverted index mapping node labels to the absolute numbers of the trees 
+    containing them
+    
+    As in Tregex, words are node labels too, so the index covers both words
+    (e.g. "increase") and syntactic categories (e.g. "NN" or "NP"). The 
+    index is stored in a directory next to the corpus (by default the parse
+    directory name plus ".terms") as a sorted list of labels and NumPy 
+    arrays holding the sorted tree numbers of each label one after another,
+    which are memory mapped when loaded. Like TreeIndex, it is rebuilt only
+    when tree files are added, removed or changed.
+    
+    Use candidates to obtain the trees that can possibly match a pattern:
+    a tree can only match if, for every node description required by the 
+    pattern (see baleen.pattern.Pattern.requirements), it contains a label
+    matching that description. Exact labels are looked up directly, 
+    regular expressions and basic categories are evaluated against all 
+    labels in the index.
+    """
+    
+    def __init__(self, file_path, index_path, files, n_trees, terms, 
+                 offsets, tree_ns):
+        self.file_path = file_path
+        self.index_path = index_path
+        # list of [filename, size, mtime_ns]
+        self.files = files
+        self.n_trees = n_trees
+        self.terms = terms
+        self.term_ids = dict((term, i) for i, term in enumerate(terms))
+        # tree numbers of term i are tree_ns[offsets[i]:offsets[i + 1]]
+        self.offsets = offsets
+        self.tree_ns = tree_ns
+        # pattern text -> candidates
+        self._candidates = {}
+        
+    @staticmethod
+    def default_index_path(file_path):
+        return os.path.normpath(file_path) + ".terms"
+    
+    @classmethod
+    def open(cls, file_path, index_path=None):
+        """
+        Load the index for the tree files in directory file_path, building
+        it first if it is missing or out of date
+        """
+        index_path = index_path or cls.default_index_path(file_path)
+        files = TreeIndex.scan_files(file_path)
+        
+        try:
+            index = cls.load(file_path, index_path)
+        except (IOError, OSError, ValueError):
+            pass
+        else:
+            if index.files == files:
+                return index
+            
+        return cls.build(file_path, index_path, files)
+    
+    @classmethod
+    def load(cls, file_path, index_path=None):
+        """
+        Load a previously built index without checking if it is up to date
+        """
+        index_path = index_path or cls.default_index_path(file_path)
+        
+        with open(join(index_path, "files.json")) as inf:
+            info = json.load(inf)
+        with open(join(index_path, "terms.json"), encoding="utf-8") as inf:
+            terms = json.load(inf)
+            
+        arrays = [np.load(join(index_path, name + ".npy"), mmap_mode="r")
+                  for name in ("offsets", "tree_ns")]
+        return cls(file_path, index_path, info["files"], info["n_trees"],
+                   terms, *arrays)
+    
+    @classmethod
+    def build(cls, file_path, index_path=None, files=None, 
+              encoding="utf-8"):
+        """
+        Build and save the index for the tree files in directory file_path
+        """
+        index_path = index_path or cls.default_index_path(file_path)
+        files = files or TreeIndex.scan_files(file_path)
+        # term -> absolute tree numbers, in increasing order
+        postings = {}
+        abs_tree_n = 0
+        
+        for fname, _, _ in files:
+            with open(join(file_path, fname), encoding=encoding, 
+                      newline="\n") as inf:
+                for line in inf:
+                    abs_tree_n += 1
+                    terms = set(token_re.findall(line))
+                    terms.discard("(")
+                    terms.discard(")")
+                    if missing_label_re.search(line):
+                        terms.add("")
+                    for term in terms:
+                        try:
+                            postings[term].append(abs_tree_n)
+                        except KeyError:
+                            postings[term] = [abs_tree_n]
+                            
+        terms = sorted(postings)
+        counts = [len(postings[term]) for term in terms]
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        tree_ns = np.fromiter((tree_n for term in terms 
+                               for tree_n in postings[term]),
+                              dtype=np.int32, count=offsets[-1])
+        
+        os.makedirs(index_path, exist_ok=True)
+        np.save(join(index_path, "offsets.npy"), offsets)
+        np.save(join(index_path, "tree_ns.npy"), tree_ns)
+        with open(join(index_path, "terms.json"), "w", 
+                  encoding="utf-8") as outf:
+            json.dump(terms, outf)
+        # write file table last, so an interrupted build is rebuilt
+        with open(join(index_path, "files.json"), "w") as outf:
+            json.dump({"files": files, "n_trees": abs_tree_n}, outf)
+            
+        return cls.load(file_path, index_path)
+    
+    def __len__(self):
+        return len(self.terms)
+    
+    def __contains__(self, term):
+        return term in self.term_ids
+    
+    def get_trees(self, term):
+        """
+        Return sorted array of the absolute numbers of the trees containing
+        a node labeled term
+        """
+        try:
+            i = self.term_ids[term]
+        except KeyError:
+            return np.empty(0, dtype=np.int32)
+        return np.asarray(self.tree_ns[self.offsets[i]:self.offsets[i + 1]])
+    
+    def find_terms(self, node):
+        """
+        Return the labels in the index matching a node description 
+        (baleen.pattern.Node instance), ignoring its negation
+        """
+        found = [label for label in node.labels if label in self.term_ids]
+        
+        if node.basic:
+            # any label starting with the category, which includes the
+            # labels whose basic category it is (e.g. NP-SBJ for @NP)
+            for category in node.labels:
+                found.extend(term for term in self.terms 
+                             if term.startswith(category))
+                
+        for regex in node.regexes:
+            if node.basic:
+                found.extend(term for term in self.terms 
+                             if regex.search(term) or 
+                             regex.search(basic_category(term)))
+            else:
+                found.extend(term for term in self.terms 
+                             if regex.search(term))
+            
+        return found
+    
+    def candidates(self, pattern):
+        """
+        Return the trees which can possibly match a Tregex pattern
+        
+        Parameters
+        ----------
+        pattern: str
+            Tregex pattern
+        
+        Returns
+        -------
+        numpy.ndarray or None
+            sorted absolute tree numbers of the candidate trees, or None 
+            if the pattern requires no labels or is not supported by 
+            baleen.pattern, so that all trees are candidates
+        """
+        try:
+            return self._candidates[pattern]
+        except KeyError:
+            pass
+        
+        try:
+            requirement = compile_pattern(pattern).requirements()
+        except UnsupportedPattern:
+            requirement = None
+            
+        candidates = self._candidates[pattern] = self._evaluate(requirement)
+        return candidates
+    
+    def _evaluate(self, requirement):
+        # sorted tree numbers satisfying the requirement, None for all 
+        if requirement is None:
+            return None
+        
+        kind, arg = requirement
+        
+        if kind == "node":
+            arrays = [self.get_trees(term) for term in self.find_terms(arg)]
+            if not arrays:
+                return np.empty(0, dtype=np.int32)
+            if len(arrays) == 1:
+                return arrays[0]
+            return np.unique(np.concatenate(arrays))
+        
+        arrays = [self._evaluate(part) for part in arg]
+        
+        if kind == "or":
+            if any(array is None for array in arrays):
+                return None
+            return np.unique(np.concatenate(arrays))
+        
+        arrays = sorted((array for array in arrays if array is not None), 
+                        key=len)
+        if not arrays:
+            return None
+        result = arrays[0]
+        for array in arrays[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, array, assume_unique=True)
+        return result
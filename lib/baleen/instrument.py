@@ -0,0 +1,152 @@
+"""
+Instrumentation of pipeline stages
+
+A Collector records timings and counts per stage, e.g. per pattern in
+Matches.from_patterns, per rule and chain of rules in post_process and per
+phase and transformation in transform_matches. Use a collector as a context
+manager to make it the active collector; while none is active, instrumented
+code only checks for an active collector and skips all measurements.
+
+    with Collector() as collector:
+        matches = Matches.from_patterns(td.patterns, td.nodes, parse_dir)
+        post_process(matches, "post_proc_rules")
+
+    collector.to_json("metrics.json")
+    print(collector.to_prometheus())
+
+Metrics are keyed by stage, kind (e.g. "pattern", "rule", "phase") and
+name. Values of the same metric for the same key are summed. Metrics ending
+in "_seconds" are wall times, others are counts.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+import json
+import re
+from time import perf_counter
+
+
+# stack of active collectors, innermost last
+_active = []
+
+
+def active_collector():
+    """
+    Return the innermost active collector or None
+    """
+    if _active:
+        return _active[-1]
+
+
+def timer(stage, kind, name, metric="seconds", **values):
+    """
+    Return the timer of the active collector (see Collector.timer), or a
+    context manager doing nothing if no collector is active
+    """
+    collector = active_collector()
+    if collector:
+        return collector.timer(stage, kind, name, metric, **values)
+    return nullcontext()
+
+
+class Collector(object):
+    """
+    Collector of timings and counts
+
+    Parameters
+    ----------
+    callback: callable, optional
+        function called as callback(stage, kind, name, values) for every
+        recorded dict of values, e.g. to log or forward metrics as they come
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        # (stage, kind, name) -> {metric: value}
+        self.metrics = OrderedDict()
+
+    def __enter__(self):
+        _active.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _active.remove(self)
+
+    def record(self, stage, kind, name, **values):
+        """
+        Add values to the metrics of stage, kind and name
+        """
+        metrics = self.metrics.setdefault((stage, kind, str(name)), {})
+        for metric, value in values.items():
+            metrics[metric] = metrics.get(metric, 0) + value
+        if self.callback:
+            self.callback(stage, kind, name, values)
+
+    @contextmanager
+    def timer(self, stage, kind, name, metric="seconds", **values):
+        """
+        Context manager recording the wall time of its block as metric,
+        together with any other values
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            values[metric] = perf_counter() - start
+            self.record(stage, kind, name, **values)
+
+    def get(self, stage, kind, name, metric, default=0):
+        """
+        Return the current value of a metric
+        """
+        return self.metrics.get((stage, kind, str(name)), {}).get(metric,
+                                                                  default)
+
+    def clear(self):
+        self.metrics.clear()
+
+    def to_records(self):
+        """
+        Return metrics as list of dicts with keys stage, kind, name and the
+        names of metrics
+        """
+        return [dict(values, stage=stage, kind=kind, name=name)
+                for (stage, kind, name), values in self.metrics.items()]
+
+    def to_json(self, fname=None, indent=2):
+        """
+        Return metrics as JSON string, or write them to file fname
+        """
+        text = json.dumps(self.to_records(), indent=indent)
+        if fname:
+            with open(fname, "w") as outf:
+                outf.write(text)
+        return text
+
+    def to_prometheus(self, prefix="baleen"):
+        """
+        Return metrics in the Prometheus text exposition format
+        """
+        # metric -> lines
+        samples = OrderedDict()
+
+        for (stage, kind, name), values in self.metrics.items():
+            labels = ",".join('{}="{}"'.format(label, _escape_label(value))
+                              for label, value in (("stage", stage),
+                                                   ("kind", kind),
+                                                   ("name", name)))
+            for metric, value in values.items():
+                metric = "{}_{}".format(prefix, re.sub(r"\W", "_", metric))
+                samples.setdefault(metric, []).append(
+                    "{}{{{}}} {!r}".format(metric, labels, float(value)))
+
+        lines = []
+        for metric, metric_samples in samples.items():
+            lines.append("# TYPE {} gauge".format(metric))
+            lines.extend(metric_samples)
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value):
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
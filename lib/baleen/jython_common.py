@@ -0,0 +1,139 @@
+"""
+Code shared by the Jython scripts server.py and trans/transform.py
+
+Requests and responses are single lines of tab-separated fields, where
+backslash, tab and newline characters within a field are escaped. See
+baleen.worker for the Python 3 side.
+
+Requires:
+- Jython 2.5 or 2.7 from http://www.jython.org/
+"""
+
+from collections import namedtuple
+from glob import glob
+from os.path import join
+
+
+ENCODING = "utf-8"
+
+# Default budget for the derivation of trees from a single original tree:
+# maximum number of transformation steps and maximum number of derived trees
+MAX_DEPTH = 10
+MAX_DERIVED = 100
+
+
+Tuple = namedtuple("Tuple", ["ancestor",   # index of ancestor match
+                             "name",       # name of transformation
+                             "subtree"     # subtree
+                             ])
+
+
+def tree_files(file_path):
+    """
+    Return the paths of the tree files in directory file_path, in the same
+    order as baleen.extract.Matches.get_tree_info, which skips hidden files
+    """
+    return sorted(glob(join(file_path, "*")))
+
+
+def escape(field):
+    return (field.replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n"))
+
+
+def unescape(field):
+    parts = field.split("\\\\")
+    return "\\".join(p.replace("\\t", "\t").replace("\\n", "\n")
+                     for p in parts)
+
+
+def read_fields(inf):
+    line = inf.readline()
+    if not line:
+        return None
+    line = unicode(line.rstrip("\n"), ENCODING)
+    return [unescape(field) for field in line.split("\t")]
+
+
+def write_fields(outf, *fields):
+    line = "\t".join(escape(unicode(field)) for field in fields)
+    outf.write(line.encode(ENCODING) + "\n")
+
+
+def apply_transforms(transforms, tuples, key, max_depth=MAX_DEPTH,
+                     max_derived=MAX_DERIVED):
+    """
+    Apply transformations to tuples until no new trees are derived
+
+    Transformations are applied exhaustively using a worklist: each
+    transformation is applied to the trees which are new since it last
+    ran, until no transformation yields new trees (fixpoint) or the budget
+    is exhausted. Trees derived from the same original tree are
+    deduplicated by key, so a tree reached through different paths is kept
+    only once, with the ancestor through which it was first reached.
+
+    Parameters
+    ----------
+    transforms: list of (name, function) pairs
+        function(tuples, indices) generates (ancestor index, derived tree)
+        for the tuples among indices which are changed by the
+        transformation
+    tuples: OrderedDict
+        index -> Tuple; derived tuples are added, numbered from the
+        highest index
+    key: function
+        returns the canonical string of a tree
+    max_depth: int
+        maximum number of transformation steps from an original tree
+    max_derived: int
+        maximum number of trees derived from an original tree
+    """
+    if not tuples:
+        return
+
+    max_index = max(tuples.keys())
+    # index of original tuple and number of transformation steps
+    origins = {}
+    depths = {}
+    # original index -> canonical strings of original and derived trees
+    families = {}
+
+    for index, tup in tuples.items():
+        if tup.ancestor is None:
+            origins[index] = index
+            depths[index] = 0
+            families[index] = set()
+        else:
+            origins[index] = origins[tup.ancestor]
+            depths[index] = depths[tup.ancestor] + 1
+        families[origins[index]].add(key(tup.subtree))
+
+    # per transformation, indices of tuples it has not seen yet
+    pending = [list(tuples.keys()) for _ in transforms]
+
+    while True:
+        for k, (name, transform) in enumerate(transforms):
+            indices = [index for index in pending[k]
+                       if depths[index] < max_depth]
+            pending[k] = []
+
+            for ancestor_index, trans_tree in transform(tuples, indices):
+                origin = origins[ancestor_index]
+                family = families[origin]
+                tree_key = key(trans_tree)
+
+                # the family includes the original tree itself
+                if tree_key in family or len(family) > max_derived:
+                    continue
+
+                family.add(tree_key)
+                max_index += 1
+                tuples[max_index] = Tuple(ancestor_index, name, trans_tree)
+                origins[max_index] = origin
+                depths[max_index] = depths[ancestor_index] + 1
+
+                for queue in pending:
+                    queue.append(max_index)
+
+        if not [queue for queue in pending if queue]:
+            break
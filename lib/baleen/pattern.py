@@ -0,0 +1,763 @@
+"""
+Native matching of tree patterns
+
+A pure Python implementation of a subset of the Tregex pattern language,
+matching against parsed trees in memory (see baleen.tree) instead of calling
+tregex.sh. The supported subset is:
+
+- node descriptions: labels (NP), label disjunction (VBN|VBD|VBG), regular
+  expressions (/.ncreas.*/, matched with re.search like Tregex does),
+  quoted labels ("-LRB-"), any node (__), basic categories (@NP) and
+  negated descriptions (!NP), optionally followed by a name (=n1)
+- dominance relations: < > << >> <, <- <: >, >- >: <N <-N >N >-N
+  <<, <<- >>, >>-
+- sister relations: $ $++ $.. $-- $,, $+ $. $- $,
+- precedence relations: .. . ,, ,
+- identity: ==
+- negated (!) and optional (?) relations, explicit conjunction (&),
+  disjunction of relations between square brackets ([< A | < B]) and
+  grouping of node descriptions with their relations between parentheses
+
+Anything else - e.g. backreferences (~n1), reuse of node names, variable
+groups, headship relations or segmented patterns - raises
+UnsupportedPattern, so callers can fall back to tregex.sh.
+
+As with tregex.sh without option -o, a node is reported once for every
+distinct way in which the pattern matches at that node.
+"""
+
+import re
+from time import perf_counter
+
+from baleen.instrument import active_collector
+from baleen.tree import as_tree
+
+
+class UnsupportedPattern(ValueError):
+    """
+    Raised for patterns outside the natively supported subset of Tregex
+    """
+
+
+#==============================================================================
+# Parsing
+#==============================================================================
+
+# relations, longest first
+relation_re = re.compile(r"<<,|<<-|<<:|>>,|>>-|>>:|"
+                         r"\$\+\+|\$--|\$\.\.|\$,,|\$\+|\$-|\$\.|\$,|"
+                         r"[<>]-?\d+|<,|<-|<:|>,|>-|>:|<<|>>|"
+                         r"\.\.|,,|==|<|>|\$|\.|,")
+
+# characters which can not occur in an unquoted Tregex identifier
+identifier_re = re.compile(r"[^\s()/|@!#%&=?\[\]<>~.,$:;\"]+")
+
+regex_re = re.compile(r"/((?:[^/\\]|\\.)*)/")
+
+quoted_re = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+
+class Node(object):
+    """
+    Node description with its relations
+    """
+
+    __slots__ = ("labels", "regexes", "any", "negated", "basic", "name",
+                 "relations", "_key")
+
+    def __init__(self):
+        self.labels = set()
+        self.regexes = []
+        self.any = False
+        self.negated = False
+        self.basic = False
+        self.name = None
+        # conjunction of Relation, Disjunction instances
+        self.relations = []
+        self._key = None
+
+    def label_key(self):
+        """
+        Canonical key of this node description without its relations
+        """
+        return (tuple(sorted(self.labels)), 
+                tuple(r.pattern for r in self.regexes), self.any,
+                self.negated, self.basic)
+
+    def key(self):
+        """
+        Canonical key of this node description including its relations,
+        which is equal for equal sub-expressions of different patterns
+        """
+        if self._key is None:
+            self._key = ("node", self.label_key(), self.name,
+                         tuple(r.key() for r in self.relations))
+        return self._key
+
+
+class Relation(object):
+    """
+    Relation between the current node and a target node description
+    """
+
+    __slots__ = ("op", "target", "negated", "optional")
+
+    def __init__(self, op, target, negated=False, optional=False):
+        self.op = op
+        self.target = target
+        self.negated = negated
+        self.optional = optional
+
+    def key(self):
+        return ("rel", self.op, self.negated, self.optional,
+                self.target.key())
+
+
+class Disjunction(object):
+    """
+    Disjunction of conjunctions of relations
+    """
+
+    __slots__ = ("alternatives", "negated", "optional")
+
+    def __init__(self, alternatives, negated=False, optional=False):
+        self.alternatives = alternatives
+        self.negated = negated
+        self.optional = optional
+
+    def key(self):
+        return ("or", self.negated, self.optional,
+                tuple(tuple(r.key() for r in conj)
+                      for conj in self.alternatives))
+
+
+class Parser(object):
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        self.names = set()
+
+    def error(self, message):
+        raise UnsupportedPattern("{} at position {} in pattern {!r}".format(
+            message, self.pos, self.text))
+
+    def skip(self):
+        while self.pos < len(self.text) and self.text[self.pos].isspace():
+            self.pos += 1
+
+    def peek(self):
+        self.skip()
+        return self.text[self.pos:self.pos + 1]
+
+    def take(self, char):
+        if self.peek() == char:
+            self.pos += 1
+            return True
+        return False
+
+    def parse(self):
+        node = self.node_with_relations()
+        if self.peek():
+            self.error("unexpected input")
+        return node
+
+    def node_with_relations(self):
+        if self.take("("):
+            node = self.node_with_relations()
+            if not self.take(")"):
+                self.error("missing closing bracket")
+        else:
+            node = self.node()
+        node.relations.extend(self.relations())
+        return node
+
+    def node(self):
+        node = Node()
+        node.negated = self.take("!")
+        node.basic = self.take("@")
+        self.label(node)
+
+        # label disjunction, unless "|" separates relations
+        while self.peek() == "|" and not self.is_relation(self.pos + 1):
+            self.pos += 1
+            self.label(node)
+
+        if self.take("="):
+            match = identifier_re.match(self.text, self.pos)
+            if not match:
+                self.error("missing node name")
+            if match.group() in self.names:
+                self.error("reuse of node names is not supported")
+            node.name = match.group()
+            self.names.add(node.name)
+            self.pos = match.end()
+
+        if self.peek() in ("~", "#", ":", ";", "%"):
+            self.error("unsupported syntax")
+
+        return node
+
+    def label(self, node):
+        self.skip()
+
+        if self.text.startswith("__", self.pos):
+            node.any = True
+            self.pos += 2
+            return
+
+        for pattern, kind in ((regex_re, "regex"), (quoted_re, "quoted"),
+                              (identifier_re, "label")):
+            match = pattern.match(self.text, self.pos)
+            if match:
+                self.pos = match.end()
+                if kind == "regex":
+                    node.regexes.append(re.compile(match.group(1)))
+                elif kind == "quoted":
+                    node.labels.add(re.sub(r"\\(.)", r"\1", match.group(1)))
+                else:
+                    node.labels.add(match.group())
+                return
+
+        self.error("missing node description")
+
+    def is_relation(self, pos):
+        while pos < len(self.text) and self.text[pos].isspace():
+            pos += 1
+        return bool(relation_re.match(self.text, pos) or
+                    self.text[pos:pos + 1] in ("!", "?", "["))
+
+    def relations(self):
+        relations = []
+
+        while True:
+            self.take("&")
+            if not self.is_relation(self.pos):
+                return relations
+
+            negated = self.take("!")
+            optional = self.take("?")
+
+            if self.take("["):
+                alternatives = [self.relations()]
+                while self.take("|"):
+                    alternatives.append(self.relations())
+                if not self.take("]"):
+                    self.error("missing closing square bracket")
+                relations.append(Disjunction(alternatives, negated, optional))
+            else:
+                self.skip()
+                match = relation_re.match(self.text, self.pos)
+                if not match:
+                    self.error("unsupported relation")
+                self.pos = match.end()
+                if self.take("("):
+                    # relations after the closing bracket belong to the
+                    # node on the left, as in "S < (NP < DT) < VP"
+                    target = self.node_with_relations()
+                    if not self.take(")"):
+                        self.error("missing closing bracket")
+                else:
+                    target = self.node()
+                relations.append(Relation(match.group(), target, negated,
+                                          optional))
+
+
+#==============================================================================
+# Matching
+#==============================================================================
+
+
+def basic_category(label):
+    # as Tregex, strip functional tags, but keep labels like -LRB-
+    category = re.split(r"[-=]", label, 1)[0]
+    return category or label
+
+
+def targets(op, tree, i):
+    """
+    Generate positions of nodes standing in relation op to node i
+    """
+    parents, children = tree.parents, tree.children
+
+    if op == "<":
+        yield from children[i]
+    elif op == ">":
+        if parents[i] >= 0:
+            yield parents[i]
+    elif op == "<<":
+        yield from range(i + 1, tree.ends[i] + 1)
+    elif op == ">>":
+        j = parents[i]
+        while j >= 0:
+            yield j
+            j = parents[j]
+    elif op == "<,":
+        if children[i]:
+            yield children[i][0]
+    elif op == "<-":
+        if children[i]:
+            yield children[i][-1]
+    elif op == "<:":
+        if len(children[i]) == 1:
+            yield children[i][0]
+    elif op in (">,", ">-", ">:"):
+        j = parents[i]
+        if j >= 0 and (op == ">," and children[j][0] == i or
+                       op == ">-" and children[j][-1] == i or
+                       op == ">:" and len(children[j]) == 1):
+            yield j
+    elif op[0] == "<" and op[1:].lstrip("-").isdigit():
+        n = int(op[1:])
+        kids = children[i]
+        if 0 < n <= len(kids):
+            yield kids[n - 1]
+        elif 0 < -n <= len(kids):
+            yield kids[n]
+    elif op[0] == ">" and op[1:].lstrip("-").isdigit():
+        n = int(op[1:])
+        j = parents[i]
+        if j >= 0:
+            kids = children[j]
+            if (0 < n <= len(kids) and kids[n - 1] == i or
+                    0 < -n <= len(kids) and kids[n] == i):
+                yield j
+    elif op in ("<<,", "<<-", "<<:"):
+        j = i
+        while children[j] and (op != "<<:" or len(children[j]) == 1):
+            j = children[j][-1 if op == "<<-" else 0]
+            yield j
+    elif op in (">>,", ">>-", ">>:"):
+        j = i
+        while parents[j] >= 0:
+            kids = children[parents[j]]
+            if (op == ">>," and kids[0] != j or
+                    op == ">>-" and kids[-1] != j or
+                    op == ">>:" and len(kids) != 1):
+                break
+            j = parents[j]
+            yield j
+    elif op[0] == "$":
+        j = parents[i]
+        if j < 0:
+            return
+        kids = children[j]
+        k = kids.index(i)
+        if op == "$":
+            yield from kids[:k]
+            yield from kids[k + 1:]
+        elif op in ("$++", "$.."):
+            yield from kids[k + 1:]
+        elif op in ("$--", "$,,"):
+            yield from kids[:k]
+        elif op in ("$+", "$."):
+            if k + 1 < len(kids):
+                yield kids[k + 1]
+        elif op in ("$-", "$,"):
+            if k > 0:
+                yield kids[k - 1]
+    elif op == "..":
+        right = tree.rights[i]
+        for j in range(len(tree)):
+            if tree.lefts[j] > right:
+                yield j
+    elif op == ".":
+        right = tree.rights[i]
+        for j in range(len(tree)):
+            if tree.lefts[j] == right + 1:
+                yield j
+    elif op == ",,":
+        left = tree.lefts[i]
+        for j in range(len(tree)):
+            if tree.rights[j] < left:
+                yield j
+    elif op == ",":
+        left = tree.lefts[i]
+        for j in range(len(tree)):
+            if tree.rights[j] + 1 == left:
+                yield j
+    elif op == "==":
+        yield i
+    else:
+        raise UnsupportedPattern("unsupported relation " + op)
+
+
+def label_matches(node, label):
+    if node.any:
+        matched = True
+    else:
+        if node.basic:
+            label = basic_category(label)
+        matched = label in node.labels or any(regex.search(label)
+                                              for regex in node.regexes)
+    return matched != node.negated
+
+
+class Memo(object):
+    """
+    Bindings of shared sub-expressions at the positions of a single tree
+
+    Parameters
+    ----------
+    ids: dict
+        mapping the id() of each shared Node instance to the number of its
+        sub-expression, which is equal for equal sub-expressions of 
+        different patterns
+    """
+
+    __slots__ = ("ids", "found")
+
+    def __init__(self, ids):
+        self.ids = ids
+        # (sub-expression number, position) -> list of bindings
+        self.found = {}
+
+
+def match_node(node, tree, i, env, memo=None):
+    """
+    Generate a binding of node names for every way node matches tree at
+    position i
+
+    If memo is a Memo instance, the bindings of the shared sub-expressions 
+    it numbers are stored in it, so that they are matched only once per 
+    tree and position.
+    """
+    k = memo.ids.get(id(node)) if memo is not None else None
+    if k is None:
+        yield from _match_node(node, tree, i, env, memo)
+        return
+
+    # without backreferences, bindings never depend on the incoming env
+    found = memo.found.get((k, i))
+    if found is None:
+        found = memo.found[k, i] = list(_match_node(node, tree, i, {}, memo))
+
+    for new_env in found:
+        if new_env:
+            new_env = dict(env, **new_env)
+        else:
+            new_env = env
+        yield new_env
+
+
+def _match_node(node, tree, i, env, memo):
+    if label_matches(node, tree.labels[i]):
+        if node.name:
+            env = dict(env)
+            env[node.name] = i
+        yield from match_conjunction(node.relations, tree, i, env, memo)
+
+
+def match_conjunction(relations, tree, i, env, memo=None):
+    if not relations:
+        yield env
+        return
+
+    first, rest = relations[0], relations[1:]
+
+    for first_env in match_relation(first, tree, i, env, memo):
+        yield from match_conjunction(rest, tree, i, first_env, memo)
+
+
+def match_relation(relation, tree, i, env, memo=None):
+    if isinstance(relation, Disjunction):
+        found = (new_env
+                 for conj in relation.alternatives
+                 for new_env in match_conjunction(conj, tree, i, env, memo))
+    else:
+        found = (new_env
+                 for j in targets(relation.op, tree, i)
+                 for new_env in match_node(relation.target, tree, j, env,
+                                           memo))
+
+    if relation.negated:
+        # names under negation are not bound
+        if next(found, None) is None:
+            yield env
+    elif relation.optional:
+        any_found = False
+        for new_env in found:
+            any_found = True
+            yield new_env
+        if not any_found:
+            yield env
+    else:
+        yield from found
+
+
+class Pattern(object):
+    """
+    Compiled tree pattern
+
+    Parameters
+    ----------
+    text: str
+        Tregex pattern
+
+    Raises
+    ------
+    UnsupportedPattern
+        if the pattern is outside the supported subset
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.root = Parser(text).parse()
+
+    def requirements(self):
+        """
+        Return the node descriptions a tree must contain to match
+        
+        Every non-negated, non-optional relation requires a node matching 
+        its target, so a tree can only match if it has nodes matching all
+        these descriptions. Negated descriptions (!NP) and any node (__) 
+        require nothing.
+        
+        Returns
+        -------
+        tuple or None
+            requirement as nested tuples ("and", [requirements]), 
+            ("or", [requirements]) or ("node", Node instance), or None if 
+            every tree may match
+        """
+        return _node_requirement(self.root)
+
+    def finditer(self, tree, memo=None, root_labels=None):
+        """
+        Generate (position, bindings) for every match in tree, where bindings
+        maps node names to positions; see match_node on memo
+        
+        root_labels is a dict caching for each label whether it matches the
+        root node description, which can be shared between trees and 
+        between patterns with the same root node description (see 
+        Node.label_key).
+        """
+        root = self.root
+        if root_labels is None:
+            root_labels = {}
+        
+        for i, label in enumerate(tree.labels):
+            matched = root_labels.get(label)
+            if matched is None:
+                matched = root_labels[label] = label_matches(root, label)
+            if matched:
+                for env in match_node(root, tree, i, {}, memo):
+                    yield i, env
+
+    def get_matches(self, trees, unique=False, candidates=None):
+        """
+        Match pattern against trees
+
+        Parameters
+        ----------
+        trees: list of baleen.tree.Tree instances or str
+            trees in order of absolute tree number
+        unique: bool, optional
+            report each matching node only once, like tregex.sh -o
+        candidates: collection of int, optional
+            numbers of the trees to match (counting from 1); other trees
+            are skipped
+
+        Returns
+        -------
+        list of (int, int) tuples
+            absolute tree number and node number of each match, both
+            counting from 1
+        """
+        if candidates is not None:
+            candidates = {self.text: candidates}
+        return PatternSet([self]).get_matches(trees, unique, 
+                                              candidates)[self.text]
+
+
+def _node_requirement(node):
+    parts = []
+    if not (node.any or node.negated):
+        parts.append(("node", node))
+    for relation in node.relations:
+        requirement = _relation_requirement(relation)
+        if requirement:
+            parts.append(requirement)
+    if parts:
+        return parts[0] if len(parts) == 1 else ("and", parts)
+
+
+def _relation_requirement(relation):
+    if relation.negated or relation.optional:
+        return None
+    if isinstance(relation, Relation):
+        return _node_requirement(relation.target)
+
+    alternatives = []
+    for conj in relation.alternatives:
+        parts = [_relation_requirement(r) for r in conj]
+        parts = [part for part in parts if part]
+        if not parts:
+            # this alternative is always satisfiable
+            return None
+        alternatives.append(parts[0] if len(parts) == 1 else ("and", parts))
+    return ("or", alternatives)
+
+
+class PatternSet(object):
+    """
+    Set of compiled tree patterns, matched in a single pass over the trees
+
+    All patterns are evaluated on each tree in turn, and the matches of
+    sub-expressions they have in common are computed only once per tree.
+    Only sub-expressions with relations occurring in more than one place 
+    are memoized, as storing other matches costs more than it saves.
+
+    Parameters
+    ----------
+    patterns: iterable of str or Pattern instances
+        Tregex patterns
+
+    Raises
+    ------
+    UnsupportedPattern
+        if any pattern is outside the supported subset
+    """
+
+    def __init__(self, patterns):
+        self.patterns = [pattern if isinstance(pattern, Pattern)
+                         else compile_pattern(pattern)
+                         for pattern in patterns]
+        self.shared_ids = self._number_shared()
+
+    def _number_shared(self):
+        # number the sub-expressions occurring more than once, mapping the id() of each of their Node instances to 
+        # the number
+        nodes = {}
+        for pattern in dict((p.text, p) for p in self.patterns).values():
+            stack = [pattern.root]
+            while stack:
+                item = stack.pop()
+                if isinstance(item, Node):
+                    # matching a node without relations is a mere label 
+                    # check, which is cheaper than a memo lookup
+                    if item.relations:
+                        nodes.setdefault(item.key(), []).append(item)
+                    stack.extend(item.relations)
+                elif isinstance(item, Relation):
+                    stack.append(item.target)
+                else:
+                    stack.extend(r for conj in item.alternatives for r in conj)
+                    
+
+        ids = {}
+        for k, same in enumerate(same for same in nodes.values() 
+                                 if len(same) > 1):
+            for node in same:
+                ids[id(node)] = k
+        return ids
+
+    def get_matches(self, trees, unique=False, candidates=None):
+        """
+        Match all patterns against trees
+
+        Parameters
+        ----------
+        trees: list of baleen.tree.Tree instances or str
+            trees in order of absolute tree number; labeled bracket 
+            strings are parsed first, and None (a blank line) is skipped
+        unique: bool, optional
+            report each matching node only once, like tregex.sh -o
+        candidates: dict, optional
+            mapping pattern texts to collections of the numbers of the 
+            trees to match (counting from 1), e.g. as obtained from 
+            baleen.index.TermIndex; patterns missing from the dict are 
+            matched against all trees, and trees which are not a candidate
+            of any pattern are not even parsed
+
+        Returns
+        -------
+        dict
+            mapping each pattern text to a list of (int, int) tuples with
+            absolute tree number and node number of each match
+            
+        If a collector is active (see baleen.instrument), the time spent
+        on each pattern is recorded like in baleen.tregex.get_matches. 
+        Sub-expressions shared between patterns are timed with the first 
+        pattern that needs them on a tree.
+        """
+        collector = active_collector()
+        matches = dict((pattern.text, []) for pattern in self.patterns)
+        # identical patterns are matched only once
+        patterns = dict((pattern.text, pattern) for pattern in self.patterns)
+
+        if candidates:
+            candidates = dict((text, candidates[text]) for text in patterns
+                              if candidates.get(text) is not None)
+        # patterns matched against all trees
+        unfiltered = [(text, pattern) for text, pattern in patterns.items()
+                      if not candidates or text not in candidates]
+        # pattern text -> seconds spent matching
+        seconds = dict((text, 0.0) for text in patterns)
+        # pattern text -> {label: whether it matches the root node}, shared
+        # by patterns with the same root node description
+        shared = {}
+        root_labels = dict(
+            (text, shared.setdefault(pattern.root.label_key(), {}))
+            for text, pattern in patterns.items())
+
+        for tree_n, tree in enumerate(trees, 1):
+            if tree is None:
+                continue
+            if candidates:
+                selected = unfiltered + [
+                    (text, patterns[text]) 
+                    for text, tree_ns in candidates.items() 
+                    if tree_n in tree_ns]
+                if not selected:
+                    continue
+            else:
+                selected = unfiltered
+            tree = as_tree(tree)
+            memo = Memo(self.shared_ids) if self.shared_ids else None
+            for text, pattern in selected:
+                if collector:
+                    start = perf_counter()
+                pairs = matches[text]
+                previous = None
+                for i, _ in pattern.finditer(tree, memo, root_labels[text]):
+                    if not (unique and i == previous):
+                        pairs.append((tree_n, i + 1))
+                    previous = i
+                if collector:
+                    seconds[text] += perf_counter() - start
+                    
+        if collector:
+            for text in patterns:
+                collector.record("tregex", "pattern", text, calls=1, 
+                                 matches=len(matches[text]),
+                                 native_seconds=seconds[text])
+
+        return matches
+
+
+# pattern text -> Pattern instance or UnsupportedPattern instance
+_compiled = {}
+
+
+def compile_pattern(text):
+    """
+    Compile Tregex pattern, caching the result
+
+    Raises UnsupportedPattern if the pattern is outside the supported subset.
+    """
+    try:
+        pattern = _compiled[text]
+    except KeyError:
+        try:
+            pattern = Pattern(text)
+        except UnsupportedPattern as error:
+            pattern = error
+        except re.error as error:
+            pattern = UnsupportedPattern(error)
+        _compiled[text] = pattern
+
+    if isinstance(pattern, UnsupportedPattern):
+        raise pattern
+
+    return pattern
@@ -0,0 +1,306 @@
+"""
+Overlapped execution of extraction, post-processing and transformation
+
+run_pipeline streams chunks of matches from extraction through
+post-processing to transformation. Each stage runs in its own thread and
+the stages are connected by bounded queues, so post-processing of the
+matches of one pattern overlaps with matching the next pattern, and
+transformation of a chunk starts as soon as it is post-processed. Tsurgeon
+and the transform workers are separate processes, so their work overlaps
+with matching in Python. When a stage falls behind, the queue before it
+fills up and the stage feeding it blocks (backpressure), which bounds the
+number of chunks in memory.
+
+The final merge is deterministic: the result is identical to running the
+stages one after another on the whole corpus,
+
+    matches = Matches.from_patterns(patterns, nodes, parse_dir)
+    post_process(matches, rules_fname)
+    merged = transform_matches(matches, transform_fname, worker=worker)
+
+regardless of chunk size and timing:
+
+    with TransformWorker() as worker:
+        merged = run_pipeline(td.patterns, td.nodes, parse_dir,
+                              rules_fname="post_proc_rules",
+                              transform_fname="transforms",
+                              transform_worker=worker)
+"""
+
+import queue
+import threading
+from time import perf_counter
+
+import pandas as pd
+
+from baleen.columnar import compact_matches, write_matches
+from baleen.extract import iter_matches, Matches
+from baleen.instrument import active_collector
+from baleen.postproc import post_process
+from baleen.trans.wrap import (TransformWorker, matches_to_tuples,
+                               merge_matches, order_tuples, renumber_tuples,
+                               transform_shards, tuples_to_matches)
+
+
+# marks the end of a stream of chunks
+_END = object()
+
+
+class _Stage(threading.Thread):
+    """
+    Thread applying a function to every chunk from an input queue and
+    putting the results on an output queue
+
+    If the function raises an exception, it is appended to errors and
+    the stop event is set, which ends all stages.
+    """
+
+    def __init__(self, name, function, inputs, outputs, stop, errors):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.function = function
+        self.inputs = inputs
+        self.outputs = outputs
+        self.stop = stop
+        self.errors = errors
+        # seconds spent processing and waiting for input
+        self.busy = self.waited = 0.0
+        self.n_chunks = 0
+
+    def put(self, item):
+        # block while the output queue is full, unless the pipeline stops
+        while not self.stop.is_set():
+            try:
+                self.outputs.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def chunks(self):
+        while not self.stop.is_set():
+            start = perf_counter()
+            try:
+                item = self.inputs.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            finally:
+                self.waited += perf_counter() - start
+            if item is _END:
+                return
+            yield item
+
+    def process(self, chunk):
+        start = perf_counter()
+        result = self.function(chunk)
+        self.busy += perf_counter() - start
+        return result
+
+    def run(self):
+        try:
+            for chunk in self.chunks():
+                result = self.process(chunk)
+                self.n_chunks += 1
+                self.put(result)
+        except BaseException as error:
+            self.errors.append(error)
+            self.stop.set()
+        else:
+            self.put(_END)
+
+
+class _Source(_Stage):
+    """
+    Thread putting the chunks generated by an iterable on an output queue
+    """
+
+    def __init__(self, name, iterable, outputs, stop, errors):
+        _Stage.__init__(self, name, None, None, outputs, stop, errors)
+        self.iterable = iterable
+
+    def chunks(self):
+        # time spent in the iterable is processing time of this stage
+        chunks = iter(self.iterable)
+        while not self.stop.is_set():
+            start = perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                self.busy += perf_counter() - start
+            yield chunk
+
+    def process(self, chunk):
+        return chunk
+
+
+def run_pipeline(patterns, nodes, file_path, rules_fname=None,
+                 transform_fname=None, tree_info=None,
+                 exec_path="tregex.sh", drop_duplicates=False,
+                 engine="external", term_index=None, edit_cache=None,
+                 transform_worker=None, n_jobs=1, batch_size=10000,
+                 max_depth=None, max_derived=None, trans_matches_fname=None,
+                 jython_exec="jython", jython_path=None, class_path=None,
+                 chunk_size=10000, max_queued=4):
+    """
+    Extract, post-process and transform matches with overlapping stages
+
+    Parameters
+    ----------
+    patterns: tredev.patterns.Patterns instance
+        tree matching patterns
+    nodes: tredev.nodes.Nodes instance
+        nodes
+    file_path: str
+        directory containing tree files
+    rules_fname: str, optional
+        name of file with post-processing rules; without rules, matches
+        are not post-processed
+    transform_fname: str or list, optional
+        name of file with definitions of tree transformations or list of
+        filenames; without transformations, the post-processed matches are
+        returned
+    tree_info, exec_path, drop_duplicates, engine, term_index: optional
+        see baleen.extract.Matches.from_patterns
+    edit_cache: baleen.cache.EditCache instance, optional
+        cache of edited subtrees; see baleen.postproc.post_process
+    transform_worker: TransformWorker instance or list of instances, optional
+        long-lived transform worker(s); if not given, n_jobs new workers
+        are started for this run
+    n_jobs, batch_size, max_depth, max_derived: int, optional
+        see baleen.trans.wrap.transform_matches
+    trans_matches_fname: str, optional
+        name of directory/file for writing the merged matches; see
+        baleen.columnar.write_matches
+    jython_exec, jython_path, class_path: str, optional
+        settings for new transform workers; see TransformWorker
+    chunk_size: int, optional
+        maximum number of matches per chunk; chunks also end after the last
+        match of every pattern
+    max_queued: int, optional
+        maximum number of chunks waiting between two stages
+
+    Returns
+    -------
+    pandas.DataFrame
+        post-processed matches, or merged matches if transformations are
+        given, in compact layout
+    """
+    chunks = iter_matches(patterns, nodes, file_path, tree_info=tree_info,
+                          exec_path=exec_path,
+                          drop_duplicates=drop_duplicates, engine=engine,
+                          chunk_size=chunk_size, term_index=term_index,
+                          flush_patterns=True)
+
+    workers = own_workers = []
+    if transform_fname is not None:
+        if transform_worker is None:
+            workers = own_workers = [
+                TransformWorker(jython_exec=jython_exec,
+                                jython_path=jython_path,
+                                class_path=class_path)
+                for _ in range(n_jobs)]
+        elif isinstance(transform_worker, TransformWorker):
+            workers = [transform_worker]
+        else:
+            workers = list(transform_worker)
+
+    def post_process_chunk(chunk):
+        post_process(chunk, rules_fname, cache=edit_cache)
+        return chunk
+
+    def transform_chunk(chunk):
+        trans_tuples = transform_shards(matches_to_tuples(chunk), workers,
+                                        transform_fname,
+                                        batch_size=batch_size,
+                                        max_depth=max_depth,
+                                        max_derived=max_derived)
+        return chunk, trans_tuples
+
+    stop = threading.Event()
+    errors = []
+    queues = [queue.Queue(max_queued)]
+    stages = [_Source("extract", chunks, queues[0], stop, errors)]
+
+    for name, function, needed in (
+            ("post_process", post_process_chunk, rules_fname is not None),
+            ("transform", transform_chunk, transform_fname is not None)):
+        if needed:
+            queues.append(queue.Queue(max_queued))
+            stages.append(_Stage(name, function, queues[-2], queues[-1],
+                                 stop, errors))
+
+    try:
+        for stage in stages:
+            stage.start()
+        results = _collect(queues[-1], errors)
+    finally:
+        stop.set()
+        for stage in stages:
+            stage.join()
+        for worker in own_workers:
+            worker.close()
+
+    collector = active_collector()
+    if collector:
+        for stage in stages:
+            collector.record("pipeline", "stage", stage.name,
+                             busy_seconds=stage.busy,
+                             idle_seconds=stage.waited,
+                             chunks=stage.n_chunks)
+
+    if transform_fname is None:
+        matches = _concat(results)
+        if trans_matches_fname:
+            write_matches(matches, trans_matches_fname)
+        return matches
+
+    return _merge(results, trans_matches_fname)
+
+
+def _collect(results, errors):
+    # collect results in order until the end of the stream
+    collected = []
+
+    while not errors:
+        try:
+            item = results.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _END:
+            return collected
+        collected.append(item)
+
+    raise errors[0]
+
+
+def _concat(chunks):
+    if not chunks:
+        return pd.DataFrame(columns=Matches.fields)
+    # categories differ between chunks, so compact again after concatenation
+    return compact_matches(pd.concat(chunks))
+
+
+def _merge(results, trans_matches_fname=None):
+    # merge matches and transformed tuples from all chunks, numbering
+    # derived tuples as a single run over all matches would, i.e. after
+    # the highest index of all matches, including ill-formed ones
+    org_matches = _concat([chunk for chunk, _ in results])
+    max_index = max([int(chunk.index.max()) for chunk, _ in results
+                     if len(chunk)] + [-1])
+    trans_tuples = []
+
+    for _, chunk_tuples in results:
+        derived = renumber_tuples(chunk_tuples, max_index)
+        trans_tuples.extend(trans_tuple for trans_tuple in chunk_tuples
+                            if trans_tuple[1] is None)
+        trans_tuples.extend(derived)
+        if derived:
+            max_index = derived[-1][0]
+
+    trans_matches = tuples_to_matches(order_tuples(trans_tuples))
+    merged_matches = merge_matches(org_matches, trans_matches)
+
+    if trans_matches_fname:
+        write_matches(merged_matches, trans_matches_fname)
+
+    return merged_matches
@@ -1,24 +1,159 @@
 from configparser import ConfigParser
+from time import perf_counter
 
-from baleen.tsurgeon import edit_trees
-from baleen.utils import tree_yield
+import pandas as pd
 
+from baleen.instrument import active_collector
+from baleen.tree import as_string
+from baleen.tsurgeon import edit_trees_chain
+from baleen.utils import tree_yields
 
-def post_process(matches, rules_fname):
+
+def post_process(matches, rules_fname, cache=None, store=None):
+    """
+    Post-process the subtrees of matches by applying Tsurgeon rules
+    
+    For each target, i.e. pattern name, its chain of rules is applied in a
+    single call to edit_trees_chain. Targets with the same chain of rules
+    are edited together, and identical subtrees are edited only once.
+    Substrings are derived once, after all editing. Different chains need
+    separate calls, because Tsurgeon applies the same scripts to every
+    tree, and restricting rules to the trees of a chain would mean
+    rewriting their patterns, e.g. around a marker node, which changes
+    what patterns anchored at the root match.
+    
+    If a collector is active (see baleen.instrument), the rules of a chain
+    are applied one at a time instead, recording the time spent on each 
+    rule and the number of trees it changed under kind "rule", while the 
+    totals of each chain are recorded under kind "chain".
+    
+    Parameters
+    ----------
+    matches: pandas.DataFrame
+        matches, modified in place; subtrees may be labeled bracket strings
+        or baleen.tree.Tree instances and are labeled bracket strings after
+        editing
+    rules_fname: str
+        name of file with post-processing rules; see read_postproc_rules
+    cache: baleen.cache.EditCache instance, optional
+        cache of edited subtrees per chain of rules, so that only subtrees 
+        not edited before are sent to Tsurgeon
+    store: baleen.store.CorpusStore instance, optional
+        store to read the subtrees of a span table from; edited subtrees 
+        and their substrings are added to the span table in columns 
+        subtree and substr, leaving them empty for other matches
+    """
     target_to_rules = read_postproc_rules(rules_fname)
     
+    # rule chain -> targets
+    chain_to_targets = {}
+    # rule chain -> rule names
+    chain_to_names = {}
+    
     for target, rules in target_to_rules.items():
-        selection = matches["pat_name"] == target
+        chain = tuple((rule["pattern"], rule["script"]) for rule in rules)
+        chain_to_targets.setdefault(chain, []).append(target)
+        chain_to_names[chain] = [rule.name for rule in rules]
+        
+    collector = active_collector()
+        
+    edited = pd.Series(False, index=matches.index)
+        
+    for chain, targets in chain_to_targets.items():
+        selection = matches["pat_name"].isin(targets)
 
-        if any(selection):
-            subtrees = matches["subtree"][selection]
+        if selection.any():
+            if collector:
+                start = perf_counter()
+                
+            if store is not None:
+                subtrees = pd.Series(store.subtrees(matches[selection]), 
+                                     index=matches.index[selection])
+            else:
+                subtrees = matches.loc[selection, "subtree"]
+            # parsed subtrees are deduplicated structurally, then serialized
+            unique_subtrees = pd.unique(subtrees)
+            unique_strings = [as_string(subtree) 
+                              for subtree in unique_subtrees]
+            
+            if cache is not None:
+                edits = cache.get_many(chain, unique_strings)
+            else:
+                edits = {}
+                
+            missing = list(dict.fromkeys(string for string in unique_strings
+                                         if string not in edits))
+            
+            if missing:
+                if collector:
+                    edited_trees = _edit_rule_by_rule(
+                        missing, chain, chain_to_names[chain], collector)
+                else:
+                    edited_trees = _edit(missing, chain)
+                new_edits = dict(zip(missing, edited_trees))
+                if cache is not None:
+                    cache.put_many(chain, new_edits)
+                edits.update(new_edits)
+            
+            edits = dict((subtree, edits[string]) for subtree, string 
+                         in zip(unique_subtrees, unique_strings))
+            matches.loc[selection, "subtree"] = subtrees.map(edits)
+            edited |= selection
+            
+            if collector:
+                seconds = perf_counter() - start
+                changed = sum(edits[subtree] != string for subtree, string 
+                              in zip(unique_subtrees, unique_strings))
+                collector.record("post_process", "chain", 
+                                 " + ".join(chain_to_names[chain]),
+                                 seconds=seconds,
+                                 matches=int(selection.sum()),
+                                 trees=len(unique_strings),
+                                 edited=len(missing),
+                                 changed=changed)
+            
+    if edited.any():
+        if collector:
+            start = perf_counter()
+            
+        subtrees = matches.loc[edited, "subtree"]
+        unique_subtrees = pd.unique(subtrees)
+        substrings = dict(zip(unique_subtrees, 
+                              subtrees_to_substrings(unique_subtrees)))
+        matches.loc[edited, "substr"] = subtrees.map(substrings)
         
-            for rule in rules:
-                subtrees = edit_trees(subtrees, rule["pattern"], rule["script"])
-                matches["subtree"][selection] = subtrees
-                matches["substr"][selection] = subtrees_to_substrings(subtrees)
+        if collector:
+            collector.record("post_process", "phase", "substrings",
+                             seconds=perf_counter() - start,
+                             trees=len(substrings))
         
 
+def _edit(trees, chain):
+    edited_trees = edit_trees_chain(trees, chain)
+    # pairing trees with the edits of other trees would also corrupt the 
+    # cache
+    if len(edited_trees) != len(trees):
+        raise ValueError("Tsurgeon returned {} trees for {} trees".format(
+            len(edited_trees), len(trees)))
+    return edited_trees
+
+
+def _edit_rule_by_rule(trees, chain, names, collector):
+    # apply the rules of a chain one after the other, which gives the same
+    # trees as applying them in one go, recording each rule's time and the
+    # number of trees it changed
+    for rule, name in zip(chain, names):
+        start = perf_counter()
+        edited_trees = _edit(trees, [rule])
+        collector.record("post_process", "rule", name,
+                         seconds=perf_counter() - start,
+                         trees=len(trees),
+                         changed=sum(edited != tree for edited, tree 
+                                     in zip(edited_trees, trees)))
+        trees = edited_trees
+    return trees
+
+
 def read_postproc_rules(rules_fname):
     
     rules = ConfigParser()
@@ -41,4 +176,4 @@ def read_postproc_rules(rules_fname):
     
         
 def subtrees_to_substrings(subtrees):
-    return [tree_yield(subtree) for subtree in subtrees]
+    return tree_yields(subtrees)
@@ -0,0 +1,164 @@
+#!/usr/bin/env jython
+
+"""
+Persistent Tregex/Tsurgeon server
+
+Loads a corpus of parse trees once and then serves pattern matching and tree
+editing requests read from stdin, writing responses to stdout, so that a
+whole session runs in a single JVM. See baleen.worker for the client side.
+
+Requests and responses are single lines of tab-separated fields, where
+backslash, tab and newline characters within a field are escaped:
+
+  load <dir>                      -> ok <number of trees>
+  match <pattern>                 -> ok <tree_n:node_n> <tree_n:node_n> ...
+  edit <pattern> <script> <n>     -> ok <n>
+  <tree 1> ... <tree n>              <tree 1> ... <tree n>
+  edit <pattern 1> <script 1> ... <pattern k> <script k> <n>
+  <tree 1> ... <tree n>           -> ok <n>
+                                     <tree 1> ... <tree n>
+  quit
+
+Failures are reported as "error <message>" and leave the server running.
+
+Requires:
+- Jython 2.7 from http://www.jython.org/
+- stanford-tregex.jar in Stanford Tregex package
+  from http://nlp.stanford.edu/software/tregex.shtml
+"""
+
+import sys
+
+hint = """
+Probably Jython can not find the Java library stanford-tregex.jar
+Either set/prepend the environment variable JYTHONPATH like
+
+  JYTHONPATH=/path/to/stanford-tregex.jar
+
+Some versions of Jython seems to require setting of CLASSPATH
+instead of JYTHONPATH.
+"""
+
+try:
+    from java.io import FileInputStream, InputStreamReader, StringReader
+    from java.lang import Throwable
+    from edu.stanford.nlp.trees.tregex import TregexPattern
+    from edu.stanford.nlp.trees.tregex.tsurgeon import Tsurgeon
+except ImportError:
+    sys.exit(hint)
+
+
+from jython_common import ENCODING, read_fields, tree_files, write_fields
+
+
+# Prefix "sc_" indicates a Java object from Stanford CoreNLP, e.g. sc_tree is
+# a edu.stanford.nlp.trees.Tree object
+
+
+class Server(object):
+
+    def __init__(self):
+        # same tree reader as used by tregex.sh and tsurgeon.sh
+        self.reader_factory = TregexPattern.TRegexTreeReaderFactory()
+        self.sc_trees = []
+        self.compiled = {}
+
+    def read_trees(self, reader):
+        sc_trees = []
+        tree_reader = self.reader_factory.newTreeReader(reader)
+        sc_tree = tree_reader.readTree()
+
+        while sc_tree is not None:
+            sc_trees.append(sc_tree)
+            sc_tree = tree_reader.readTree()
+
+        return sc_trees
+
+    def load(self, file_path):
+        # same order as baleen.extract.Matches.get_tree_info, so absolute
+        # tree numbers agree
+        self.sc_trees = []
+
+        for fname in tree_files(file_path):
+            reader = InputStreamReader(FileInputStream(fname), ENCODING)
+            self.sc_trees.extend(self.read_trees(reader))
+            reader.close()
+
+        return [len(self.sc_trees)]
+
+    def pattern(self, pattern):
+        try:
+            return self.compiled[pattern]
+        except KeyError:
+            sc_pattern = self.compiled[pattern] = TregexPattern.compile(
+                pattern)
+            return sc_pattern
+
+    def operation(self, script):
+        # a script may consist of several operations, one per line
+        sc_operations = [Tsurgeon.parseOperation(line)
+                         for line in script.split("\n") if line.strip()]
+        if len(sc_operations) == 1:
+            return sc_operations[0]
+        return Tsurgeon.collectOperations(sc_operations)
+
+    def match(self, pattern):
+        sc_pattern = self.pattern(pattern)
+        pairs = []
+
+        for tree_n, sc_tree in enumerate(self.sc_trees):
+            matcher = sc_pattern.matcher(sc_tree)
+            while matcher.find():
+                node_n = matcher.getMatch().nodeNumber(sc_tree)
+                pairs.append("%d:%d" % (tree_n + 1, node_n))
+
+        return [" ".join(pairs)]
+
+    def edit(self, *args):
+        # pairs of pattern and script, applied in order, followed by the
+        # number of trees
+        n = int(args[-1])
+        # read all trees before editing, so that an error does not leave
+        # unread trees on stdin
+        trees = [read_fields(sys.stdin)[0] for _ in range(n)]
+        rules = [(self.pattern(args[i]), self.operation(args[i + 1]))
+                 for i in range(0, len(args) - 1, 2)]
+        lines = []
+
+        for tree in trees:
+            sc_trees = self.read_trees(StringReader(tree))
+            sc_tree = sc_trees and sc_trees[0] or None
+            for sc_pattern, sc_operation in rules:
+                if sc_tree is None:
+                    break
+                sc_tree = Tsurgeon.processPattern(sc_pattern, sc_operation,
+                                                  sc_tree)
+            lines.append(sc_tree and sc_tree.toString() or "")
+
+        return [len(lines)] + lines
+
+    def serve(self):
+        commands = {"load": self.load,
+                    "match": self.match,
+                    "edit": self.edit}
+
+        while True:
+            fields = read_fields(sys.stdin)
+
+            if not fields or fields[0] == "quit":
+                break
+
+            try:
+                result = commands[fields[0]](*fields[1:])
+            except (Exception, Throwable) as error:
+                write_fields(sys.stdout, "error", str(error))
+            else:
+                write_fields(sys.stdout, "ok", result[0])
+                for line in result[1:]:
+                    write_fields(sys.stdout, line)
+
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    Server().serve()
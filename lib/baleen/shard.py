@@ -0,0 +1,470 @@
+"""
+Sharded corpus runs
+
+A manifest splits the tree files of a corpus into shards of consecutive
+files and records, for each shard, its files and the number of trees
+preceding it (its base). Each shard is then extracted, post-processed and
+transformed on its own, e.g. by separate processes or on separate nodes of
+a cluster, and the results of all shards are merged into a single table:
+
+    manifest = make_manifest(parse_dir, 8, "manifest.json")
+    run_shards("manifest.json", td.patterns, "shards", nodes=td.nodes,
+               rules_fname="post_proc_rules", transform_fname="transforms",
+               n_jobs=8)
+    merged = merge_shards("manifest.json", "shards")
+
+On a cluster, each node runs run_shard for its own shard ids and writes to
+a shared output directory; merge_shards is run once all shards are done.
+A shard is done when its directory contains done.json, which is written
+last. Failed shards are simply run again, e.g. with run_shards, which by
+default only runs shards that are not done.
+
+The merged table is identical to that of a single run over the whole
+corpus: the values of file and rel_tree_n are relative to tree files
+anyway, and indices of matches as well as index, ancestor and origin of
+transformed matches are renumbered globally when merging, numbering matches
+in order of pattern and tree and derived matches in order of their origin.
+
+Tree numbers of a shard count from 1, like those of any directory of tree
+files. If nodes are given, they are looked up with absolute tree numbers of
+the whole corpus by adding the base of the shard. Without nodes, subtrees
+are read from a baleen.store.CorpusStore built for the shard in its output
+directory.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+from os.path import basename, exists, join
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from baleen.columnar import compact_matches, read_matches, write_matches
+from baleen.extract import Matches
+from baleen.postproc import post_process
+from baleen.store import CorpusStore, SPAN_COLUMNS
+from baleen.trans.wrap import (matches_to_tuples, merge_matches,
+                               renumber_tuples, transform_tuples,
+                               tuples_to_matches)
+from baleen.tregex import shard_files
+
+
+class ShardError(Exception):
+    """
+    Raised when shards fail, are incomplete or do not match their manifest
+    """
+
+
+def make_manifest(file_path, n_shards, manifest_fname=None):
+    """
+    Split the tree files in directory file_path into at most n_shards
+    shards of consecutive files with about the same number of trees
+
+    Parameters
+    ----------
+    file_path: str
+        directory containing tree files
+    n_shards: int
+        maximum number of shards
+    manifest_fname: str, optional
+        name of file for writing the manifest as JSON
+
+    Returns
+    -------
+    dict
+        manifest with keys file_path, n_trees and shards, a list of dicts
+        with keys id, files (list of [filename, size]), base (number of
+        trees preceding the shard) and n_trees
+    """
+    shards = []
+    n_trees = 0
+
+    for shard_id, (fnames, base) in enumerate(shard_files(file_path,
+                                                          n_shards)):
+        files = []
+        for fname in fnames:
+            with open(fname, "rb") as inf:
+                n_trees += sum(1 for _ in inf)
+            files.append([basename(fname), os.path.getsize(fname)])
+        shards.append({"id": shard_id, "files": files, "base": base,
+                       "n_trees": n_trees - base})
+
+    manifest = {"file_path": os.path.abspath(file_path),
+                "n_trees": n_trees,
+                "shards": shards}
+
+    if manifest_fname:
+        with open(manifest_fname, "w") as outf:
+            json.dump(manifest, outf, indent=2)
+
+    return manifest
+
+
+def read_manifest(manifest):
+    """
+    Read manifest from file, or return it if it is a dict already
+    """
+    if isinstance(manifest, str):
+        with open(manifest) as inf:
+            return json.load(inf)
+    return manifest
+
+
+def shard_dir(out_dir, shard_id):
+    return join(out_dir, "shard-{:04d}".format(shard_id))
+
+
+def is_done(out_dir, shard_id):
+    """
+    Return True if shard shard_id has been run successfully
+    """
+    return exists(join(shard_dir(out_dir, shard_id), "done.json"))
+
+
+def pending_shards(manifest, out_dir):
+    """
+    Return the ids of the shards which have not been run successfully
+    """
+    return [shard["id"] for shard in read_manifest(manifest)["shards"]
+            if not is_done(out_dir, shard["id"])]
+
+
+class _ShardNodes(object):
+    """
+    Nodes of the whole corpus looked up with tree numbers of a shard
+    """
+
+    def __init__(self, nodes, base):
+        self.nodes = nodes
+        self.base = base
+
+        if hasattr(nodes, "get_node_ids"):
+            self.get_node_ids = lambda abs_tree_ns, node_ns: (
+                nodes.get_node_ids(np.asarray(abs_tree_ns) + base, node_ns))
+
+    def get_node_id(self, abs_tree_n, node_n):
+        return self.nodes.get_node_id(abs_tree_n + self.base, node_n)
+
+    def __getattr__(self, name):
+        # get_subtree(s) and get_substring(s) take node ids
+        return getattr(self.nodes, name)
+
+
+def _link_files(file_path, shard, tree_path):
+    # directory with links to the tree files of the shard only, so tree
+    # numbers count from 1 for the shard
+    os.makedirs(tree_path, exist_ok=True)
+
+    for fname in os.listdir(tree_path):
+        os.remove(join(tree_path, fname))
+
+    for fname, size in shard["files"]:
+        source = join(file_path, fname)
+        if os.path.getsize(source) != size:
+            raise ShardError("tree file {} of shard {} differs from "
+                             "manifest".format(source, shard["id"]))
+        os.symlink(os.path.abspath(source), join(tree_path, fname))
+
+
+def run_shard(manifest, shard_id, patterns, out_dir, nodes=None,
+              rules_fname=None, transform_fname=None, file_path=None,
+              exec_path="tregex.sh", drop_duplicates=False,
+              engine="external", edit_cache=None, transform_worker=None,
+              n_jobs=1, batch_size=10000, max_depth=None, max_derived=None,
+              jython_exec="jython", jython_path=None, class_path=None):
+    """
+    Extract, post-process and transform the matches of a single shard
+
+    Results are written to the shard's directory in out_dir: matches.pkl
+    with the (post-processed) matches, numbered from 0 within the shard,
+    trans_tuples.pkl with the transformed tuples, if transformations are
+    given, and finally done.json. Running a shard again overwrites its
+    previous results.
+
+    Parameters
+    ----------
+    manifest: dict or str
+        manifest or name of manifest file; see make_manifest
+    shard_id: int
+        id of shard to run
+    patterns: tredev.patterns.Patterns instance
+        tree matching patterns, with unique names
+    out_dir: str
+        directory for the results of all shards
+    nodes: tredev.nodes.Nodes instance, optional
+        nodes of the whole corpus; if not given, subtrees are read from a
+        corpus store of the shard
+    rules_fname: str, optional
+        name of file with post-processing rules; without rules, matches
+        are not post-processed
+    transform_fname: str or list, optional
+        name of file with definitions of tree transformations or list of
+        filenames; without transformations, matches are not transformed
+    file_path: str, optional
+        directory containing tree files, if it differs from the one in the
+        manifest, e.g. on another node
+    exec_path, drop_duplicates, engine: optional
+        see baleen.extract.Matches.from_patterns
+    edit_cache: baleen.cache.EditCache instance, optional
+        cache of edited subtrees; see baleen.postproc.post_process
+    transform_worker, n_jobs, batch_size, max_depth, max_derived,
+    jython_exec, jython_path, class_path: optional
+        see baleen.trans.wrap.transform_matches
+    """
+    manifest = read_manifest(manifest)
+    shard = manifest["shards"][shard_id]
+    shard_path = shard_dir(out_dir, shard_id)
+    done_fname = join(shard_path, "done.json")
+
+    if exists(done_fname):
+        os.remove(done_fname)
+
+    tree_path = join(shard_path, "trees")
+    _link_files(file_path or manifest["file_path"], shard, tree_path)
+    tree_info = Matches.get_tree_info(tree_path)
+
+    if len(tree_info) != shard["n_trees"]:
+        raise ShardError("shard {} has {} trees instead of {}".format(
+            shard_id, len(tree_info), shard["n_trees"]))
+
+    if nodes is None:
+        store = CorpusStore.open(tree_path, join(shard_path, "store"))
+        nodes = tree_info = store
+    else:
+        store = None
+        nodes = _ShardNodes(nodes, shard["base"])
+
+    try:
+        matches = Matches.from_patterns(patterns, nodes, tree_path,
+                                        tree_info=tree_info,
+                                        exec_path=exec_path, engine=engine,
+                                        spans=store is not None)
+        # number of matches per pattern, including duplicates, because
+        # dropping duplicates keeps the index of the remaining matches
+        counts = (matches["pat_name"].value_counts()
+                  .reindex(patterns.index, fill_value=0))
+
+        if drop_duplicates:
+            matches.drop_duplicates(
+                subset=['label', 'file', 'rel_tree_n', 'node_n'],
+                inplace=True)
+
+        if rules_fname:
+            post_process(matches, rules_fname, cache=edit_cache,
+                         store=store)
+
+        if transform_fname:
+            trans_tuples = transform_tuples(
+                matches_to_tuples(matches, store), transform_fname,
+                jython_exec=jython_exec, jython_path=jython_path,
+                class_path=class_path, worker=transform_worker,
+                batch_size=batch_size, max_depth=max_depth,
+                max_derived=max_derived, n_jobs=n_jobs)
+            with open(join(shard_path, "trans_tuples.pkl"), "wb") as outf:
+                pickle.dump(trans_tuples, outf)
+
+        if store is not None:
+            # spans refer to the store of the shard
+            store.materialize(matches)
+            matches = compact_matches(matches.drop(SPAN_COLUMNS, axis=1))
+    finally:
+        if store is not None:
+            store.close()
+
+    write_matches(matches, join(shard_path, "matches.pkl"))
+
+    # write done.json last, so an interrupted shard is not merged
+    with open(done_fname, "w") as outf:
+        json.dump({"id": shard_id,
+                   "patterns": counts.index.tolist(),
+                   "counts": counts.tolist(),
+                   "transformed": bool(transform_fname)}, outf)
+
+
+def run_shards(manifest, patterns, out_dir, shard_ids=None, rerun=False,
+               n_jobs=1, executor=None, **kwargs):
+    """
+    Run shards in parallel processes
+
+    Parameters
+    ----------
+    manifest: dict or str
+        manifest or name of manifest file; see make_manifest
+    patterns: tredev.patterns.Patterns instance
+        tree matching patterns, with unique names
+    out_dir: str
+        directory for the results of all shards
+    shard_ids: list of int, optional
+        ids of shards to run; by default all shards
+    rerun: bool, optional
+        also run shards which are done already
+    n_jobs: int, optional
+        number of processes; with a single job, shards are run in this
+        process
+    executor: concurrent.futures.Executor instance, optional
+        executor to submit shards to instead of a new process pool
+    kwargs:
+        other arguments of run_shard, which must be picklable unless shards
+        are run in this process
+
+    Raises
+    ------
+    ShardError
+        if any shard fails, after all other shards have been run
+    """
+    manifest = read_manifest(manifest)
+
+    if shard_ids is None:
+        shard_ids = [shard["id"] for shard in manifest["shards"]]
+    if not rerun:
+        shard_ids = [shard_id for shard_id in shard_ids
+                     if not is_done(out_dir, shard_id)]
+
+    # shard id -> error
+    errors = {}
+
+    if n_jobs == 1 and executor is None:
+        for shard_id in shard_ids:
+            try:
+                run_shard(manifest, shard_id, patterns, out_dir, **kwargs)
+            except Exception as error:
+                errors[shard_id] = error
+    else:
+        pool = executor or ProcessPoolExecutor(n_jobs)
+        try:
+            futures = {shard_id: pool.submit(run_shard, manifest, shard_id,
+                                             patterns, out_dir, **kwargs)
+                       for shard_id in shard_ids}
+            for shard_id, future in futures.items():
+                error = future.exception()
+                if error is not None:
+                    errors[shard_id] = error
+        finally:
+            if executor is None:
+                pool.shutdown()
+
+    if errors:
+        raise ShardError("shards {} failed: {}".format(
+            sorted(errors), "; ".join("{}: {!r}".format(shard_id, error)
+                                      for shard_id, error
+                                      in sorted(errors.items()))))
+
+
+def merge_shards(manifest, out_dir, trans_matches_fname=None):
+    """
+    Merge the results of all shards with global numbering
+
+    Matches are numbered as by a single run over the whole corpus, i.e. in
+    order of pattern and tree, counting duplicates if they were dropped.
+    Derived matches are numbered after all matches, in order of the match
+    they derive from.
+
+    Parameters
+    ----------
+    manifest: dict or str
+        manifest or name of manifest file; see make_manifest
+    out_dir: str
+        directory with the results of all shards
+    trans_matches_fname: str, optional
+        name of directory/file for writing the merged matches; see
+        baleen.columnar.write_matches
+
+    Returns
+    -------
+    pandas.DataFrame
+        post-processed matches, or merged matches if shards were
+        transformed, in compact layout
+
+    Raises
+    ------
+    ShardError
+        if shards are not done or were run with different settings
+    """
+    manifest = read_manifest(manifest)
+    shard_ids = [shard["id"] for shard in manifest["shards"]]
+    pending = pending_shards(manifest, out_dir)
+
+    if pending:
+        raise ShardError("shards {} are not done".format(pending))
+
+    infos = []
+    for shard_id in shard_ids:
+        with open(join(shard_dir(out_dir, shard_id), "done.json")) as inf:
+            infos.append(json.load(inf))
+
+    if any(info["patterns"] != infos[0]["patterns"] or
+           info["transformed"] != infos[0]["transformed"]
+           for info in infos):
+        raise ShardError("shards were run with different patterns or "
+                         "transformations")
+
+    positions = {name: position
+                 for position, name in enumerate(infos[0]["patterns"])}
+    # counts[i, j] is the number of matches of pattern j in shard i
+    counts = np.array([info["counts"] for info in infos],
+                      dtype=np.int64).reshape(len(infos), len(positions))
+    # global index of the first match of pattern j in shard i
+    starts = (np.cumsum(counts.sum(axis=0)) - counts.sum(axis=0) +
+              np.cumsum(counts, axis=0) - counts)
+    # local index of the first match of pattern j in shard i
+    local_starts = np.cumsum(counts, axis=1) - counts
+
+    chunks, index_maps = [], []
+
+    for i, shard_id in enumerate(shard_ids):
+        matches = read_matches(join(shard_dir(out_dir, shard_id),
+                                    "matches.pkl"))
+        pattern_ns = np.array([positions[name] for name
+                               in matches["pat_name"].tolist()],
+                              dtype=np.int64)
+        local_index = matches.index.values.astype(np.int64)
+        global_index = (starts[i, pattern_ns] + local_index -
+                        local_starts[i, pattern_ns])
+        index_maps.append(dict(zip(local_index.tolist(),
+                                   global_index.tolist())))
+        matches.index = pd.Index(global_index)
+        chunks.append(matches)
+
+    if chunks:
+        # categories differ between shards, so compact again
+        org_matches = compact_matches(pd.concat(chunks).sort_index())
+    else:
+        org_matches = pd.DataFrame(columns=Matches.fields)
+
+    if not infos or not infos[0]["transformed"]:
+        merged_matches = org_matches
+    else:
+        trans_tuples = _merge_tuples(out_dir, shard_ids, index_maps,
+                                     org_matches.index.max())
+        trans_matches = tuples_to_matches(trans_tuples)
+        merged_matches = merge_matches(org_matches, trans_matches)
+
+    if trans_matches_fname:
+        write_matches(merged_matches, trans_matches_fname)
+
+    return merged_matches
+
+
+def _merge_tuples(out_dir, shard_ids, index_maps, max_index):
+    # combine transformed tuples of all shards with original tuples under
+    # their global index and derived tuples under (shard id, local index),
+    # and number derived tuples as a single run over all tuples would
+    originals, derived = [], []
+
+    for shard_id, index_map in zip(shard_ids, index_maps):
+        with open(join(shard_dir(out_dir, shard_id),
+                       "trans_tuples.pkl"), "rb") as inf:
+            shard_tuples = pickle.load(inf)
+
+        for index, ancestor, name, subtree in shard_tuples:
+            if ancestor is None:
+                originals.append((index_map[index], None, name, subtree))
+            else:
+                ancestor = index_map.get(ancestor, (shard_id, ancestor))
+                derived.append(((shard_id, index), ancestor, name, subtree))
+
+    originals.sort(key=lambda trans_tuple: trans_tuple[0])
+    max_index = -1 if pd.isnull(max_index) else int(max_index)
+    return originals + renumber_tuples(originals + derived, max_index)
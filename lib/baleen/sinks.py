@@ -0,0 +1,111 @@
+"""
+Sinks for chunks of matches
+
+A sink consumes the chunks of matches generated by 
+baleen.extract.iter_matches, for example to write them to disk or to 
+post-process them, without collecting all matches in memory:
+
+    chunks = iter_matches(td.patterns, td.nodes, parse_dir)
+    ParquetSink("matches").consume(chunks)
+"""
+
+import pickle
+
+from baleen.columnar import write_matches
+
+
+class Sink(object):
+    """
+    Base class for sinks
+    """
+    
+    def write(self, chunk):
+        """
+        Consume a single chunk of matches
+        """
+        raise NotImplementedError
+    
+    def close(self):
+        """
+        Finish after the last chunk
+        """
+        
+    def consume(self, chunks):
+        """
+        Consume all chunks and close the sink
+        """
+        try:
+            for chunk in chunks:
+                self.write(chunk)
+        finally:
+            self.close()
+            
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+        
+        
+class ParquetSink(Sink):
+    """
+    Append chunks to a Parquet dataset partitioned by label, 
+    which can be read with baleen.columnar.read_matches
+    """
+    
+    def __init__(self, path, partition_cols=("label",)):
+        self.path = path
+        self.partition_cols = partition_cols
+        self.n_rows = 0
+        
+    def write(self, chunk):
+        write_matches(chunk, self.path, partition_cols=self.partition_cols,
+                      row_offset=self.n_rows)
+        self.n_rows += len(chunk)
+        
+        
+class PickleSink(Sink):
+    """
+    Append pickled chunks to a single file, which can be read with 
+    read_chunks
+    """
+    
+    def __init__(self, fname):
+        self.file = open(fname, "wb")
+        
+    def write(self, chunk):
+        pickle.dump(chunk, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+        
+    def close(self):
+        self.file.close()
+        
+        
+class FunctionSink(Sink):
+    """
+    Call a function on every chunk, e.g. to post-process matches and pass
+    them on to another sink:
+    
+        def process(chunk):
+            post_process(chunk, "post_proc_rules")
+            sink.write(chunk)
+            
+        FunctionSink(process).consume(chunks)
+    """
+    
+    def __init__(self, function):
+        self.function = function
+        
+    def write(self, chunk):
+        self.function(chunk)
+        
+        
+def read_chunks(fname):
+    """
+    Generate the chunks written by a PickleSink
+    """
+    with open(fname, "rb") as inf:
+        while True:
+            try:
+                yield pickle.load(inf)
+            except EOFError:
+                return
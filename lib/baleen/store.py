@@ -0,0 +1,419 @@
+"""
+Packed corpus store
+
+All trees from the tree files in a parse directory are packed into a single
+binary file, one tree per line, with a table of byte offsets. The file is
+memory mapped, so opening a store takes constant time and trees are only
+read from disk when accessed.
+
+A CorpusStore can replace both the tree info (see Matches.get_tree_info)
+and the tredev Nodes in Matches.from_patterns. Node ids are byte offsets of
+nodes in the store. With spans=True, matches refer to their subtrees as
+spans, i.e. columns tree_id (absolute tree number), start and end (byte
+offsets relative to the start of the tree), instead of holding copies of
+subtrees and substrings. Text is decoded only on access:
+
+    store = CorpusStore.open(parse_dir)
+    matches = Matches.from_patterns(patterns, store, parse_dir,
+                                    tree_info=store, spans=True)
+    subtrees = store.subtrees(matches)
+    post_process(matches, "post_proc_rules", store=store)
+    merged = transform_matches(matches, "transforms", store=store)
+
+Subtrees are decoded as written in the tree files, so they are identical to
+those of tredev if trees are stored in the usual one-line bracket format.
+"""
+
+import json
+import mmap
+import os
+from os.path import join
+import re
+
+import numpy as np
+
+from baleen.index import TreeIndex
+from baleen.tree import Tree
+from baleen.utils import tree_yields
+
+
+# brackets and labels/words, as in baleen.tree, but on bytes
+token_re = re.compile(rb"\(|\)|[^\s()]+")
+
+# columns referring to subtrees in span tables
+SPAN_COLUMNS = ["tree_id", "start", "end"]
+
+
+def node_spans(lbs):
+    """
+    Return byte spans of all nodes of a tree
+
+    Parameters
+    ----------
+    lbs: bytes
+        tree as labeled bracket string
+
+    Returns
+    -------
+    starts: list of int
+        start of each node in pre-order, i.e. the position of its opening
+        bracket or, for words, of the word
+    ends: list of int
+        end of each node, i.e. the position after its closing bracket or
+        word
+    """
+    starts, ends = [], []
+    stack = []
+    # position of previous token if it was an opening bracket
+    opened = None
+
+    for match in token_re.finditer(lbs):
+        token = match.group()
+        if token == b"(":
+            if opened is not None:
+                # node without label
+                stack.append(len(starts))
+                starts.append(opened)
+                ends.append(None)
+            opened = match.start()
+        elif token == b")":
+            if opened is not None:
+                stack.append(len(starts))
+                starts.append(opened)
+                ends.append(None)
+                opened = None
+            ends[stack.pop()] = match.end()
+        elif opened is not None:
+            stack.append(len(starts))
+            starts.append(opened)
+            ends.append(None)
+            opened = None
+        else:
+            starts.append(match.start())
+            ends.append(match.end())
+
+    return starts, ends
+
+
+class CorpusStore(object):
+    """
+    Trees of a parse directory packed into a single memory-mapped file
+
+    The store is a directory next to the corpus (by default the parse
+    directory name plus ".store") holding the packed trees, which is itself
+    a valid tree file, and NumPy arrays with the byte offset, file and
+    relative tree number of each tree. It is rebuilt only when tree files
+    are added, removed or changed, like baleen.index.TreeIndex.
+
+    Like a TreeIndex, a store can be used in place of the dict returned by
+    Matches.get_tree_info. It also provides the methods of tredev Nodes
+    used by Matches.from_patterns, including the bulk methods of
+    baleen.extract.resolve_nodes, with byte offsets as node ids.
+    """
+
+    def __init__(self, file_path, store_path, files, offsets, file_ids,
+                 rel_tree_ns):
+        self.file_path = file_path
+        self.store_path = store_path
+        # list of [filename, size, mtime_ns]
+        self.files = files
+        self.fnames = [fname for fname, _, _ in files]
+        # tree i (counting from 0) is data[offsets[i]:offsets[i + 1]]
+        self.offsets = offsets
+        self.file_ids = file_ids
+        self.rel_tree_ns = rel_tree_ns
+        self.data = self._map(join(store_path, "trees.bin"))
+        # abs_tree_n -> node spans, of the most recently used trees
+        self._spans = {}
+
+    @staticmethod
+    def _map(fname):
+        with open(fname, "rb") as inf:
+            if not os.fstat(inf.fileno()).st_size:
+                # empty files can not be mapped
+                return b""
+            return mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def default_store_path(file_path):
+        return os.path.normpath(file_path) + ".store"
+
+    @classmethod
+    def open(cls, file_path, store_path=None):
+        """
+        Open the store for the tree files in directory file_path, building
+        it first if it is missing or out of date
+        """
+        store_path = store_path or cls.default_store_path(file_path)
+        files = TreeIndex.scan_files(file_path)
+
+        try:
+            store = cls.load(file_path, store_path)
+        except (IOError, OSError, ValueError):
+            pass
+        else:
+            if store.files == files:
+                return store
+            store.close()
+
+        return cls.build(file_path, store_path, files)
+
+    @classmethod
+    def load(cls, file_path, store_path=None):
+        """
+        Open a previously built store without checking if it is up to date
+        """
+        store_path = store_path or cls.default_store_path(file_path)
+
+        with open(join(store_path, "files.json")) as inf:
+            files = json.load(inf)
+
+        arrays = [np.load(join(store_path, name + ".npy"), mmap_mode="r")
+                  for name in ("offsets", "file_ids", "rel_tree_ns")]
+        return cls(file_path, store_path, files, *arrays)
+
+    @classmethod
+    def build(cls, file_path, store_path=None, files=None):
+        """
+        Build the store for the tree files in directory file_path
+        """
+        store_path = store_path or cls.default_store_path(file_path)
+        files = files or TreeIndex.scan_files(file_path)
+        os.makedirs(store_path, exist_ok=True)
+        offsets, file_ids, rel_tree_ns = [0], [], []
+
+        with open(join(store_path, "trees.bin"), "wb") as outf:
+            for file_id, (fname, _, _) in enumerate(files):
+                with open(join(file_path, fname), "rb") as inf:
+                    for rel_tree_n, line in enumerate(inf, 1):
+                        line = line.rstrip() + b"\n"
+                        outf.write(line)
+                        offsets.append(offsets[-1] + len(line))
+                        file_ids.append(file_id)
+                        rel_tree_ns.append(rel_tree_n)
+
+        for name, values, dtype in (("offsets", offsets, np.int64),
+                                    ("file_ids", file_ids, np.int32),
+                                    ("rel_tree_ns", rel_tree_ns, np.int32)):
+            np.save(join(store_path, name + ".npy"),
+                    np.array(values, dtype=dtype))
+        # write file table last, so an interrupted build is rebuilt
+        with open(join(store_path, "files.json"), "w") as outf:
+            json.dump(files, outf)
+
+        return cls.load(file_path, store_path)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # tree info, as in TreeIndex
+
+    def __len__(self):
+        return len(self.file_ids)
+
+    def __contains__(self, abs_tree_n):
+        return 0 < abs_tree_n <= len(self)
+
+    def __iter__(self):
+        return iter(range(1, len(self) + 1))
+
+    def __getitem__(self, abs_tree_n):
+        if abs_tree_n not in self:
+            raise KeyError(abs_tree_n)
+        i = abs_tree_n - 1
+        return int(self.rel_tree_ns[i]), self.fnames[self.file_ids[i]]
+
+    def items(self):
+        for abs_tree_n in self:
+            yield abs_tree_n, self[abs_tree_n]
+
+    def lookup(self, abs_tree_ns):
+        """
+        Vectorized lookup of relative tree numbers and filenames; see
+        TreeIndex.lookup
+        """
+        i = np.asarray(abs_tree_ns, dtype=np.int64) - 1
+        fnames = np.array(self.fnames, dtype=object)
+        return (np.asarray(self.rel_tree_ns[i]),
+                fnames[np.asarray(self.file_ids[i])])
+
+    # trees
+
+    def get_bytes(self, abs_tree_n):
+        """
+        Return tree as labeled bracket string in bytes, without newline
+        """
+        if abs_tree_n not in self:
+            raise KeyError(abs_tree_n)
+        return self.data[self.offsets[abs_tree_n - 1]:
+                         self.offsets[abs_tree_n] - 1]
+
+    def get_tree(self, abs_tree_n, encoding="utf-8", parse=False):
+        """
+        Return tree as labeled bracket string, or as baleen.tree.Tree
+        instance if parse is True
+        """
+        lbs = self.get_bytes(abs_tree_n).decode(encoding)
+        return Tree.from_string(lbs) if parse else lbs
+
+    def get_node_spans(self, abs_tree_n):
+        """
+        Return byte spans (starts, ends) of all nodes of a tree relative to
+        the start of the tree; see node_spans
+        """
+        try:
+            return self._spans[abs_tree_n]
+        except KeyError:
+            pass
+        if len(self._spans) >= 10000:
+            self._spans.clear()
+        starts, ends = node_spans(self.get_bytes(abs_tree_n))
+        spans = self._spans[abs_tree_n] = (np.array(starts, dtype=np.int64),
+                                           np.array(ends, dtype=np.int64))
+        return spans
+
+    def get_spans(self, abs_tree_ns, node_ns):
+        """
+        Return byte spans of nodes relative to the start of their trees
+
+        Parameters
+        ----------
+        abs_tree_ns: array-like of int
+            absolute tree numbers, counting from 1
+        node_ns: array-like of int
+            node numbers, counting from 1
+
+        Returns
+        -------
+        starts: numpy.ndarray
+        ends: numpy.ndarray
+        """
+        abs_tree_ns = np.asarray(abs_tree_ns, dtype=np.int64)
+        node_ns = np.asarray(node_ns, dtype=np.int64)
+        starts = np.empty(len(node_ns), dtype=np.int64)
+        ends = np.empty(len(node_ns), dtype=np.int64)
+
+        # spans are computed once per tree
+        order = np.argsort(abs_tree_ns, kind="stable")
+        tree_ns, first = np.unique(abs_tree_ns[order], return_index=True)
+
+        for tree_n, positions in zip(tree_ns.tolist(),
+                                     np.split(order, first[1:])):
+            tree_starts, tree_ends = self.get_node_spans(tree_n)
+            i = node_ns[positions] - 1
+            starts[positions] = tree_starts[i]
+            ends[positions] = tree_ends[i]
+
+        return starts, ends
+
+    def decode(self, abs_tree_ns, starts, ends, encoding="utf-8"):
+        """
+        Return list of the strings at the given spans
+        """
+        data, offsets = self.data, self.offsets
+        return [data[offsets[tree_n - 1] + start:
+                     offsets[tree_n - 1] + end].decode(encoding)
+                for tree_n, start, end in zip(
+                    np.asarray(abs_tree_ns).tolist(),
+                    np.asarray(starts).tolist(), np.asarray(ends).tolist())]
+
+    # nodes, as in tredev.nodes.Nodes
+
+    def get_node_id(self, abs_tree_n, node_n):
+        return int(self.get_node_ids([abs_tree_n], [node_n])[0])
+
+    def get_subtree(self, node_id):
+        return self.get_subtrees([node_id])[0]
+
+    def get_substring(self, node_id):
+        return self.get_substrings([node_id])[0]
+
+    def get_node_ids(self, abs_tree_ns, node_ns):
+        """
+        Return node ids, i.e. byte offsets of nodes in the store
+        """
+        abs_tree_ns = np.asarray(abs_tree_ns, dtype=np.int64)
+        starts, _ = self.get_spans(abs_tree_ns, node_ns)
+        return np.asarray(self.offsets)[abs_tree_ns - 1] + starts
+
+    def _id_spans(self, node_ids):
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        i = np.searchsorted(self.offsets, node_ids, side="right") - 1
+        starts = node_ids - np.asarray(self.offsets)[i]
+        tree_starts = np.empty(len(node_ids), dtype=np.int64)
+        tree_ends = np.empty(len(node_ids), dtype=np.int64)
+
+        for j, (tree_n, start) in enumerate(zip((i + 1).tolist(),
+                                                starts.tolist())):
+            spans = self.get_node_spans(tree_n)
+            tree_starts[j] = start
+            tree_ends[j] = spans[1][np.searchsorted(spans[0], start)]
+
+        return i + 1, tree_starts, tree_ends
+
+    def get_subtrees(self, node_ids):
+        return self.decode(*self._id_spans(node_ids))
+
+    def get_substrings(self, node_ids):
+        return tree_yields(self.get_subtrees(node_ids))
+
+    # span tables
+
+    def subtrees(self, matches):
+        """
+        Return the subtrees of matches as list of labeled bracket strings
+
+        Matches are either a span table (see Matches.from_patterns) or
+        ordinary matches. Where a span table has a non-null value in a
+        column subtree, e.g. after post-processing, that value is used
+        instead of its span.
+        """
+        if not all(column in matches for column in SPAN_COLUMNS):
+            return list(matches["subtree"])
+
+        subtrees = np.empty(len(matches), dtype=object)
+        if "subtree" in matches:
+            overlay = matches["subtree"].notnull().values
+            subtrees[overlay] = matches["subtree"].values[overlay]
+        else:
+            overlay = np.zeros(len(matches), dtype=bool)
+
+        spans = [matches[column].values[~overlay]
+                 for column in SPAN_COLUMNS]
+        subtrees[~overlay] = self.decode(*spans)
+        return subtrees.tolist()
+
+    def substrings(self, matches):
+        """
+        Return the substrings of matches as list of strings; see subtrees
+        """
+        if not all(column in matches for column in SPAN_COLUMNS):
+            return list(matches["substr"])
+
+        substrings = np.empty(len(matches), dtype=object)
+        if "substr" in matches:
+            overlay = matches["substr"].notnull().values
+            substrings[overlay] = matches["substr"].values[overlay]
+        else:
+            overlay = np.zeros(len(matches), dtype=bool)
+
+        substrings[~overlay] = tree_yields(self.subtrees(matches[~overlay]))
+        return substrings.tolist()
+
+    def materialize(self, matches):
+        """
+        Add the columns subtree and substr to a span table in place,
+        decoding all subtrees from the store, and return it
+        """
+        subtrees = self.subtrees(matches)
+        substrings = self.substrings(matches)
+        matches["subtree"] = subtrees
+        matches["substr"] = substrings
+        return matches
@@ -1,38 +1,318 @@
 """
 Trace transformation of matches
+
+The derivations of merged matches (see baleen.trans.wrap.merge_matches)
+form a forest, with original matches as roots. A DerivationGraph holds this
+forest as arrays over the positions of matches: the ancestor of each match,
+its immediate descendants in compressed sparse row (CSR) format and, as
+node attributes, its origin, its depth and its transformation. It answers
+queries without scanning the table of matches, and can be saved to and
+loaded from a directory of memory-mapped NumPy arrays:
+
+    graph = DerivationGraph.from_matches(merged)
+    graph.derived_from(42)
+    graph.produced_by("passive_to_active")
+    graph.save("derivations")
+
+    print_derivations(merged, "derivations.txt", graph=graph)
 """
 
+import json
+import os
+from os.path import join
+import sys
+
+import numpy as np
+import pandas as pd
+
+from baleen.trans.wrap import get_descendants, get_origins
+
+
+def get_depths(ancestors):
+    """
+    Number of transformations from its origin to every match, by pointer
+    jumping
+
+    Parameters
+    ----------
+    ancestors: numpy.ndarray
+        position of the ancestor of each match, -1 for original matches
+
+    Returns
+    -------
+    depths: numpy.ndarray
+        depth of each match, 0 for original matches
+    """
+    positions = np.arange(len(ancestors))
+    jumps = np.where(ancestors < 0, positions, ancestors)
+    depths = (ancestors >= 0).astype(np.int64)
+
+    # every jump doubles the number of ancestor links followed, adding
+    # their number of transformations
+    while True:
+        jumped = jumps[jumps]
+        if (jumped == jumps).all():
+            return depths
+        depths = depths + depths[jumps]
+        jumps = jumped
+
 
+def _group(keys, n_keys):
+    # positions grouped by key in CSR format, ignoring negative keys
+    order = np.argsort(keys, kind="stable")
+    order = order[keys[order] >= 0]
+    offsets = np.zeros(n_keys + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys[order], minlength=n_keys), out=offsets[1:])
+    return offsets, order
 
-def print_derivations(matches, outf=None):
+
+class DerivationGraph(object):
+    """
+    Derivation forest of merged matches
+
+    Arrays are indexed by the position of matches in the table of merged
+    matches; the index labels of matches are in attribute index.
+
+    Attributes
+    ----------
+    index: pandas.Index
+        index label of the match at each position
+    ancestors: numpy.ndarray
+        position of ancestor, -1 for original matches
+    offsets, descendants: numpy.ndarray
+        immediate descendants of the match at position i are
+        descendants[offsets[i]:offsets[i + 1]]
+    origins: numpy.ndarray
+        position of origin, i.e. own position for original matches
+    depths: numpy.ndarray
+        number of transformations from origin
+    trans_ids: numpy.ndarray
+        position of transformation name in trans_names, -1 for original
+        matches
+    trans_names: list of str
+        names of transformations
+    """
+
+    # arrays saved as .npy files, besides a numeric index
+    arrays = ["ancestors", "offsets", "descendants", "origins", "depths",
+              "trans_ids"]
+
+    def __init__(self, index, ancestors, offsets, descendants, origins,
+                 depths, trans_ids, trans_names):
+        self.index = pd.Index(index)
+        self.ancestors = ancestors
+        self.offsets = offsets
+        self.descendants = descendants
+        self.origins = origins
+        self.depths = depths
+        self.trans_ids = trans_ids
+        self.trans_names = list(trans_names)
+        # matches grouped by origin and by transformation
+        self._origin_offsets, self._by_origin = _group(origins,
+                                                       len(origins))
+        self._trans_offsets, self._by_trans = _group(trans_ids,
+                                                     len(self.trans_names))
+
+    @classmethod
+    def from_matches(cls, matches):
+        """
+        Build the derivation graph of merged matches
+        """
+        index = matches.index
+        ancestors = index.get_indexer(matches["ancestor"])
+        offsets, descendants = get_descendants(ancestors)
+        trans_ids, trans_names = pd.factorize(
+            matches["trans_name"].astype(object))
+        return cls(index, ancestors, offsets, descendants,
+                   get_origins(ancestors), get_depths(ancestors),
+                   trans_ids.astype(np.int64), list(trans_names))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a derivation graph saved to directory path
+        """
+        with open(join(path, "graph.json")) as inf:
+            info = json.load(inf)
+
+        if "index" in info:
+            index = info["index"]
+        else:
+            index = np.load(join(path, "index.npy"), mmap_mode="r")
+        arrays = [np.load(join(path, name + ".npy"), mmap_mode="r")
+                  for name in cls.arrays]
+        return cls(index, *arrays, trans_names=info["trans_names"])
+
+    def save(self, path):
+        """
+        Save derivation graph to directory path, with one .npy file per
+        array and the names of transformations in graph.json
+        
+        A numeric index is saved as index.npy too, whereas other index 
+        labels (e.g. strings), which can not be memory-mapped, are saved in
+        graph.json.
+        """
+        os.makedirs(path, exist_ok=True)
+        info = {"n_matches": len(self), "trans_names": self.trans_names}
+
+        for name in self.arrays:
+            np.save(join(path, name + ".npy"),
+                    np.asarray(getattr(self, name)))
+            
+        index_fname = join(path, "index.npy")
+        if self.index.dtype.kind in "iu":
+            np.save(index_fname, self.index.values)
+        else:
+            info["index"] = self.index.tolist()
+            if os.path.exists(index_fname):
+                # from saving another graph before
+                os.remove(index_fname)
+
+        with open(join(path, "graph.json"), "w") as outf:
+            json.dump(info, outf)
+
+    def __len__(self):
+        return len(self.ancestors)
+
+    def _labels(self, positions):
+        return self.index.values[positions]
+
+    def roots(self, derived_only=True):
+        """
+        Return labels of original matches, by default only those from
+        which other matches are derived
+        """
+        roots = self.ancestors < 0
+        if derived_only:
+            roots &= np.diff(self.offsets) > 0
+        return self._labels(np.flatnonzero(roots))
+
+    def children(self, label):
+        """
+        Return labels of the matches derived from a match in a single
+        transformation
+        """
+        i = self.index.get_loc(label)
+        return self._labels(self.descendants[self.offsets[i]:
+                                             self.offsets[i + 1]])
+
+    def derived_from(self, label):
+        """
+        Return labels of all matches derived from a match, in order of
+        position
+        """
+        i = self.index.get_loc(label)
+
+        if self.ancestors[i] < 0:
+            positions = self._by_origin[self._origin_offsets[i]:
+                                        self._origin_offsets[i + 1]]
+            return self._labels(positions[positions != i])
+
+        positions = []
+        stack = [i]
+        while stack:
+            j = stack.pop()
+            derived = self.descendants[self.offsets[j]:self.offsets[j + 1]]
+            positions.extend(derived.tolist())
+            stack.extend(derived.tolist())
+        return self._labels(np.sort(np.array(positions, dtype=np.int64)))
+
+    def produced_by(self, trans_name):
+        """
+        Return labels of all matches produced by a transformation
+        """
+        try:
+            t = self.trans_names.index(trans_name)
+        except ValueError:
+            return self._labels(np.empty(0, dtype=np.int64))
+        return self._labels(self._by_trans[self._trans_offsets[t]:
+                                           self._trans_offsets[t + 1]])
+
+    def path(self, label):
+        """
+        Return labels of the matches from origin to a match, and the names
+        of the transformations between them
+        """
+        i = self.index.get_loc(label)
+        positions = [i]
+        while self.ancestors[positions[-1]] >= 0:
+            positions.append(self.ancestors[positions[-1]])
+        positions.reverse()
+        names = [self.trans_names[self.trans_ids[j]] for j in positions[1:]]
+        return self._labels(np.array(positions, dtype=np.int64)), names
+
+    def edges(self):
+        """
+        Return derivations as edge list with columns ancestor, index and
+        trans_name
+        """
+        derived = np.flatnonzero(self.ancestors >= 0)
+        trans_names = np.array(self.trans_names + [None], dtype=object)
+        return pd.DataFrame({
+            "ancestor": self._labels(self.ancestors[derived]),
+            "index": self._labels(derived),
+            "trans_name": trans_names[self.trans_ids[derived]]})
+
+
+def print_derivations(matches, outf=None, graph=None, buffer_size=10000):
     """
     Print derivations showing transformation of original matches into
-    transformed matches    
-    
+    transformed matches
+
     Parameters
     ----------
     matches: pandas.DataFrame
-        transformed matches    
+        transformed matches
+    outf: str or file, optional
+        name of output file or file object; defaults to stdout
+    graph: DerivationGraph instance, optional
+        derivation graph of matches, if built already
+    buffer_size: int, optional
+        number of lines written at once
     """
+    if graph is None:
+        graph = DerivationGraph.from_matches(matches)
+
     if isinstance(outf, str):
-        outf = open(outf, "w")
-        
-    def print_steps(index, indent=0):
-        print(indent * " ", matches.at[index, "substr"], file=outf) 
-        for i in matches.at[index, "descendants"] or []:
-            print((indent + 4) * " ", "===", matches.at[i, "trans_name"], 
-                  "===>", file=outf)
-            print_steps(i, indent + 8)
-    
+        with open(outf, "w") as outf:
+            return print_derivations(matches, outf, graph, buffer_size)
+
+    outf = outf or sys.stdout
+    substrings = matches["substr"].tolist()
+    trans_names = matches["trans_name"].tolist()
+    labels = matches["label"].tolist()
+    index = matches.index.tolist()
+    offsets = graph.offsets.tolist()
+    descendants = graph.descendants.tolist()
+    rule = 78 * "-" + "\n"
+    lines = []
+
     # Select matches on top of derivations (exclude matches embedded in larger
     # derivations)
-    indices = matches.index[~matches["descendants"].isnull() & 
-                            matches["ancestor"].isnull()]
-    
-    for n, index in enumerate(indices):
-        print(78 * "-", file=outf)
-        print(n+1, ":", matches.at[index, "label"], "(", index, ")", 
-              file=outf)
-        print(78 * "-", file=outf)
-        print_steps(index)
-        print(file=outf)
+    tops = np.flatnonzero((graph.ancestors < 0) &
+                          (np.diff(graph.offsets) > 0)).tolist()
+
+    for n, top in enumerate(tops):
+        lines.append(rule)
+        lines.append("{} : {} ( {} )\n".format(n + 1, labels[top],
+                                               index[top]))
+        lines.append(rule)
+        # depth-first, with descendants in order
+        stack = [(top, 0)]
+
+        while stack:
+            i, indent = stack.pop()
+            if indent:
+                lines.append("{} === {} ===>\n".format((indent - 4) * " ",
+                                                       trans_names[i]))
+            lines.append("{} {}\n".format(indent * " ", substrings[i]))
+            stack.extend((j, indent + 8)
+                         for j in reversed(descendants[offsets[i]:
+                                                       offsets[i + 1]]))
+            if len(lines) >= buffer_size:
+                outf.write("".join(lines))
+                lines = []
+
+        lines.append("\n")
+
+    outf.write("".join(lines))
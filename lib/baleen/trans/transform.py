@@ -3,12 +3,37 @@
 """
 Apply tree transformations to matches
 
+Run with three arguments to transform pickled tuples from a file, or with
+--serve to run as a long-lived worker (see baleen.trans.wrap.TransformWorker)
+which keeps compiled transformations loaded and reads requests from stdin,
+writing responses to stdout. Requests and responses are lines of 
+tab-separated fields, where backslash, tab and newline characters within a 
+field are escaped:
+
+  load <transforms file 1> ... <transforms file k>  -> ok <number of transforms>
+  budget <max depth> <max derived>                  -> ok <max depth> <max derived>
+  transform <n>                                     -> ok <m>
+  <index> <ancestor> <name> <tree> (n lines)           <index> <ancestor> <name> <tree> (m lines)
+  quit
+
+Each transform request is a batch of original tuples, with empty ancestor 
+and name fields. The response contains the well-formed original tuples 
+followed by the derived tuples, numbered from the highest index in the batch.
+Failures are reported as "error <message>" and leave the worker running.
+
+Transformations are applied until no transformation yields a new tree, 
+within a budget of MAX_DEPTH steps and MAX_DERIVED derived trees per 
+original tree (see jython_common.py). Earlier versions applied each 
+transformation once, in order; the budget arguments or request bound the
+derivations instead.
+
 Requires:
 - Jython 2.7 from http://www.jython.org/
 - stanford-tregex.jar in Stanford Tregex package 
   from http://nlp.stanford.edu/software/tregex.shtml 
 """
 
+import os
 import re
 import sys
 import pickle
@@ -42,11 +67,18 @@ try:
     from edu.stanford.nlp.trees.tregex import TregexPattern
     from edu.stanford.nlp.trees.tregex.tsurgeon import Tsurgeon
     from edu.stanford.nlp.ling import Sentence
+    from java.lang import Throwable
 #except ImportError as error:
 except ImportError, error:
     print error
     sys.exit(hint)
 
+# line protocol shared with baleen/server.py
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jython_common import (MAX_DEPTH, MAX_DERIVED, Tuple, read_fields, 
+                           write_fields)
+from jython_common import apply_transforms as apply_to_fixpoint
+
 
     
 # Prefix "sc_" indicates a Java object from Stanford CoreNLP, e.g. sc_tree is
@@ -54,34 +86,47 @@ except ImportError, error:
 
     
 
-Tuple = namedtuple("Tuple", ["ancestor",   # index of ancestor match
-                             "name",       # name of transformation
-                             "subtree"     # subtree as Java Tree object
-                             ])
-
-
-
-def transform_matches(tuples, transforms, tuples_fname=None):
+def transform_matches(tuples, transforms, tuples_fname=None, 
+                      max_depth=MAX_DEPTH, max_derived=MAX_DERIVED):
     if isinstance(tuples, str):
         tuples = read_tuples(tuples)        
         
     if isinstance(transforms, str):
         transforms = read_transformations(transforms)
         
-    max_index = max(tuples.keys())
-    
-    for name, (pattern, operation) in transforms.items():
-        sc_pattern = TregexPattern.compile(pattern)
-        sc_operation = Tsurgeon.parseOperation(operation) 
-        max_index = apply_transform(name, sc_pattern, sc_operation, tuples,
-                                    max_index)
+    apply_transforms(compile_transforms(transforms), tuples, 
+                     int(max_depth), int(max_derived))
         
     if tuples_fname:
         write_tuples(tuples, tuples_fname)
         
+        
+def compile_transforms(transforms):
+    return [(name, TregexPattern.compile(pattern), 
+             Tsurgeon.parseOperation(operation))
+            for name, (pattern, operation) in transforms.items()]
+
+
+def apply_transforms(sc_transforms, tuples, max_depth=MAX_DEPTH, 
+                     max_derived=MAX_DERIVED):
+    # Transformations are applied to a fixpoint within the budget, and 
+    # derived trees are deduplicated by their canonical labeled bracket 
+    # string; see jython_common.apply_transforms
+    transforms = [(name, make_transform(sc_pattern, sc_operation))
+                  for name, sc_pattern, sc_operation in sc_transforms]
+    apply_to_fixpoint(transforms, tuples, key=Tree.toString, 
+                      max_depth=max_depth, max_derived=max_derived)
+    
+    
+def make_transform(sc_pattern, sc_operation):
+    def transform(tuples, indices):
+        return apply_transform(sc_pattern, sc_operation, tuples, indices)
+    return transform
+        
 
 def read_tuples(fname):
-    tuples = {}
+    # ordered, so that derived tuples are numbered deterministically
+    tuples = OrderedDict()
     
     for (index, ancestor, name, lbs_tree) in pickle.load(open(fname, "rb")):
         sc_tree = Tree.valueOf(lbs_tree)
@@ -109,17 +154,24 @@ def read_transformations(fname):
                         for i in range(0, len(parts), 3) )
 
 
-def apply_transform(name, sc_pattern, sc_operation, tuples, max_index):
-    # FIXME: exhaustive application by reapplying same transformation on
-    # only the trees it generated
+def apply_transform(sc_pattern, sc_operation, tuples, indices):
+    # Generate (ancestor index, transformed tree) for every tuple among 
+    # indices which is changed by the transformation
+    
+    # Select candidate trees first, because trees not matching the pattern
+    # are left unchanged by the operation and thus never yield new trees
+    ancestor_indices = [index for index in indices
+                        if sc_pattern.matcher(tuples[index].subtree).find()]
     
-    # Copy input trees first because tsurgeon operations are destructive
-    transformed_trees = [t.subtree.deepCopy() for t in tuples.values()]
+    # Copy candidate trees because tsurgeon operations are destructive
+    transformed_trees = [tuples[index].subtree.deepCopy() 
+                         for index in ancestor_indices]
 
     Tsurgeon.processPatternOnTrees(sc_pattern, sc_operation,
                                    transformed_trees)
     
-    for trans_tree, ancestor_index in zip(transformed_trees, tuples):
+    for trans_tree, ancestor_index in zip(transformed_trees, 
+                                          ancestor_indices):
         # Trimmed trees are obtained by parsing the labeled bracket string
         # using Tree.valueOf. Among other things, this flattens the tree.
         # E.g. (NP (NP x)) becomes (NP x). In order to compare trimmed trees
@@ -132,10 +184,7 @@ def apply_transform(name, sc_pattern, sc_operation, tuples, max_index):
         ancestor_tree = tuples[ancestor_index].subtree
         
         if trans_tree and trans_tree != ancestor_tree:
-            max_index += 1
-            tuples[max_index] = Tuple(ancestor_index, name, trans_tree)
-            
-    return max_index
+            yield ancestor_index, trans_tree
 
 
 def write_tuples(sc_tuples, fname):
@@ -144,6 +193,58 @@ def write_tuples(sc_tuples, fname):
     pickle.dump(lbs_tuples, open(fname, "wb"))
 
     
+def serve(inf=sys.stdin, outf=sys.stdout):
+    sc_transforms = []
+    budget = MAX_DEPTH, MAX_DERIVED
+    
+    while True:
+        fields = read_fields(inf)
+        
+        if not fields or fields[0] == "quit":
+            break
+        
+        try:
+            if fields[0] == "load":
+                transforms = OrderedDict()
+                for fname in fields[1:]:
+                    transforms.update(read_transformations(fname))
+                sc_transforms = compile_transforms(transforms)
+                lines = [] 
+                result = len(sc_transforms)
+            elif fields[0] == "budget":
+                budget = int(fields[1]), int(fields[2])
+                lines = []
+                result = "%d %d" % budget
+            elif fields[0] == "transform":
+                # read the whole batch before transforming, so that an error
+                # does not leave unread tuples on stdin
+                batch = [read_fields(inf) for _ in range(int(fields[1]))]
+                tuples = OrderedDict()
+                
+                for index, ancestor, name, lbs_tree in batch:
+                    sc_tree = Tree.valueOf(lbs_tree)
+                    if sc_tree:
+                        tuples[int(index)] = Tuple(None, None, sc_tree)
+                        
+                apply_transforms(sc_transforms, tuples, *budget)
+                lines = [(index, 
+                          "" if tup.ancestor is None else tup.ancestor, 
+                          tup.name or "", 
+                          Tree.toString(tup.subtree))
+                         for index, tup in tuples.items()]
+                result = len(lines)
+            else:
+                raise ValueError("unknown request " + fields[0])
+        except (Exception, Throwable), error:
+            write_fields(outf, "error", str(error))
+        else:
+            write_fields(outf, "ok", result)
+            for line in lines:
+                write_fields(outf, *line)
+                
+        outf.flush()
+
+    
 def report(tuples):
     for index, tup in tuples.items():
         if tup.name:
@@ -161,11 +262,15 @@ def report(tuples):
 if __name__ == "__main__":    
     import sys
     
-    if len(sys.argv) == 4:
-        transform_matches(*sys.argv[1:4])
+    if sys.argv[1:] == ["--serve"]:
+        serve()
+    elif 4 <= len(sys.argv) <= 6:
+        transform_matches(*sys.argv[1:])
     else:
         sys.exit("Usage: transform.py original-tuples-file "
-                 "transformations-file transformed-tuples-file")
+                 "transformations-file transformed-tuples-file "
+                 "[max-depth [max-derived]]\n"
+                 "       transform.py --serve")
     
     
     
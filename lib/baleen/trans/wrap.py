@@ -2,33 +2,51 @@
 Wrapper for transformation of matches  
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import os
 import pickle
 import subprocess
 import sys
 import tempfile
+import threading
 
+import numpy as np
 import pandas as pd
 
-from baleen.utils import tree_yield
+from baleen.columnar import compact_matches, read_matches, write_matches
+from baleen.instrument import active_collector, timer
+from baleen.jython_common import MAX_DEPTH, MAX_DERIVED
+from baleen.tree import as_string
+from baleen.utils import tree_yields
+from baleen.worker import Worker, WorkerError
 
 
 
 def transform_matches(org_matches, transform_fname, trans_matches_fname=None,
                       org_tuples_fname=None, jython_exec="jython", 
-                      jython_path=None, class_path=None):
+                      jython_path=None, class_path=None, worker=None,
+                      batch_size=10000, max_depth=None, max_derived=None,
+                      n_jobs=1, store=None):
     """
     Transform matches by applying tree transformations
     
+    Transformations are reapplied to derived matches until none yields a 
+    new match or the budget of max_depth steps and max_derived matches per
+    original match is exhausted. Matches derived from the same original 
+    match are deduplicated.
+    
     Parameters
     ----------
     org_matches: pandas.DataFrame or str
-        original matches or name of file with pickled original matches
+        original matches or name of file/directory with original matches;
+        see baleen.columnar.read_matches
     transform_fname: str or list
         name of file with definitions of tree transformations or
         list of filenames
     trans_matches_fname: str
-        name of file for outputting transformed matches
+        name of directory for outputting transformed matches as a Parquet
+        dataset partitioned by label, or of file for pickled matches if it
+        ends in .pkl; see baleen.columnar.write_matches
     org_tuples_fname: str
         name of file for outputting original matches. This is normally a
         temp file, but in order to run the transform.py Jython script from 
@@ -41,6 +59,24 @@ def transform_matches(org_matches, transform_fname, trans_matches_fname=None,
     class_path: str
         value assigned to JYTHONPATH/CLASSPATH environment variable:
         use with Jython 2.5 on Linux
+    worker: TransformWorker instance or list of instances, optional
+        long-lived transform worker to stream matches through in batches,
+        instead of spawning transform.py on pickled tuples; 
+        see TransformWorker. Given several workers, matches are sharded 
+        over them and transformed in parallel.
+    batch_size: int, optional
+        number of original matches per batch sent to the worker
+    max_depth: int, optional
+        maximum number of transformation steps from an original match;
+        defaults to MAX_DEPTH in baleen.jython_common
+    max_derived: int, optional
+        maximum number of matches derived from an original match;
+        defaults to MAX_DERIVED in baleen.jython_common
+    n_jobs: int, optional
+        number of transform workers to start for this call, if no worker is
+        given, each transforming a shard of the matches in parallel
+    store: baleen.store.CorpusStore instance, optional
+        store to read the subtrees of original matches in a span table from
         
     Returns
     -------
@@ -52,17 +88,96 @@ def transform_matches(org_matches, transform_fname, trans_matches_fname=None,
     # STEP 1: Export original matches to tuples
     # ------------------------------------------------------------------------
     if isinstance(org_matches, str): 
-        org_matches = pd.read_pickle(org_matches)
+        org_matches = read_matches(org_matches)
+        
+    with timer("transform_matches", "phase", "export"):
+        org_tuples = matches_to_tuples(org_matches, store)
+        
+    # ------------------------------------------------------------------------
+    # STEP 2: Transform tuples 
+    # ------------------------------------------------------------------------
+    trans_tuples = transform_tuples(org_tuples, transform_fname, 
+                                    org_tuples_fname=org_tuples_fname,
+                                    jython_exec=jython_exec, 
+                                    jython_path=jython_path,
+                                    class_path=class_path, worker=worker,
+                                    batch_size=batch_size, 
+                                    max_depth=max_depth,
+                                    max_derived=max_derived, n_jobs=n_jobs)
+    
+    # ------------------------------------------------------------------------
+    # STEP 3: Import transformed matches from tuples       
+    # ------------------------------------------------------------------------
+    with timer("transform_matches", "phase", "import"):
+        trans_matches = tuples_to_matches(trans_tuples)
+    
+    # ------------------------------------------------------------------------
+    # STEP 4: Merge original and transformed matches
+    # ------------------------------------------------------------------------
+    return _merge_and_write(org_matches, trans_matches, trans_matches_fname)
+
 
+def transform_tuples(org_tuples, transform_fname, org_tuples_fname=None,
+                     jython_exec="jython", jython_path=None, class_path=None,
+                     worker=None, batch_size=10000, max_depth=None, 
+                     max_derived=None, n_jobs=1):
+    """
+    Transform original tuples by applying tree transformations
+    
+    Parameters
+    ----------
+    org_tuples: list of tuples
+        original tuples as returned by matches_to_tuples
+    transform_fname, org_tuples_fname, jython_exec, jython_path, class_path,
+    worker, batch_size, max_depth, max_derived, n_jobs: optional
+        see transform_matches
+        
+    Returns
+    -------
+    list of tuples
+        well-formed original tuples followed by the derived tuples in order
+        of index; see TransformWorker.transform for their numbering
+    """
+    max_index = get_max_index(org_tuples)
+    
     if org_tuples_fname:
-        org_tuples_file = open(org_tuples_fname, "wb")
-    else:
+        with timer("transform_matches", "phase", "export"):
+            # force protocol 2, because Jython is at python2
+            pickle.dump(org_tuples, open(org_tuples_fname, "wb"), 
+                        protocol=2)
+            
+    if worker is not None or n_jobs > 1:
+        if worker is None:
+            workers = [TransformWorker(jython_exec=jython_exec, 
+                                       jython_path=jython_path, 
+                                       class_path=class_path)
+                       for _ in range(n_jobs)]
+        elif isinstance(worker, TransformWorker):
+            workers = [worker]
+        else:
+            workers = list(worker)
+            
+        try:
+            with timer("transform_matches", "phase", "transform"):
+                trans_tuples = transform_shards(
+                    org_tuples, workers, transform_fname, 
+                    batch_size=batch_size, max_depth=max_depth,
+                    max_derived=max_derived, max_index=max_index)
+        finally:
+            if worker is None:
+                for new_worker in workers:
+                    new_worker.close()
+                    
+        return order_tuples(trans_tuples)
+
+    if not org_tuples_fname:
         org_tuples_file = tempfile.NamedTemporaryFile()
-    export_to_tuples(org_matches, org_tuples_file.name)
+        org_tuples_fname = org_tuples_file.name
+        with timer("transform_matches", "phase", "export"):
+            pickle.dump(org_tuples, org_tuples_file, protocol=2)
+            org_tuples_file.flush()
     
-    # ------------------------------------------------------------------------
-    # STEP 2: Transform matches by spawning Jython script
-    # ------------------------------------------------------------------------
+    # Transform tuples by spawning Jython script
     trans_tuples_file = tempfile.NamedTemporaryFile()   
     
     if not isinstance(transform_fname, str):
@@ -81,7 +196,11 @@ def transform_matches(org_matches, transform_fname, trans_matches_fname=None,
                                 "transform.py") 
     
     args = [jython_exec, script_fname, 
-            org_tuples_file.name, transform_fname, trans_tuples_file.name]
+            org_tuples_fname, transform_fname, trans_tuples_file.name]
+    
+    if max_depth is not None or max_derived is not None:
+        args += [str(MAX_DEPTH if max_depth is None else max_depth),
+                 str(MAX_DERIVED if max_derived is None else max_derived)]
     
     # If given, set JYTHONPATH env var, otherwise assume it is set:
     # use with Jython 2.7 on Mac OS
@@ -94,23 +213,345 @@ def transform_matches(org_matches, transform_fname, trans_matches_fname=None,
     # Note: for some weird reason, setting *both* results in 
     # weird import errors on Linux...
  
-    subprocess.check_output(args)
+    with timer("transform_matches", "phase", "transform"):
+        subprocess.check_output(args)
 
+    with timer("transform_matches", "phase", "import"):
+        trans_tuples = pickle.load(open(trans_tuples_file.name, "rb"))
+        # number derived matches as the transform workers do
+        originals = [trans_tuple for trans_tuple in trans_tuples 
+                     if trans_tuple[1] is None]
+        return originals + renumber_tuples(trans_tuples, max_index)
+
+
+def _merge_and_write(org_matches, trans_matches, trans_matches_fname=None):
+    collector = active_collector()
     
-    # ------------------------------------------------------------------------
-    # STEP 3: Import transformed matches from tuples       
-    # ------------------------------------------------------------------------
-    trans_matches = import_from_tuples(trans_tuples_file.name)
+    if collector:
+        # number of matches generated by each transformation
+        counts = trans_matches["trans_name"].value_counts()
+        for name, count in counts.items():
+            collector.record("transform_matches", "transformation", name,
+                             generated=int(count))
     
-    # ------------------------------------------------------------------------
-    # STEP 4: Import transformed matches from tuples       
-    # ------------------------------------------------------------------------
-    merged_matches = merge_matches(org_matches, trans_matches)
+    with timer("transform_matches", "phase", "merge"):
+        merged_matches = merge_matches(org_matches, trans_matches)
     
     if trans_matches_fname:
-        pd.to_pickle(merged_matches, trans_matches_fname)
+        with timer("transform_matches", "phase", "write"):
+            write_matches(merged_matches, trans_matches_fname)
         
     return merged_matches
+
+
+class TransformWorker(Worker):
+    """
+    Client for a long-lived Jython transform worker
+    
+    Spawns transform.py in serve mode once. The worker keeps the compiled 
+    Tregex patterns and Tsurgeon operations loaded, and transforms batches 
+    of tuples streamed over its stdin/stdout as escaped tab-separated lines,
+    so the JVM start-up is paid only once per session and neither side 
+    holds more than a few batches in memory.
+    
+        with TransformWorker("transforms.txt", jython_path=jar) as worker:
+            for org_matches in ...:
+                transform_matches(org_matches, "transforms.txt", 
+                                  worker=worker)
+    
+    Parameters
+    ----------
+    transform_fname: str or list, optional
+        name of file with definitions of tree transformations or
+        list of filenames
+    jython_exec: str, optional
+        path to Jython executable
+    jython_path: str, optional
+        value assigned to JYTHONPATH environment variable
+    class_path: str, optional
+        value assigned to CLASSPATH environment variable
+    encoding: str, optional
+        encoding of the pipe
+    """
+    
+    def __init__(self, transform_fname=None, jython_exec="jython", 
+                 jython_path=None, class_path=None, encoding="utf-8"):
+        Worker.__init__(self, jython_exec=jython_exec, 
+                        jython_path=jython_path, class_path=class_path,
+                        encoding=encoding)
+        self.transform_fnames = None
+        self.n_transforms = None
+        self.budget = None
+        
+        if transform_fname:
+            self.load(transform_fname)
+            
+    def __enter__(self):
+        # unlike a Tregex/Tsurgeon worker, never the active worker
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+            
+    def script_args(self):
+        # get file path to current module (i.e. baleen.trans.wrap)
+        path = sys.modules[__name__].__file__
+        # and deduce file path to the Jython script in the same directory 
+        return [os.path.join(os.path.split(path)[0], "transform.py"), 
+                "--serve"]
+        
+    def load(self, transform_fname):
+        """
+        Load and compile the transformations, unless already loaded
+        """
+        if isinstance(transform_fname, str):
+            transform_fname = [transform_fname]
+        fnames = [os.path.abspath(fname) for fname in transform_fname]
+        
+        if fnames != self.transform_fnames or not self.alive:
+            restarted = not self.alive
+            self.n_transforms = int(self._request("load", *fnames))
+            self.transform_fnames = fnames
+            if restarted and self.budget:
+                self._request("budget", *self.budget)
+                
+    def set_budget(self, max_depth=None, max_derived=None):
+        """
+        Set the budget for derivations from a single original tuple;
+        see transform_matches
+        """
+        if max_depth is None and max_derived is None:
+            return
+        budget = (MAX_DEPTH if max_depth is None else max_depth,
+                  MAX_DERIVED if max_derived is None else max_derived)
+        
+        if budget != self.budget:
+            self._request("budget", *budget)
+            self.budget = budget
+            
+    def transform(self, tuples, batch_size=10000, max_index=None):
+        """
+        Transform original tuples in batches
+        
+        Batches are written to the worker from a separate thread, while
+        the results of earlier batches are read and generated, so results
+        can be consumed while the worker is still transforming. 
+        
+        Parameters
+        ----------
+        tuples: list of tuples
+            original tuples (index, ancestor, trans_name, subtree) as 
+            returned by matches_to_tuples
+        batch_size: int, optional
+            number of tuples per batch
+        max_index: int, optional
+            highest index used so far; by default the highest index of 
+            tuples, see get_max_index
+            
+        Returns
+        -------
+        generator of tuples
+            for each batch, its well-formed original tuples followed by 
+            the tuples derived from them. Derived tuples are numbered from 
+            max_index onwards, in order of the original tuple they derive 
+            from, so numbering does not depend on batch_size.
+        """
+        if self.transform_fnames is None:
+            raise WorkerError("no transformations loaded")
+        
+        # (re)start worker if needed
+        self.load(self.transform_fnames)
+        tuples = list(tuples)
+        batches = [tuples[i:i + batch_size] 
+                   for i in range(0, len(tuples), batch_size)]
+        if max_index is None:
+            max_index = get_max_index(tuples)
+        
+        def feed():
+            try:
+                for batch in batches:
+                    self._write("transform", len(batch))
+                    for index, _, _, subtree in batch:
+                        self._write(index, "", "", subtree)
+                    self.process.stdin.flush()
+            except (IOError, OSError, ValueError, AttributeError):
+                # worker was stopped
+                pass
+            
+        writer = threading.Thread(target=feed, daemon=True)
+        writer.start()
+        complete = False
+        
+        try:
+            for _ in batches:
+                try:
+                    fields = self._read()
+                    if fields[0] != "ok":
+                        raise WorkerError(fields[-1])
+                    lines = [self._read() for _ in range(int(fields[1]))]
+                except (IOError, OSError) as error:
+                    raise WorkerError(error)
+                
+                batch = [(int(index), 
+                          None if ancestor == "" else int(ancestor),
+                          name or None, 
+                          subtree)
+                         for index, ancestor, name, subtree in lines]
+                derived = renumber_tuples(batch, max_index)
+                for trans_tuple in batch:
+                    if trans_tuple[1] is None:
+                        yield trans_tuple
+                if derived:
+                    max_index = derived[-1][0]
+                yield from derived
+                    
+            complete = True
+        finally:
+            if not complete:
+                # responses to unread batches would desynchronize the pipe
+                self.process.kill()
+                self.process.wait()
+                self.process = None
+            writer.join()
+            
+            
+def get_max_index(tuples):
+    """
+    Return the highest index of original tuples, or -1 if there are none
+    
+    Derived tuples are numbered after the highest index of all tuples 
+    passed in for transformation, including ill-formed ones which are 
+    dropped, so that a derived tuple never takes the index of a dropped
+    original tuple.
+    """
+    return max([trans_tuple[0] for trans_tuple in tuples] + [-1])
+
+
+def renumber_tuples(tuples, max_index):
+    """
+    Renumber derived tuples in order of the original tuple they derive from
+    
+    As transformations of different original tuples are independent, this
+    numbering is the same whether tuples are transformed at once, in 
+    batches or in parallel shards.
+    
+    Parameters
+    ----------
+    tuples: list of tuples
+        transformed tuples (index, ancestor, trans_name, subtree), where 
+        original tuples have ancestor None and each derived tuple comes 
+        after its ancestor
+    max_index: int
+        highest index used so far
+        
+    Returns
+    -------
+    list of tuples
+        derived tuples (index, ancestor, trans_name, subtree), numbered 
+        from max_index + 1 in order of the original tuple they derive from 
+    """
+    # position of original tuple each tuple derives from
+    origins = {}
+    # local index -> global index
+    indices = {}
+    derived = []
+    
+    for index, ancestor, name, subtree in tuples:
+        if ancestor is None:
+            origins[index] = len(origins)
+            indices[index] = index
+        else:
+            origins[index] = origins[ancestor]
+            derived.append((index, ancestor, name, subtree))
+            
+    # stable sort keeps ancestors before their descendants
+    derived.sort(key=lambda trans_tuple: origins[trans_tuple[0]])
+    renumbered = []
+    
+    for index, ancestor, name, subtree in derived:
+        max_index += 1
+        indices[index] = max_index
+        renumbered.append((max_index, indices[ancestor], name, subtree))
+        
+    return renumbered
+
+
+def transform_shards(tuples, workers, transform_fname, batch_size=10000,
+                     max_depth=None, max_derived=None, max_index=None):
+    """
+    Transform original tuples in parallel, one shard per worker
+    
+    Tuples are split into contiguous shards, each of which is streamed 
+    through its own worker process. Derived tuples are renumbered 
+    afterwards, so the result is identical to that of a single worker.
+    
+    Parameters
+    ----------
+    tuples: list of tuples
+        original tuples as returned by matches_to_tuples
+    workers: list of TransformWorker instances
+        transform workers
+    transform_fname: str or list
+        name of file with definitions of tree transformations or
+        list of filenames
+    batch_size: int, optional
+        number of tuples per batch
+    max_depth, max_derived: int, optional
+        budget for derivations; see transform_matches
+    max_index: int, optional
+        highest index used so far; by default the highest index of tuples,
+        see get_max_index
+        
+    Returns
+    -------
+    list of tuples
+        transformed tuples, for each shard its original tuples followed by
+        the tuples derived from them
+    """
+    tuples = list(tuples)
+    shard_size = max(1, -(-len(tuples) // len(workers)))
+    shards = [tuples[i:i + shard_size] 
+              for i in range(0, len(tuples), shard_size)]
+    
+    def transform_shard(worker, shard):
+        worker.load(transform_fname)
+        worker.set_budget(max_depth, max_derived)
+        return list(worker.transform(shard, batch_size=batch_size))
+    
+    # workers are separate processes, so threads suffice to drive them
+    with ThreadPoolExecutor(max(1, len(shards))) as executor:
+        results = list(executor.map(transform_shard, workers, shards))
+    
+    if max_index is None:
+        max_index = get_max_index(tuples)
+    trans_tuples = []
+    
+    for result in results:
+        derived = renumber_tuples(result, max_index)
+        trans_tuples.extend(trans_tuple for trans_tuple in result 
+                            if trans_tuple[1] is None)
+        trans_tuples.extend(derived)
+        if derived:
+            max_index = derived[-1][0]
+            
+    return trans_tuples
+    
+    
+def order_tuples(tuples):
+    """
+    Order transformed tuples as original tuples followed by derived tuples
+    in order of index, independent of how they were batched
+    """
+    originals, derived = [], []
+    
+    for trans_tuple in tuples:
+        if trans_tuple[1] is None:
+            originals.append(trans_tuple)
+        else:
+            derived.append(trans_tuple)
+            
+    derived.sort(key=lambda trans_tuple: trans_tuple[0])
+    return originals + derived
     
     
 
@@ -135,27 +576,42 @@ COLUMNS = ["index",           # index of transformed match (i.e. its own index)
            ]
 
 
-def export_to_tuples(matches, tuples_fname):
+def export_to_tuples(matches, tuples_fname, store=None):
     """
     Export selected columns from matches to tuples
     
     Parameters
     ----------
     matches: pandas.DataFrame instance
-        originally extracted matches with columns "index" and "subtree"
+        originally extracted matches with columns "index" and "subtree";
+        parsed subtrees (baleen.tree.Tree instances) are serialized, as
+        Jython reads labeled bracket strings
     tuples_fname: str
         filename for writing pickled tuples 
+    store: baleen.store.CorpusStore instance, optional
+        store to read subtrees from if matches are a span table
+    """
+    tuples = matches_to_tuples(matches, store)
+    # force protocol 2, because Jython is at python2 and thus cannot handle
+    # higher protocols
+    pickle.dump(tuples, open(tuples_fname, "wb"), protocol=2)
+    
+    
+def matches_to_tuples(matches, store=None):
+    """
+    Convert selected columns from matches to tuples; see export_to_tuples
     """
-    subset = matches[["subtree"]]
+    subtrees = (store.subtrees(matches) if store is not None 
+                else matches["subtree"])
+    subset = pd.DataFrame({"subtree": [as_string(subtree) 
+                                       for subtree in subtrees]},
+                          index=matches.index)
     subset["ancestor"] = None
     subset["trans_name"] = None
     subset.reset_index(inplace=True)
     # rearrange columns
     subset = subset[COLUMNS]
-    tuples = [tuple(r) for r in subset.values]
-    # force protocol 2, because Jython is at python2 and thus cannot handle
-    # higher protocols
-    pickle.dump(tuples, open(tuples_fname, "wb"), protocol=2)
+    return [tuple(r) for r in subset.values]
     
     
 def import_from_tuples(tuples_fname):
@@ -172,7 +628,13 @@ def import_from_tuples(tuples_fname):
     trans_matches: pandas.DataFrame instance
         transformed matches
     """
-    tuples = pickle.load(open(tuples_fname, "rb"))
+    return tuples_to_matches(pickle.load(open(tuples_fname, "rb")))
+
+
+def tuples_to_matches(tuples):
+    """
+    Convert tuples to transformed matches; see import_from_tuples
+    """
     trans_matches = pd.DataFrame(tuples, columns=COLUMNS)
     trans_matches.set_index("index", inplace=True)
     return trans_matches
@@ -192,56 +654,109 @@ def merge_matches(org_matches, trans_matches):
     Returns
     -------
     merged_matches: pandas.DataFrame
+        in compact layout; see baleen.columnar.compact_matches
     """
     # Remove column 'subtree' from original matches, because its values are
-    # included in the columns 'subtree' from the transformed matches
-    org_matches = org_matches.drop("subtree", axis=1)
+    # included in the columns 'subtree' from the transformed matches. 
+    # Spans of a span table (see baleen.store) do not apply to derived 
+    # subtrees, so they are removed as well.
+    org_matches = org_matches.drop(["subtree", "tree_id", "start", "end"], 
+                                   axis=1, errors="ignore")
     # Now join on the indices. The indices of transformed matches contain
     # almost all of the indices of original mathes, except for those that
     # were dropped during pruning because of ill-formed trees.
     merged_matches = trans_matches.join(org_matches)
-    # Add a new columns for tracking descendants and origin
-    merged_matches["descendants"] = None
-    merged_matches["origin"] = None
-    
+    index = merged_matches.index
     # Get indices of only transformed matches
-    indices = merged_matches.index[merged_matches["file"].isnull()]
-    # Columns to copy from ancestor to descendant
-    columns = ["pat_name", "label", "file", "rel_tree_n", "node_n"]
+    transformed = merged_matches["file"].isnull().values
+    if "substr" not in merged_matches:
+        merged_matches["substr"] = None
+    # Get indices of matches without substring: transformed matches and,
+    # for span tables, original matches which were not post-processed
+    indices = index[merged_matches["substr"].isnull().values]
     
-    # Now iterate over all transformed matches 
-    for i in indices:        
-        # Get ancenstor index (Why does this return a float!?)
-        j = int(merged_matches.at[i, 'ancestor'])
-        
-        # Copy info from ancestor to descendant        
-        merged_matches.loc[i, columns] = merged_matches.loc[j, columns]
-        
-        # Add current index to list of descendants of ancestor
-        try:
-            merged_matches.loc[j, "descendants"].append(i)
-        except AttributeError:
-            merged_matches.loc[j, "descendants"] = [i]
-        
-        # FIXME: this is rather inefficient
-        # follow chain of ancestors until origin is reached
-        # i.e. a match with no ancestor
-        while not pd.isnull(merged_matches.at[j, "ancestor"]):
-            j = int(merged_matches.at[j, "ancestor"])
+    # Position of ancestor of each match, -1 for original matches
+    ancestors = index.get_indexer(merged_matches["ancestor"])
+    origins = get_origins(ancestors)
+    
+    # Copy info from origin to descendants with one take per column
+    for column in ["pat_name", "label", "file", "rel_tree_n", "node_n"]:
+        merged_matches[column] = merged_matches[column].take(origins).values
         
-        merged_matches.at[i, "origin"] = j 
+    # Add new columns for tracking origin and descendants
+    labels = np.array(index.tolist() + [None], dtype=object)
+    merged_matches["origin"] = labels[np.where(transformed, origins, -1)]
+    
+    offsets, descendants = get_descendants(ancestors)
+    descendants = labels[descendants].tolist()
+    column = [None] * len(index)
+    for i in np.flatnonzero(np.diff(offsets)):
+        column[i] = descendants[offsets[i]:offsets[i + 1]]
+    merged_matches["descendants"] = column
         
-        # Derive substring from subtree
-        merged_matches.at[i, "substr"] = tree_yield(
-            merged_matches.at[i, "subtree"])
+    # Derive substrings from subtrees in one go
+    merged_matches.loc[indices, "substr"] = tree_yields(
+        merged_matches.loc[indices, "subtree"])
             
     # rearrange columns
     columns = ['pat_name', 'label', 'file', 'rel_tree_n', 'node_n',
                'subtree', 'substr', 'trans_name', 
                'origin', 'ancestor', 'descendants']
-    return merged_matches[columns]
+    return compact_matches(merged_matches.reindex(columns=columns))
         
 
     
     
     
+        
+        
+def get_origins(ancestors):
+    """
+    Resolve the origin of every match by pointer jumping
+    
+    Parameters
+    ----------
+    ancestors: numpy.ndarray
+        position of the ancestor of each match, -1 for original matches
+        
+    Returns
+    -------
+    origins: numpy.ndarray
+        position of the original match each match derives from, i.e. its 
+        own position for original matches
+    """
+    positions = np.arange(len(ancestors))
+    origins = np.where(ancestors < 0, positions, ancestors)
+    
+    # every jump doubles the number of ancestor links followed
+    while True:
+        jumped = origins[origins]
+        if (jumped == origins).all():
+            return origins
+        origins = jumped
+        
+        
+def get_descendants(ancestors):
+    """
+    Immediate descendants of every match in compressed sparse row format
+    
+    Parameters
+    ----------
+    ancestors: numpy.ndarray
+        position of the ancestor of each match, -1 for original matches
+        
+    Returns
+    -------
+    offsets: numpy.ndarray
+        the descendants of the match at position i are 
+        descendants[offsets[i]:offsets[i + 1]]
+    descendants: numpy.ndarray
+        positions of descendants, in order of position
+    """
+    derived = np.flatnonzero(ancestors >= 0)
+    # stable sort keeps descendants of the same ancestor in order
+    descendants = derived[np.argsort(ancestors[derived], kind="stable")]
+    counts = np.bincount(ancestors[derived], minlength=len(ancestors))
+    offsets = np.zeros(len(ancestors) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets, descendants
@@ -0,0 +1,507 @@
+"""
+Parsed trees in memory
+
+A tree is parsed once from its labeled bracket string (LBS) into flat integer
+arrays indexed by node position in pre-order, counting from 0. Leaves (words)
+are nodes too, so node number n as reported by Tregex is position n - 1.
+Labels and words are stored as ids into a vocabulary shared by many trees:
+trees read with read_corpus share a vocabulary per corpus, which is freed
+together with them, and other trees share the global vocabulary, which can
+be renewed with clear_vocabulary.
+
+Trees can be passed to every baleen stage that takes trees or subtrees as
+labeled bracket strings, e.g. baleen.utils.tree_yields,
+baleen.tsurgeon.edit_trees, baleen.postproc.post_process and
+baleen.trans.wrap.export_to_tuples, which serialize them only where an
+external tool requires strings.
+"""
+
+from array import array
+from collections import OrderedDict
+from glob import glob
+from os.path import join, getmtime, getsize, abspath
+import re
+
+
+token_re = re.compile(r"\(|\)|[^\s()]+")
+
+
+class Vocabulary(object):
+    """
+    Mapping between label/word strings and integer ids
+    """
+
+    __slots__ = ("ids", "strings")
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def __len__(self):
+        return len(self.strings)
+
+    def id(self, string):
+        """
+        Return id of string, adding it if it is new
+        """
+        try:
+            return self.ids[string]
+        except KeyError:
+            i = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+            return i
+
+
+# labels and words of trees not read with read_corpus
+vocabulary = Vocabulary()
+
+
+def clear_vocabulary():
+    """
+    Start a new global vocabulary for trees parsed from now on
+    
+    Existing trees keep using the old vocabulary, which is freed once they 
+    are all gone.
+    """
+    global vocabulary
+    vocabulary = Vocabulary()
+
+
+def _global_vocabulary():
+    # for functions with a vocabulary argument shadowing the global one
+    return vocabulary
+
+
+class Tree(object):
+    """
+    Parse tree as flat integer arrays in pre-order
+
+    Trees are immutable; editing results in new trees. Trees with the same
+    structure and labels compare and hash equal, so they can be used as
+    dict keys or deduplicated with pandas.unique.
+
+    Attributes
+    ----------
+    label_ids: array of int
+        vocabulary ids of node labels, i.e. syntactic categories or words
+    vocabulary: Vocabulary instance
+        vocabulary of the label ids
+    parents: array of int
+        position of parent node, -1 for the root
+    first_children: array of int
+        position of first child node, -1 if none
+    next_siblings: array of int
+        position of next sibling node, -1 if none
+    ends: array of int
+        position of the last node dominated by each node
+    lefts: array of int
+        leaf number (counting from 0) of the leftmost leaf under each node
+    rights: array of int
+        leaf number of the rightmost leaf under each node; for constituents
+        without words, rights is lefts - 1
+    """
+
+    __slots__ = ("label_ids", "parents", "first_children", "next_siblings",
+                 "ends", "lefts", "rights", "vocabulary", "_labels", 
+                 "_children", "_hash")
+
+    def __init__(self, label_ids, parents, first_children, next_siblings,
+                 ends, lefts, rights, vocabulary=None):
+        self.label_ids = array("i", label_ids)
+        self.parents = array("i", parents)
+        self.first_children = array("i", first_children)
+        self.next_siblings = array("i", next_siblings)
+        self.ends = array("i", ends)
+        self.lefts = array("i", lefts)
+        self.rights = array("i", rights)
+        if vocabulary is None:
+            vocabulary = _global_vocabulary()
+        self.vocabulary = vocabulary
+        self._labels = None
+        self._children = None
+        self._hash = None
+
+    def __len__(self):
+        return len(self.label_ids)
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        return NodeView(self, i % len(self))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield NodeView(self, i)
+
+    def __str__(self):
+        return self.to_string()
+
+    def __repr__(self):
+        return "Tree.from_string({!r})".format(self.to_string())
+
+    def __reduce__(self):
+        # pickle label strings, as ids are specific to the vocabulary of
+        # the current process
+        return (_unpickle_tree, (self.labels, self.parents,
+                                 self.first_children, self.next_siblings,
+                                 self.ends, self.lefts, self.rights))
+
+    def key(self):
+        """
+        Structural key, equal for trees with the same structure and labels,
+        whatever the vocabulary of their labels
+        """
+        strings = self.vocabulary.strings
+        return (tuple(strings[k] for k in self.label_ids), 
+                self.parents.tobytes(), self.lefts.tobytes(), 
+                self.rights.tobytes())
+
+    def __eq__(self, other):
+        if not isinstance(other, Tree):
+            return NotImplemented
+        if self is other:
+            return True
+        if self.vocabulary is other.vocabulary:
+            # compare label ids instead of strings
+            return (self.label_ids == other.label_ids and 
+                    self.parents == other.parents and
+                    self.lefts == other.lefts and self.rights == other.rights)
+        return self.key() == other.key()
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(self.key())
+        return self._hash
+
+    @property
+    def root(self):
+        return NodeView(self, 0)
+
+    @property
+    def labels(self):
+        """
+        Node labels as strings, built on first use
+        """
+        if self._labels is None:
+            strings = self.vocabulary.strings
+            self._labels = [strings[k] for k in self.label_ids]
+        return self._labels
+
+    @property
+    def children(self):
+        """
+        Positions of child nodes as list of lists, built on first use
+        """
+        if self._children is None:
+            first_children, next_siblings = (self.first_children,
+                                             self.next_siblings)
+            children = []
+            for i in range(len(self)):
+                kids = []
+                j = first_children[i]
+                while j >= 0:
+                    kids.append(j)
+                    j = next_siblings[j]
+                children.append(kids)
+            self._children = children
+        return self._children
+
+    @classmethod
+    def from_string(cls, lbs, vocabulary=None):
+        """
+        Parse tree from labeled bracket string, adding its labels to 
+        vocabulary (default is the global vocabulary)
+
+        Raises ValueError for ill-formed trees.
+        """
+        if vocabulary is None:
+            vocabulary = _global_vocabulary()
+        label_ids, parents, first_children, next_siblings = [], [], [], []
+        ends, lefts, rights = [], [], []
+        # position of last child added to each node
+        last_children = []
+        ids = vocabulary.id
+        stack = []
+        # True if previous token was an opening bracket, so next token is
+        # the label (the label may be missing, as in "( (S ...))")
+        opened = False
+        n_leaves = 0
+
+        def add(label):
+            i = len(label_ids)
+            parent = stack[-1] if stack else -1
+            label_ids.append(ids(label))
+            parents.append(parent)
+            first_children.append(-1)
+            next_siblings.append(-1)
+            last_children.append(-1)
+            ends.append(i)
+            lefts.append(n_leaves)
+            rights.append(n_leaves)
+            if parent >= 0:
+                if last_children[parent] < 0:
+                    first_children[parent] = i
+                else:
+                    next_siblings[last_children[parent]] = i
+                last_children[parent] = i
+            return i
+
+        for token in token_re.findall(lbs):
+            if token == "(":
+                if opened:
+                    stack.append(add(""))
+                if not stack and label_ids:
+                    raise ValueError("more than one tree: " + lbs)
+                opened = True
+            elif token == ")":
+                if opened:
+                    stack.append(add(""))
+                    opened = False
+                if not stack:
+                    raise ValueError("unbalanced brackets: " + lbs)
+                i = stack.pop()
+                ends[i] = len(label_ids) - 1
+                rights[i] = n_leaves - 1
+            elif opened:
+                stack.append(add(token))
+                opened = False
+            elif stack:
+                add(token)
+                n_leaves += 1
+            else:
+                raise ValueError("word outside brackets: " + lbs)
+
+        if stack or opened or not label_ids:
+            raise ValueError("unbalanced brackets: " + lbs)
+
+        return cls(label_ids, parents, first_children, next_siblings, ends,
+                   lefts, rights, vocabulary)
+
+    def is_word(self, i):
+        """
+        Return True if node i is a leaf (word) rather than a constituent
+        """
+        return self.first_children[i] < 0 and self.lefts[i] == self.rights[i]
+
+    def leaves(self):
+        """
+        Return positions of leaf nodes
+        """
+        first_children = self.first_children
+        return [i for i in range(len(self)) if first_children[i] < 0]
+
+    def words(self, i=0):
+        """
+        Return the words under node i, i.e. the tree yield as list
+        """
+        strings, label_ids = self.vocabulary.strings, self.label_ids
+        return [strings[label_ids[j]]
+                for j in range(i, self.ends[i] + 1) if self.is_word(j)]
+
+    def to_string(self, i=0):
+        """
+        Serialize the subtree under node i as labeled bracket string
+        """
+        strings, label_ids = self.vocabulary.strings, self.label_ids
+        ends = self.ends
+        parts = []
+        # ends of open constituents
+        stack = []
+
+        for j in range(i, ends[i] + 1):
+            while stack and stack[-1] < j:
+                stack.pop()
+                parts.append(")")
+            if j > i:
+                parts.append(" ")
+            if self.is_word(j):
+                parts.append(strings[label_ids[j]])
+            else:
+                parts.append("(" + strings[label_ids[j]])
+                stack.append(ends[j])
+
+        parts.append(")" * len(stack))
+        return "".join(parts)
+
+    def subtree(self, i):
+        """
+        Return the subtree under node i as a new tree
+        """
+        end = self.ends[i] + 1
+        left = self.lefts[i]
+
+        def shift(positions):
+            return [j - i if j >= 0 else -1 for j in positions[i:end]]
+
+        parents = shift(self.parents)
+        parents[0] = -1
+        next_siblings = shift(self.next_siblings)
+        next_siblings[0] = -1
+        return Tree(self.label_ids[i:end], parents,
+                    shift(self.first_children), next_siblings,
+                    [j - i for j in self.ends[i:end]],
+                    [j - left for j in self.lefts[i:end]],
+                    [j - left for j in self.rights[i:end]], self.vocabulary)
+
+
+def _unpickle_tree(labels, *arrays):
+    tree = Tree([vocabulary.id(label) for label in labels], *arrays)
+    tree._labels = labels
+    return tree
+
+
+class NodeView(object):
+    """
+    View on a single node of a tree, without copying
+
+    Attributes
+    ----------
+    tree: Tree instance
+        tree the node belongs to
+    position: int
+        position of the node in pre-order, counting from 0
+    """
+
+    __slots__ = ("tree", "position")
+
+    def __init__(self, tree, position):
+        self.tree = tree
+        self.position = position
+
+    def __repr__(self):
+        return "<NodeView {} of {!r}>".format(self.position, self.tree)
+
+    def __eq__(self, other):
+        return (isinstance(other, NodeView) and self.tree is other.tree and
+                self.position == other.position)
+
+    def __hash__(self):
+        return hash((id(self.tree), self.position))
+
+    @property
+    def node_n(self):
+        """
+        Node number as reported by Tregex, counting from 1
+        """
+        return self.position + 1
+
+    @property
+    def label(self):
+        tree = self.tree
+        return tree.vocabulary.strings[tree.label_ids[self.position]]
+
+    @property
+    def is_word(self):
+        return self.tree.is_word(self.position)
+
+    @property
+    def parent(self):
+        j = self.tree.parents[self.position]
+        if j >= 0:
+            return NodeView(self.tree, j)
+
+    @property
+    def children(self):
+        tree = self.tree
+        kids = []
+        j = tree.first_children[self.position]
+        while j >= 0:
+            kids.append(NodeView(tree, j))
+            j = tree.next_siblings[j]
+        return kids
+
+    def words(self):
+        return self.tree.words(self.position)
+
+    def to_string(self):
+        return self.tree.to_string(self.position)
+
+    def subtree(self):
+        return self.tree.subtree(self.position)
+
+
+def as_tree(tree):
+    """
+    Return tree as Tree instance, parsing it if it is a labeled bracket string
+    """
+    if isinstance(tree, str):
+        return Tree.from_string(tree)
+    if isinstance(tree, NodeView):
+        return tree.subtree()
+    return tree
+
+
+def as_string(tree):
+    """
+    Return tree as labeled bracket string, serializing it if it is a Tree
+    """
+    if isinstance(tree, (Tree, NodeView)):
+        return tree.to_string()
+    return tree
+
+
+def read_trees(fname, encoding="utf-8", vocabulary=None):
+    """
+    Read file with one tree per line
+
+    Blank lines are read as None, so that trees keep the numbers of their
+    lines, like in Matches.get_tree_info.
+    """
+    with open(fname, encoding=encoding, newline="\n") as inf:
+        return [Tree.from_string(line, vocabulary) if line.strip() else None
+                for line in inf]
+
+
+# number of corpora kept in the cache of read_corpus
+MAX_CACHED_CORPORA = 2
+
+# directory -> (signature, trees), least recently used first
+_corpus_cache = OrderedDict()
+
+
+def clear_corpus_cache():
+    """
+    Drop all corpora cached by read_corpus
+    """
+    _corpus_cache.clear()
+
+
+def read_corpus(file_path, encoding="utf-8"):
+    """
+    Read trees from all tree files in directory file_path
+
+    Files are read in the same order as in Matches.get_tree_info, so that
+    tree i in the returned list has absolute tree number i + 1; blank lines
+    are None (see read_trees). The trees share a vocabulary of their own. 
+    Parsed trees of the MAX_CACHED_CORPORA most recently read directories 
+    are cached until any of the files is changed, added or removed.
+    """
+    fnames = sorted(glob(join(file_path, "*")))
+    signature = [(fname, getmtime(fname), getsize(fname)) for fname in fnames]
+    key = abspath(file_path)
+
+    try:
+        cached_signature, trees = _corpus_cache[key]
+    except KeyError:
+        pass
+    else:
+        if cached_signature == signature:
+            _corpus_cache.move_to_end(key)
+            return trees
+        # free the outdated trees before reading the new ones
+        del _corpus_cache[key]
+
+    trees = []
+    corpus_vocabulary = Vocabulary()
+    for fname in fnames:
+        trees.extend(read_trees(fname, encoding=encoding,
+                                vocabulary=corpus_vocabulary))
+
+    _corpus_cache[key] = signature, trees
+    while len(_corpus_cache) > MAX_CACHED_CORPORA:
+        _corpus_cache.popitem(last=False)
+    return trees
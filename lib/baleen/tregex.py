@@ -0,0 +1,509 @@
+"""
+Tree pattern matching with Tregex
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from os import symlink
+from os.path import join, basename, abspath
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import numpy as np
+
+from tredev.tregex import get_matches as call_tregex
+
+from baleen.index import TermIndex
+from baleen.instrument import active_collector
+from baleen.pattern import compile_pattern, PatternSet, UnsupportedPattern
+from baleen.tree import read_corpus, read_trees
+from baleen.worker import active_worker, WorkerError
+
+
+def get_matches(pattern, file_path, exec_path="tregex.sh", worker=None,
+                engine="external", term_index=None):
+    """
+    Match Tregex pattern against all trees in the tree files in directory
+    file_path
+
+    Parameters
+    ----------
+    pattern: str
+        Tregex pattern
+    file_path: str
+        directory containing tree files
+    exec_path: str, optional
+        path to tregex.sh executable
+    worker: baleen.worker.Worker instance, optional
+        worker to route the request through; defaults to the active worker.
+        If no worker serves file_path, or if the request fails, tregex.sh is
+        called instead.
+    engine: str, optional
+        "external" (default) always uses the external tool; "auto" uses the
+        native matcher (see baleen.pattern) for patterns in the supported 
+        subset and the external tool otherwise; "native" raises 
+        UnsupportedPattern for other patterns. Check patterns with 
+        check_conformance before matching them natively.
+    term_index: baleen.index.TermIndex instance, optional
+        inverted index of the tree files in file_path, used to match only 
+        the trees containing the labels the pattern requires; matches are 
+        the same as without index. A worker always matches all trees it 
+        serves, unless there are no candidate trees at all.
+
+    Returns
+    -------
+    list of (int, int) tuples
+        absolute tree number and node number of each match
+    """
+    collector = active_collector()
+    
+    if not collector:
+        return _get_matches(pattern, file_path, exec_path, worker, engine,
+                            term_index)[0]
+    
+    # native matching runs in Python, other engines in a (JVM) subprocess
+    start = perf_counter()
+    matches, used = _get_matches(pattern, file_path, exec_path, worker, 
+                                 engine, term_index)
+    metric = ("subprocess_seconds" if used in ("worker", "external") 
+              else "native_seconds")
+    collector.record("tregex", "pattern", pattern, calls=1, 
+                     matches=len(matches), 
+                     **{metric: perf_counter() - start})
+    return matches
+
+
+def _get_matches(pattern, file_path, exec_path, worker, engine, 
+                 term_index=None):
+    # return matches and the engine used
+    candidates = None
+    if term_index is not None:
+        candidates = term_index.candidates(pattern)
+    
+    if engine != "external":
+        try:
+            compiled = compile_pattern(pattern)
+        except UnsupportedPattern:
+            if engine == "native":
+                raise
+        else:
+            return compiled.get_matches(read_corpus(file_path), 
+                                        candidates=_as_set(candidates)
+                                        ), "native"
+        
+    if candidates is not None and not len(candidates):
+        return [], "prefilter"
+
+    worker = worker or active_worker()
+
+    if worker and worker.serves(file_path):
+        try:
+            return worker.get_matches(pattern), "worker"
+        except WorkerError:
+            pass
+        
+    if candidates is not None:
+        return match_candidates(pattern, sorted(glob(join(file_path, "*"))),
+                                candidates, exec_path=exec_path), "external"
+
+    return call_tregex(pattern, file_path, exec_path=exec_path), "external"
+
+
+def _as_set(candidates):
+    if candidates is not None:
+        return set(candidates.tolist())
+
+
+def match_candidates(pattern, fnames, candidates, base=0, 
+                     exec_path="tregex.sh"):
+    """
+    Match Tregex pattern with tregex.sh against candidate trees only
+    
+    The candidate trees are copied to a temporary tree file, and the tree
+    numbers of the matches are mapped back to the original numbering.
+    
+    Parameters
+    ----------
+    pattern: str
+        Tregex pattern
+    fnames: list of str
+        tree files, in order
+    candidates: collection of int
+        tree numbers of the candidate trees, counting from base + 1
+    base: int, optional
+        number of trees preceding the first file
+    exec_path: str, optional
+        path to tregex.sh executable
+        
+    Returns
+    -------
+    list of (int, int) tuples
+        tree number and node number of each match
+    """
+    candidates = _as_set(np.asarray(candidates))
+    # original tree numbers of the trees in the temporary file
+    selected = []
+    
+    with TemporaryDirectory() as tmp_path:
+        with open(join(tmp_path, "candidates.parse"), "wb") as outf:
+            tree_n = base
+            for fname in fnames:
+                with open(fname, "rb") as inf:
+                    for line in inf:
+                        tree_n += 1
+                        if tree_n in candidates:
+                            selected.append(tree_n)
+                            outf.write(line.rstrip(b"\r\n") + b"\n")
+                            
+        if not selected:
+            return []
+        
+        pairs = call_tregex(pattern, tmp_path, exec_path=exec_path)
+        
+    return [(selected[tree_n - 1], node_n) for tree_n, node_n in pairs]
+
+
+def get_matches_multi(patterns, file_path, exec_path="tregex.sh", worker=None,
+                      engine="external", term_index=None):
+    """
+    Match several Tregex patterns against all trees in the tree files in
+    directory file_path
+    
+    Natively supported patterns are all matched in a single traversal of
+    each tree, sharing the work on common sub-expressions. Other patterns
+    are matched one by one as in get_matches.
+    
+    Parameters
+    ----------
+    patterns: iterable of str
+        Tregex patterns
+    file_path: str
+        directory containing tree files
+    exec_path: str, optional
+        path to tregex.sh executable
+    worker: baleen.worker.Worker instance, optional
+        see get_matches
+    engine: str, optional
+        see get_matches
+    term_index: baleen.index.TermIndex instance, optional
+        see get_matches
+    
+    Returns
+    -------
+    dict
+        mapping each pattern to a list of (int, int) tuples with absolute 
+        tree number and node number of each match
+    """
+    native, external = [], []
+    
+    for pattern in patterns:
+        if engine == "external":
+            external.append(pattern)
+            continue
+        try:
+            native.append(compile_pattern(pattern))
+        except UnsupportedPattern:
+            if engine == "native":
+                raise
+            external.append(pattern)
+            
+    matches = {}
+    
+    if native:
+        candidates = None
+        if term_index is not None:
+            candidates = dict(
+                (pattern.text, _as_set(term_index.candidates(pattern.text)))
+                for pattern in native)
+        matches.update(PatternSet(native).get_matches(read_corpus(file_path),
+                                                      candidates=candidates))
+        
+    for pattern in external:
+        matches[pattern] = get_matches(pattern, file_path, 
+                                       exec_path=exec_path, worker=worker, 
+                                       engine="external", 
+                                       term_index=term_index)
+        
+    return matches
+
+
+def get_matches_parallel(patterns, file_path, exec_path="tregex.sh",
+                         engine="external", n_jobs=2, executor=None, 
+                         shards_per_job=4, term_index=None):
+    """
+    Match several Tregex patterns against all trees in the tree files in
+    directory file_path, spreading the work over a pool of processes
+    
+    The tree files are split into shards of consecutive files with about 
+    the same number of trees. Each shard is a work unit for all natively 
+    supported patterns together (see get_matches_multi), whereas other 
+    patterns are run by tregex.sh as one work unit per pattern and shard.
+    Matches are renumbered to absolute tree numbers and merged in shard
+    order, so the result is identical to a serial run.
+    
+    Parameters
+    ----------
+    patterns: iterable of str
+        Tregex patterns
+    file_path: str
+        directory containing tree files
+    exec_path: str, optional
+        path to tregex.sh executable
+    engine: str, optional
+        see get_matches
+    n_jobs: int, optional
+        number of worker processes; with an executor, the number of workers
+        assumed when sharding
+    executor: concurrent.futures.Executor instance, optional
+        executor to submit work units to
+    shards_per_job: int, optional
+        number of shards per worker process, for load balancing
+    term_index: baleen.index.TermIndex instance, optional
+        see get_matches; work units without candidate trees are skipped
+    
+    Returns
+    -------
+    dict
+        mapping each pattern to a list of (int, int) tuples with absolute 
+        tree number and node number of each match
+    """
+    # a repeated pattern is matched once, as in a serial run
+    patterns = list(dict.fromkeys(patterns))
+    native, external = [], []
+    
+    for pattern in patterns:
+        if engine == "external":
+            external.append(pattern)
+            continue
+        try:
+            compile_pattern(pattern)
+        except UnsupportedPattern:
+            if engine == "native":
+                raise
+            external.append(pattern)
+        else:
+            native.append(pattern)
+    
+    shards = shard_files(file_path, n_jobs * shards_per_job)
+    
+    # pattern -> candidate trees, for patterns with a restricted set
+    candidates = {}
+    if term_index is not None:
+        for pattern in patterns:
+            pattern_candidates = term_index.candidates(pattern)
+            if pattern_candidates is not None:
+                candidates[pattern] = pattern_candidates
+    
+    units = []
+    for i, (fnames, base) in enumerate(shards):
+        # candidate trees within the shard
+        end = shards[i + 1][1] if i + 1 < len(shards) else np.inf
+        shard_candidates = {}
+        for pattern, pattern_candidates in candidates.items():
+            start, stop = np.searchsorted(pattern_candidates, 
+                                          [base + 1, end + 1])
+            shard_candidates[pattern] = pattern_candidates[start:stop]
+        # patterns without candidates in the shard are skipped
+        active = set(pattern for pattern in patterns 
+                     if pattern not in shard_candidates or 
+                     len(shard_candidates[pattern]))
+        
+        shard_native = [pattern for pattern in native if pattern in active]
+        if shard_native:
+            units.append((shard_native, [], fnames, base, 
+                          dict((pattern, shard_candidates[pattern])
+                               for pattern in shard_native
+                               if pattern in shard_candidates)))
+        for pattern in external:
+            if pattern in active:
+                units.append(([], [pattern], fnames, base,
+                              dict((pattern, shard_candidates[pattern])
+                                   for pattern in [pattern]
+                                   if pattern in shard_candidates)))
+    
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(n_jobs)
+        
+    try:
+        futures = [executor.submit(match_files, *unit, exec_path=exec_path)
+                   for unit in units]
+        matches = dict((pattern, []) for pattern in patterns)
+        # collect in order of submission to obtain a deterministic order
+        for future in futures:
+            for pattern, pairs in future.result().items():
+                matches[pattern].extend(pairs)
+    finally:
+        if own_executor:
+            executor.shutdown()
+            
+    return matches
+
+
+def shard_files(file_path, n_shards):
+    """
+    Split the tree files in directory file_path into at most n_shards 
+    shards of consecutive files with about the same number of trees
+    
+    Returns
+    -------
+    list of (list of str, int) tuples
+        filenames in shard and number of trees preceding the shard
+    """
+    fnames = sorted(glob(join(file_path, "*")))
+    counts = []
+    for fname in fnames:
+        with open(fname, "rb") as inf:
+            counts.append(sum(1 for _ in inf))
+    
+    shard_size = sum(counts) / max(1, n_shards)
+    shards = []
+    shard, shard_base, base = [], 0, 0
+    
+    for fname, count in zip(fnames, counts):
+        if shard and base >= (len(shards) + 1) * shard_size:
+            shards.append((shard, shard_base))
+            shard, shard_base = [], base
+        shard.append(fname)
+        base += count
+        
+    if shard:
+        shards.append((shard, shard_base))
+        
+    return shards
+
+
+def match_files(native, external, fnames, base=0, candidates=None, 
+                exec_path="tregex.sh"):
+    """
+    Match patterns against the trees in the given tree files
+    
+    This is the work unit of get_matches_parallel.
+    
+    Parameters
+    ----------
+    native: list of str
+        natively supported Tregex patterns
+    external: list of str
+        Tregex patterns to match with tregex.sh
+    fnames: list of str
+        tree files, in order
+    base: int, optional
+        number of trees preceding the first file, added to tree numbers
+    candidates: dict, optional
+        mapping patterns to arrays of the tree numbers (including base) of
+        the only trees to match
+    exec_path: str, optional
+        path to tregex.sh executable
+        
+    Returns
+    -------
+    dict
+        mapping each pattern to a list of (int, int) tuples with tree 
+        number and node number of each match
+    """
+    matches = {}
+    candidates = candidates or {}
+    
+    if native:
+        trees = [tree for fname in fnames for tree in read_trees(fname)]
+        # candidates numbered within the shard
+        shard_candidates = dict(
+            (pattern, set((np.asarray(candidates[pattern]) - base).tolist()))
+            for pattern in native if pattern in candidates)
+        for pattern, pairs in PatternSet(native).get_matches(
+                trees, candidates=shard_candidates).items():
+            matches[pattern] = [(base + tree_n, node_n) 
+                                for tree_n, node_n in pairs]
+            
+    if external:
+        # tregex.sh takes a directory, so link the shard's files into one
+        with TemporaryDirectory() as shard_path:
+            for fname in fnames:
+                symlink(abspath(fname), join(shard_path, basename(fname)))
+            for pattern in external:
+                if pattern in candidates:
+                    matches[pattern] = match_candidates(
+                        pattern, fnames, candidates[pattern], base, 
+                        exec_path=exec_path)
+                    continue
+                matches[pattern] = [
+                    (base + tree_n, node_n) 
+                    for tree_n, node_n in call_tregex(pattern, shard_path,
+                                                      exec_path=exec_path)]
+                
+    return matches
+
+
+def check_conformance(patterns, file_path, exec_path="tregex.sh"):
+    """
+    Check that native matching gives the same results as the external tool
+
+    Parameters
+    ----------
+    patterns: iterable of str
+        Tregex patterns; patterns outside the natively supported subset are
+        skipped
+    file_path: str
+        directory containing tree files
+    exec_path: str, optional
+        path to tregex.sh executable
+
+    Returns
+    -------
+    dict
+        mapping each non-conforming pattern to a pair of
+        (native matches, external matches)
+    """
+    failures = {}
+
+    for pattern in patterns:
+        try:
+            native = get_matches(pattern, file_path, engine="native")
+        except UnsupportedPattern:
+            continue
+        external = get_matches(pattern, file_path, exec_path=exec_path,
+                               engine="external")
+        if sorted(native) != sorted(external):
+            failures[pattern] = native, external
+
+    return failures
+
+
+def check_prefilter(patterns, file_path, term_index=None, 
+                    exec_path="tregex.sh", engine="external"):
+    """
+    Check that prefiltering with an inverted index never drops a match
+    
+    Parameters
+    ----------
+    patterns: iterable of str
+        Tregex patterns
+    file_path: str
+        directory containing tree files
+    term_index: baleen.index.TermIndex instance, optional
+        inverted index; defaults to the (possibly newly built) index of 
+        file_path
+    exec_path: str, optional
+        path to tregex.sh executable
+    engine: str, optional
+        see get_matches
+        
+    Returns
+    -------
+    dict
+        mapping each pattern for which prefiltering changes the result to
+        a pair of (matches with prefiltering, matches without)
+    """
+    term_index = term_index or TermIndex.open(file_path)
+    failures = {}
+    
+    for pattern in patterns:
+        full = get_matches(pattern, file_path, exec_path=exec_path, 
+                           engine=engine)
+        filtered = get_matches(pattern, file_path, exec_path=exec_path,
+                               engine=engine, term_index=term_index)
+        if sorted(filtered) != sorted(full):
+            failures[pattern] = filtered, full
+            
+    return failures
@@ -1,17 +1,20 @@
 from subprocess import check_output, Popen, PIPE 
 from tempfile import NamedTemporaryFile          
+
+from baleen.tree import as_string
+from baleen.worker import active_worker, WorkerError
     
     
 
 def edit_trees(trees, pattern, script, exec_path="tsurgeon.sh",
-               encoding="utf-8"):
+               encoding="utf-8", worker=None):
     """
     Edit trees by matching tree pattern and applying Tsurgeon script
     
     Parameters
     ----------
-    trees: list of str
-        list of input trees in LBS format
+    trees: list of str or baleen.tree.Tree instances
+        list of input trees in LBS format or parsed
     pattern: str
         Tregex pattern
     script: str
@@ -20,12 +23,25 @@ def edit_trees(trees, pattern, script, exec_path="tsurgeon.sh",
         path to tsurgeon.sh executable
     encoding: str, optional
         encoding during file IO 
+    worker: baleen.worker.Worker instance, optional
+        worker to route the request through; defaults to the active worker.
+        If there is none, or if the request fails, tsurgeon.sh is called 
+        instead.
         
     Returns
     -------
     result: list of str
         list of output trees in LBS format
     """
+    trees = [as_string(tree) for tree in trees]
+    worker = worker or active_worker()
+    
+    if worker:
+        try:
+            return worker.edit_trees(trees, pattern, script)
+        except WorkerError:
+            pass
+        
     trees_file = NamedTemporaryFile("w")
     trees_file.write("\n".join(trees))
     trees_file.flush()
@@ -34,6 +50,57 @@ def edit_trees(trees, pattern, script, exec_path="tsurgeon.sh",
     return result.strip().split("\n")
 
 
+def edit_trees_chain(trees, rules, exec_path="tsurgeon.sh", encoding="utf-8",
+                     worker=None):
+    """
+    Edit trees by applying a chain of rules in a single Tsurgeon invocation
+    
+    Parameters
+    ----------
+    trees: list of str or baleen.tree.Tree instances
+        list of input trees in LBS format or parsed
+    rules: list of (str, str) tuples
+        Tregex pattern and Tsurgeon script of each rule, applied in order
+        to every tree
+    excec_path: str, optional
+        path to tsurgeon.sh executable
+    encoding: str, optional
+        encoding during file IO 
+    worker: baleen.worker.Worker instance, optional
+        see edit_trees
+        
+    Returns
+    -------
+    result: list of str
+        list of output trees in LBS format
+    """
+    trees = [as_string(tree) for tree in trees]
+    worker = worker or active_worker()
+    
+    if worker:
+        try:
+            return worker.edit_trees_chain(trees, rules)
+        except WorkerError:
+            pass
+        
+    trees_file = NamedTemporaryFile("w", encoding=encoding)
+    trees_file.write("\n".join(trees))
+    trees_file.flush()
+    
+    # Tsurgeon applies script files in the given order; each file holds a
+    # pattern, an empty line and the operations
+    script_files = []
+    for pattern, script in rules:
+        script_file = NamedTemporaryFile("w", encoding=encoding)
+        script_file.write(pattern + "\n\n" + script + "\n")
+        script_file.flush()
+        script_files.append(script_file)
+        
+    cmd = ([exec_path, "-s", "-treeFile", trees_file.name] + 
+           [script_file.name for script_file in script_files])
+    return check_output(cmd).decode(encoding).strip().split("\n")
+
+
 def call_tsurgeon(trees_fname, pattern, script, options=["-s"], 
                   exec_path="tsurgeon.sh", encoding="utf-8"):
     cmd = [exec_path] + options + ["-treeFile", trees_fname,
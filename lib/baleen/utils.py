@@ -1,8 +1,130 @@
 
+import re
+
+import numpy as np
+
 from tredev.nodes import Nodes
 
+from baleen.tree import Tree, NodeView
+
+
+# whitespace which str.split splits on, other than space and newline
+ascii_space = "\t\r\x0b\x0c\x1c\x1d\x1e\x1f"
+unicode_space_re = re.compile(r"[^\S \n]")
+
+SPACE, NEWLINE, OPENING, CLOSING = (ord(char) for char in " \n()")
+
+
+def _chunk_yields(trees):
+    """
+    Tree yields of a chunk of plain labeled bracket strings, computed on 
+    the bytes of all trees at once, or None if the trees are not plain,
+    i.e. if brackets occur elsewhere than at the start of labels and the 
+    end of terminals, or tokens are separated by other whitespace than 
+    spaces
+    """
+    # prefix every tree with a space, so every token follows a separator
+    text = " " + "\n ".join(trees)
+    
+    if (text.count("\n") != len(trees) - 1 or
+            any(char in text for char in ascii_space) or
+            not text.isascii() and unicode_space_re.search(text)):
+        return None
+    
+    data = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+    space = data == SPACE
+    newline = data == NEWLINE
+    opening = data == OPENING
+    closing = data == CLOSING
+    separator = space | newline | opening
+    
+    if ((opening[1:] & ~space[:-1]).any() or
+            (space[:-1] & closing[1:]).any() or
+            (closing[:-1] & ~(separator | closing)[1:]).any()):
+        return None
+    
+    # position of the separator preceding each token, which is an opening
+    # bracket for labels and a space for terminals
+    positions = np.where(separator, np.arange(len(data), dtype=np.int64), 0)
+    preceding = np.maximum.accumulate(positions)
+    keep = ~(separator | closing) & ~opening[preceding]
+    # keep the space before each terminal and the newlines between trees
+    keep[:-1] |= space[:-1] & keep[1:]
+    keep |= newline
+    
+    text = data[keep].tobytes().decode("utf-8").replace("\n ", "\n")
+    # brackets are unescaped in bulk
+    return Nodes.unescape_brackets(text[1:] if text.startswith(" ") 
+                                   else text).split("\n")
+    
+
+def tree_yields(trees, chunk_size=10000):
+    """
+    Tree yields of a whole column of labeled bracket strings
+    
+    Trees are processed in chunks: terminals are selected with array 
+    operations on the bytes of all trees in a chunk and brackets are 
+    unescaped once for the whole chunk. Chunks with unusual bracketing or 
+    whitespace fall back to processing tree by tree.
+    
+    Parameters
+    ----------
+    trees: iterable of str or baleen.tree.Tree instances
+        trees (subtrees) as labeled bracket strings, e.g. a pandas.Series,
+        or as parsed trees, whose words are taken without tokenizing
+    chunk_size: int, optional
+        number of trees processed at a time, bounding memory use
+        
+    Returns
+    -------
+    list of str
+        tree yields
+    """
+    yields = []
+    chunk = []
+    
+    def flush():
+        strings = [tree for tree in chunk if isinstance(tree, str)]
+        chunk_yields = _chunk_yields(strings) if strings else []
+        
+        if chunk_yields is None:
+            chunk_yields = [
+                " ".join(Nodes.unescape_brackets(part.rstrip(")"))
+                         for part in tree.split() 
+                         if not part.startswith("("))
+                for tree in strings]
+            
+        if len(strings) < len(chunk):
+            string_yields = iter(chunk_yields)
+            chunk_yields = [
+                Nodes.unescape_brackets(" ".join(tree.words()))
+                if isinstance(tree, (Tree, NodeView)) else next(string_yields)
+                for tree in chunk]
+        
+        yields.extend(chunk_yields)
+        del chunk[:]
+    
+    for tree in trees:
+        chunk.append(tree)
+        if len(chunk) == chunk_size:
+            flush()
+            
+    if chunk:
+        flush()
+        
+    return yields
+
+
 def tree_yield(tree):
-    # quick & dirty tree yield
+    """
+    Tree yield of a single labeled bracket string or tree
+    
+    For single trees, splitting the string is faster than the array 
+    operations of tree_yields, which pay off for whole columns only.
+    """
+    if isinstance(tree, (Tree, NodeView)):
+        return Nodes.unescape_brackets(" ".join(tree.words()))
+    
     terms = [Nodes.unescape_brackets(part.rstrip(")")) 
              for part in tree.split() 
              if not part.startswith("(")]
@@ -0,0 +1,228 @@
+"""
+Long-lived Tregex/Tsurgeon worker
+
+Instead of launching tregex.sh or tsurgeon.sh - and thus a fresh JVM - for
+every pattern and every post-processing rule, a Worker spawns the Jython
+script baleen/server.py once, which loads the corpus once and then answers
+matching and editing requests over a pipe.
+
+Use a worker as a context manager to make it the active worker. While
+active, baleen.tregex.get_matches and baleen.tsurgeon.edit_trees route
+through it, falling back to the per-call subprocess path if the worker is
+unavailable, e.g. because Jython is not installed:
+
+    with Worker(parse_dir, jython_path="/path/to/stanford-tregex.jar"):
+        matches = Matches.from_patterns(td.patterns, td.nodes, parse_dir)
+        post_process(matches, "post_proc_rules")
+"""
+
+import os
+import subprocess
+import sys
+
+
+# stack of active workers, innermost last
+_active = []
+
+
+def active_worker():
+    """
+    Return the innermost active worker or None
+    """
+    if _active:
+        return _active[-1]
+
+
+class WorkerError(Exception):
+    """
+    Raised when a request to the worker fails
+    """
+
+
+def escape(field):
+    return (field.replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n"))
+
+
+def unescape(field):
+    return "\\".join(p.replace("\\t", "\t").replace("\\n", "\n")
+                     for p in field.split("\\\\"))
+
+
+class Worker(object):
+    """
+    Client for a persistent Tregex/Tsurgeon server process
+
+    The server process is started on the first request and restarted if it
+    has died, reloading the trees of file_path. If it can not be started, 
+    the worker becomes unavailable and no longer serves any requests.
+
+    Parameters
+    ----------
+    file_path: str, optional
+        directory containing tree files to load for matching
+    jython_exec: str, optional
+        path to Jython executable
+    jython_path: str, optional
+        value assigned to JYTHONPATH environment variable
+    class_path: str, optional
+        value assigned to CLASSPATH environment variable
+    encoding: str, optional
+        encoding of the pipe
+    """
+
+    def __init__(self, file_path=None, jython_exec="jython",
+                 jython_path=None, class_path=None, encoding="utf-8"):
+        self.file_path = file_path
+        self.n_trees = None
+        self.jython_exec = jython_exec
+        self.jython_path = jython_path
+        self.class_path = class_path
+        self.encoding = encoding
+        self.process = None
+        # False once the server process could not be started
+        self.available = True
+
+    def __enter__(self):
+        _active.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _active.remove(self)
+        self.close()
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def script_args(self):
+        """
+        Return path to the Jython script to run and its arguments
+        """
+        # get file path to current module (i.e. baleen.worker)
+        path = sys.modules[__name__].__file__
+        # and deduce file path to the Jython script in the same directory
+        return [os.path.join(os.path.split(path)[0], "server.py")]
+
+    def start(self):
+        """
+        Spawn the server process
+        """
+        env = dict(os.environ)
+        # see baleen.trans.wrap.transform_matches on setting only one of both
+        if self.jython_path:
+            env["JYTHONPATH"] = self.jython_path
+        elif self.class_path:
+            env["CLASSPATH"] = self.class_path
+
+        try:
+            self.process = subprocess.Popen([self.jython_exec] +
+                                            self.script_args(),
+                                            stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE,
+                                            env=env)
+        except OSError as error:
+            raise WorkerError(error)
+
+    def close(self):
+        """
+        Stop the server process
+        """
+        if self.alive:
+            try:
+                self._write("quit")
+                self.process.stdin.close()
+            except (IOError, OSError):
+                pass
+            self.process.wait()
+        self.process = None
+
+    def _write(self, *fields):
+        line = "\t".join(escape(str(field)) for field in fields) + "\n"
+        self.process.stdin.write(line.encode(self.encoding))
+
+    def _read(self):
+        line = self.process.stdout.readline()
+        if not line:
+            raise WorkerError("worker process terminated")
+        line = line.decode(self.encoding).rstrip("\n")
+        return [unescape(field) for field in line.split("\t")]
+
+    def _request(self, *fields, lines=()):
+        if not self.available:
+            raise WorkerError("worker is unavailable")
+        
+        if not self.alive:
+            try:
+                self.start()
+                if self.file_path is not None and fields[0] != "load":
+                    # a new server process has no trees loaded
+                    self._load()
+            except WorkerError:
+                self.available = False
+                self.close()
+                raise
+
+        try:
+            self._write(*fields)
+            for line in lines:
+                self._write(line)
+            self.process.stdin.flush()
+            status, result = self._read()
+        except (IOError, OSError) as error:
+            raise WorkerError(error)
+
+        if status != "ok":
+            raise WorkerError(result)
+
+        return result
+
+    def load(self, file_path):
+        """
+        Load tree files from directory file_path, numbering trees in the
+        same way as Matches.get_tree_info
+        """
+        self.file_path = file_path
+        self._load()
+        
+    def _load(self):
+        self.n_trees = int(self._request("load", 
+                                         os.path.abspath(self.file_path)))
+
+    def serves(self, file_path):
+        """
+        Return True if the worker is available and serves the trees from 
+        file_path, which are loaded on the first request
+        """
+        return (self.available and self.file_path is not None and
+                os.path.abspath(self.file_path) == os.path.abspath(file_path))
+
+    def get_matches(self, pattern):
+        """
+        Match Tregex pattern against loaded trees
+
+        Returns
+        -------
+        list of (int, int) tuples
+            absolute tree number and node number of each match
+        """
+        result = self._request("match", pattern)
+        return [tuple(int(n) for n in pair.split(":"))
+                for pair in result.split()]
+
+    def edit_trees(self, trees, pattern, script):
+        """
+        Edit trees by matching tree pattern and applying Tsurgeon script;
+        see baleen.tsurgeon.edit_trees
+        """
+        return self.edit_trees_chain(trees, [(pattern, script)])
+
+    def edit_trees_chain(self, trees, rules):
+        """
+        Edit trees by applying a chain of rules in one request;
+        see baleen.tsurgeon.edit_trees_chain
+        """
+        trees = list(trees)
+        fields = [field for rule in rules for field in rule]
+        n = int(self._request("edit", *fields, len(trees), lines=trees))
+        return [self._read()[0] for _ in range(n)]
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+"""
+Conformance sample: check that the native matcher gives the same matches
+as tregex.sh on the sample parses
+
+Note: run setup_sample.py first to create data files
+"""
+
+from tredev import Tredev
+
+from baleen.tregex import check_conformance
+
+from setup_sample import path_prefix, parse_dir
+
+
+# load data files
+td = Tredev.load(path_prefix, parse_dir)
+
+# the post-processing rule pattern is checked as well
+patterns = list(td.patterns["pattern"]) + [
+    "NP < (VBN|VBD|VBG=n1 < /.ncreas.*/) !$.. PP"]
+
+failures = check_conformance(patterns, parse_dir)
+
+for pattern, (native, external) in failures.items():
+    print("MISMATCH:", pattern)
+    print("  native:  ", native)
+    print("  external:", external)
+
+print("{} of {} patterns conform".format(len(patterns) - len(failures), 
+                                         len(patterns)))
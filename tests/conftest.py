@@ -0,0 +1,23 @@
+import os
+from os.path import abspath, dirname, join
+import shutil
+import sys
+
+import pytest
+
+
+# make baleen importable without installing it, like setup_env.sh
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), "lib"))
+
+DATA_DIR = join(dirname(abspath(__file__)), "data")
+
+
+@pytest.fixture
+def parse_dir(tmp_path):
+    """
+    Copy of the fixture corpus, so indexes and stores built next to it
+    do not end up in the source tree
+    """
+    path = str(tmp_path / "parses")
+    shutil.copytree(join(DATA_DIR, "parses"), path)
+    return path
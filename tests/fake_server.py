@@ -0,0 +1,49 @@
+"""
+Stand-in for the Jython Tregex/Tsurgeon server (see baleen.server)
+
+Speaks the worker protocol of baleen.worker.Worker. Instead of matching 
+Tregex patterns, it returns the root node of every loaded tree as match,
+so that a server without loaded trees returns no matches.
+"""
+
+from os.path import abspath, dirname, join
+import sys
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), "lib"))
+
+from baleen.jython_common import tree_files
+from baleen.worker import escape, unescape
+
+
+def read():
+    line = sys.stdin.readline()
+    if line:
+        return [unescape(field) for field in line.rstrip("\n").split("\t")]
+
+
+def write(*fields):
+    sys.stdout.write("\t".join(escape(str(field)) for field in fields) + "\n")
+
+
+def main():
+    n_trees = 0
+    while True:
+        fields = read()
+        if not fields or fields[0] == "quit":
+            break
+        if fields[0] == "load":
+            n_trees = 0
+            for fname in tree_files(fields[1]):
+                with open(fname) as inf:
+                    n_trees += sum(1 for _ in inf)
+            write("ok", n_trees)
+        elif fields[0] == "match":
+            write("ok", " ".join("{}:1".format(tree_n) 
+                                 for tree_n in range(1, n_trees + 1)))
+        else:
+            write("error", "unsupported request " + fields[0])
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
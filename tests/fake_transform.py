@@ -0,0 +1,79 @@
+"""
+Stand-in for the Jython transform worker (see baleen.trans.transform)
+
+Speaks the worker protocol of baleen.trans.wrap.TransformWorker. Instead of
+Tsurgeon transformations it applies fixed relabelings, to a fixpoint within
+the budget like transform.py, and it drops tuples containing the word BAD as
+ill-formed.
+"""
+
+from collections import OrderedDict
+from os.path import abspath, dirname, join
+import sys
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), "lib"))
+
+from baleen.jython_common import (MAX_DEPTH, MAX_DERIVED, Tuple,
+                                  apply_transforms)
+from baleen.worker import escape, unescape
+
+
+# (transformation name, old label, new label), applied in order; trees
+# relabeled by t4 are only relabeled by t1 and t2 in a second round
+RULES = [("t1", "NN", "NNX"), ("t2", "NNX", "NNY"), ("t3", "DT", "DX"),
+         ("t4", "JJ", "NN")]
+
+
+def read():
+    line = sys.stdin.readline()
+    if line:
+        return [unescape(field) for field in line.rstrip("\n").split("\t")]
+
+
+def write(*fields):
+    sys.stdout.write("\t".join(escape(str(field)) for field in fields) + "\n")
+
+
+def relabel(old, new):
+    def transform(tuples, indices):
+        for index in indices:
+            subtree = tuples[index].subtree
+            new_subtree = subtree.replace("(%s " % old, "(%s " % new)
+            if new_subtree != subtree:
+                yield index, new_subtree
+    return transform
+
+
+def transform(batch, budget):
+    tuples = OrderedDict((int(index), Tuple(None, None, subtree))
+                         for index, _, _, subtree in batch
+                         if "BAD" not in subtree)
+    transforms = [(name, relabel(old, new)) for name, old, new in RULES]
+    apply_transforms(transforms, tuples, str, *budget)
+    return tuples
+
+
+def main():
+    budget = MAX_DEPTH, MAX_DERIVED
+
+    while True:
+        fields = read()
+        if not fields or fields[0] == "quit":
+            break
+        if fields[0] == "load":
+            write("ok", len(RULES))
+        elif fields[0] == "budget":
+            budget = int(fields[1]), int(fields[2])
+            write("ok", "%d %d" % budget)
+        else:
+            tuples = transform([read() for _ in range(int(fields[1]))],
+                               budget)
+            write("ok", len(tuples))
+            for index, (ancestor, name, subtree) in tuples.items():
+                write(index, "" if ancestor is None else ancestor,
+                      name or "", subtree)
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
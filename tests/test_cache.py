@@ -0,0 +1,65 @@
+import pytest
+
+pytest.importorskip("tredev")
+
+import baleen.cache
+import baleen.tregex
+from baleen.cache import MatchCache
+from baleen.index import TermIndex
+from baleen.tregex import get_matches, match_files
+
+
+PATTERNS = ["NP < DT", "VP << rose", "NP < (NN < nonexistent)", "NP $.. PP",
+            "NP !< DT"]
+
+
+@pytest.fixture(autouse=True)
+def call_tregex(monkeypatch):
+    # the native matcher stands in for tregex.sh
+    def call_tregex(pattern, file_path, exec_path="tregex.sh"):
+        return get_matches(pattern, file_path, engine="native")
+
+    monkeypatch.setattr(baleen.tregex, "call_tregex", call_tregex)
+
+
+def test_engine_in_key(parse_dir, tmp_path):
+    cache = MatchCache(str(tmp_path / "cache"))
+    cache.put("NP < DT", "hash", [(1, 2)], "native")
+    assert cache.get("NP <  DT", "hash", "native") == [(1, 2)]
+    assert cache.get("NP < DT", "hash", "external") is None
+
+    for engine in ("native", "external"):
+        cache.get_matches_multi(PATTERNS, parse_dir, engine=engine)
+    # both engines match all (pattern, file) pairs
+    assert cache.hits == 1 and cache.misses == 1 + 2 * 2 * len(PATTERNS)
+
+    cache.get_matches_multi(PATTERNS, parse_dir, engine="auto")
+    assert cache.hits == 1 + 2 * len(PATTERNS)
+
+
+@pytest.mark.parametrize("engine", ["native", "external"])
+def test_term_index(parse_dir, tmp_path, monkeypatch, engine):
+    calls = []
+
+    def counting_match_files(native, external, fnames, **kwargs):
+        calls.append((native, external, fnames))
+        return match_files(native, external, fnames, **kwargs)
+
+    monkeypatch.setattr(baleen.cache, "match_files", counting_match_files)
+    cache = MatchCache(str(tmp_path / "cache"))
+    term_index = TermIndex.open(parse_dir)
+    expected = dict((pattern, get_matches(pattern, parse_dir, engine=engine))
+                    for pattern in PATTERNS)
+
+    assert cache.get_matches_multi(PATTERNS, parse_dir, engine=engine,
+                                   term_index=term_index) == expected
+    # patterns without candidate trees in a file are not matched on it
+    matched = [pattern for native, external, _ in calls
+               for pattern in native + external]
+    assert "NP < (NN < nonexistent)" not in matched
+    assert matched.count("VP << rose") == 1
+
+    calls.clear()
+    assert cache.get_matches_multi(PATTERNS, parse_dir, engine=engine,
+                                   term_index=term_index) == expected
+    assert calls == []
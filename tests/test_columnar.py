@@ -0,0 +1,46 @@
+from glob import glob
+from os.path import join
+
+import pandas as pd
+import pytest
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+from baleen.columnar import compact_matches, read_matches
+from baleen.sinks import ParquetSink
+
+
+def make_chunk(start, n_rows, max_tree_n, n_patterns):
+    return compact_matches(pd.DataFrame(
+        {"pat_name": ["p{}".format(i % n_patterns) for i in range(n_rows)],
+         "label": "increase",
+         "file": "a.parse",
+         "rel_tree_n": [1 + i * (max_tree_n - 1) // max(1, n_rows - 1)
+                        for i in range(n_rows)],
+         "node_n": range(1, n_rows + 1),
+         "subtree": "(NN change)",
+         "substr": "change"},
+        index=range(start, start + n_rows)))
+
+
+def test_append_chunks_of_different_widths(tmp_path):
+    # few small values and categories, then many large ones
+    chunks = [make_chunk(0, 10, 5, 2), make_chunk(10, 300, 1000, 200)]
+    sink = ParquetSink(str(tmp_path / "matches"))
+    for chunk in chunks:
+        sink.write(chunk)
+
+    # the schema of the first file read applies to all files
+    schemas = [pq.read_schema(fname).remove_metadata()
+               for fname in glob(join(str(tmp_path), "matches", "*",
+                                      "*.parquet"))]
+    assert len(schemas) == 2
+    assert schemas[0].equals(schemas[1])
+
+    matches = read_matches(str(tmp_path / "matches"))
+    expected = pd.concat(chunks)
+
+    assert matches.index.tolist() == expected.index.tolist()
+    for column in ["pat_name", "rel_tree_n", "node_n"]:
+        assert (matches[column].astype(str).tolist() ==
+                expected[column].astype(str).tolist())
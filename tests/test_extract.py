@@ -0,0 +1,76 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("tredev")
+
+from baleen.extract import Matches, resolve_nodes
+from baleen.instrument import Collector
+from baleen.store import CorpusStore
+
+
+@pytest.mark.parametrize("batch", [False, True])
+def test_pattern_match_times(parse_dir, batch):
+    patterns = pd.DataFrame({"pattern": ["NP < DT", "NP < NN"],
+                             "label": ["det", "noun"]},
+                            index=["p1", "p2"])
+    store = CorpusStore.open(parse_dir)
+
+    with Collector() as collector:
+        Matches.from_patterns(patterns, store, parse_dir, tree_info=store,
+                              engine="native", batch=batch)
+
+    for index, pattern in patterns["pattern"].items():
+        seconds = collector.get("from_patterns", "pattern", index,
+                                "match_seconds")
+        assert seconds > 0
+        assert seconds == collector.get("from_patterns", "pattern", index,
+                                        "python_seconds")
+        assert seconds == collector.get("tregex", "pattern", pattern,
+                                        "native_seconds")
+
+
+@pytest.mark.parametrize("engine, pattern", [("external", "NP < DT"),
+                                             ("auto", "NP < DT ~ VP")])
+def test_nothing_to_batch(parse_dir, engine, pattern):
+    patterns = pd.DataFrame({"pattern": [pattern], "label": ["det"]})
+    store = CorpusStore.open(parse_dir)
+
+    with pytest.raises(ValueError):
+        Matches.from_patterns(patterns, store, parse_dir, tree_info=store,
+                              engine=engine, batch=True)
+
+
+class ScalarNodes(object):
+    # nodes without bulk methods, numbering the nodes of each tree 
+    # consecutively, except that nodes 3 and 4 are swapped
+    
+    def __init__(self, store):
+        self.store = store
+        self.calls = 0
+
+    def get_node_id(self, abs_tree_n, node_n):
+        self.calls += 1
+        node_n = {3: 4, 4: 3}.get(node_n, node_n)
+        return self.store.get_node_id(abs_tree_n, node_n)
+
+    def get_subtree(self, node_id):
+        return self.store.get_subtree(node_id)
+
+    def get_substring(self, node_id):
+        return self.store.get_substring(node_id)
+
+
+def test_resolve_nodes_scalar(parse_dir):
+    store = CorpusStore.open(parse_dir)
+    nodes = ScalarNodes(store)
+    abs_tree_ns = [1, 1, 1, 3, 3, 1]
+    node_ns = [1, 3, 14, 12, 12, 3]
+
+    subtrees, substrings = resolve_nodes(nodes, abs_tree_ns, node_ns)
+    swapped = [{3: 4, 4: 3}.get(node_n, node_n) for node_n in node_ns]
+    expected = resolve_nodes(store, abs_tree_ns, swapped)
+
+    assert list(subtrees) == list(expected[0])
+    assert list(substrings) == list(expected[1])
+    # one lookup per distinct node
+    assert nodes.calls == 4
@@ -0,0 +1,95 @@
+import os
+from os.path import join
+import shutil
+
+import pytest
+
+pytest.importorskip("tredev")
+
+import baleen.tregex
+from baleen.extract import Matches
+from baleen.index import TermIndex, TreeIndex
+from baleen.pattern import compile_pattern
+from baleen.tregex import check_prefilter, get_matches
+from baleen.tree import read_corpus
+
+
+# patterns with required words, labels, regular expressions and basic
+# categories, as well as negated and optional relations and disjunctions,
+# whose requirements must not be used for prefiltering
+PATTERNS = [
+    "NP < DT",
+    "NP !< DT",
+    "NP < (NN < decrease)",
+    "NP << change",
+    "NP ?< JJ",
+    "NP ?< (JJ < Sea)",
+    "@NP < NNS",
+    "@NP !<< effect",
+    "VP < /^VB[DZ]$/",
+    "/^N/ < /ncreas/",
+    "NN < /.ncreas.*/",
+    "NP < /^NNS?$/",
+    "NP [< DT | < JJ]",
+    "NP [< DT | !< NN]",
+    "S < (NP !< PRP) < VP",
+    "VP << rose",
+    "NP $.. PP",
+    "PP > VP",
+    "__ < rapidly",
+    "NP !<< /^climate$/",
+    "ADJP < (JJ < large) > VP",
+    "NP < (NN < nonexistent)",
+]
+
+
+@pytest.fixture
+def term_index(parse_dir):
+    return TermIndex.open(parse_dir)
+
+
+def test_patterns_are_prefiltered(term_index):
+    # otherwise the patterns below would be matched against all trees
+    for pattern in PATTERNS:
+        compile_pattern(pattern)
+    candidates = [term_index.candidates(pattern) for pattern in PATTERNS]
+    assert any(c is not None and len(c) < term_index.n_trees
+               for c in candidates)
+
+
+def test_prefilter_native(parse_dir, term_index):
+    assert check_prefilter(PATTERNS, parse_dir, term_index=term_index,
+                           engine="native") == {}
+
+
+def test_prefilter_candidate_file(parse_dir, term_index, monkeypatch):
+    # the native matcher stands in for tregex.sh on the file of candidate
+    # trees, so that mapping back tree numbers is checked without Java
+    def call_tregex(pattern, file_path, exec_path="tregex.sh"):
+        return get_matches(pattern, file_path, engine="native")
+
+    monkeypatch.setattr(baleen.tregex, "call_tregex", call_tregex)
+    assert check_prefilter(PATTERNS, parse_dir, term_index=term_index) == {}
+
+
+@pytest.mark.skipif(shutil.which("tregex.sh") is None,
+                    reason="requires tregex.sh")
+def test_prefilter_tregex(parse_dir, term_index):
+    assert check_prefilter(PATTERNS, parse_dir, term_index=term_index) == {}
+
+
+def test_line_endings(tmp_path):
+    # a lone carriage return within a tree is not a line break
+    path = str(tmp_path / "parses")
+    os.mkdir(path)
+    with open(join(path, "a.parse"), "wb") as outf:
+        outf.write(b"(NP (DT the)\r(NN effect))\r\n(NP (NN change))\n"
+                   b"(NP (JJ large)\r(NNS values))")
+
+    tree_index = TreeIndex.open(path)
+    tree_info = Matches.get_tree_info(path)
+    assert len(tree_index) == len(tree_info) == 3
+    assert TermIndex.open(path).n_trees == 3
+    assert [tree_index.get_tree(n, parse=True) for n in tree_info] == (
+        read_corpus(path))
+    assert get_matches("NP < DT", path, engine="native") == [(1, 1)]
@@ -0,0 +1,53 @@
+from os.path import abspath, dirname, join
+import sys
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("tredev")
+
+from baleen.extract import Matches
+from baleen.pipeline import run_pipeline
+from baleen.store import CorpusStore
+from baleen.trans.wrap import TransformWorker, transform_matches
+
+
+FAKE_TRANSFORM = join(dirname(abspath(__file__)), "fake_transform.py")
+
+
+class FakeTransformWorker(TransformWorker):
+
+    def __init__(self):
+        TransformWorker.__init__(self, FAKE_TRANSFORM,
+                                 jython_exec=sys.executable)
+
+    def script_args(self):
+        return [FAKE_TRANSFORM]
+
+
+@pytest.fixture
+def patterns():
+    # the last match of the last pattern is the ill-formed NP with BAD
+    return pd.DataFrame({"pattern": ["NP < DT", "NP < NN"],
+                         "label": ["det", "noun"]},
+                        index=["p1", "p2"])
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 100])
+def test_ill_formed_highest_original(parse_dir, patterns, chunk_size):
+    store = CorpusStore.open(parse_dir)
+    matches = Matches.from_patterns(patterns, store, parse_dir,
+                                    tree_info=store, engine="native")
+    assert "BAD" in matches["subtree"].iloc[-1]
+
+    with FakeTransformWorker() as worker:
+        expected = transform_matches(matches, FAKE_TRANSFORM, worker=worker)
+        merged = run_pipeline(patterns, store, parse_dir,
+                              transform_fname=FAKE_TRANSFORM,
+                              tree_info=store, engine="native",
+                              transform_worker=worker, chunk_size=chunk_size)
+
+    # derived matches never take the index of the dropped original
+    assert matches.index[-1] not in merged.index
+    assert merged["trans_name"].isnull().sum() == len(matches) - 1
+    assert merged.equals(expected)
@@ -0,0 +1,86 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("tredev")
+
+import baleen.postproc
+from baleen.cache import EditCache
+from baleen.instrument import Collector
+from baleen.postproc import post_process
+
+
+RULES = """
+[delete determiner]
+targets = p1
+pattern = NP < DT=n1 $ __
+script = delete n1
+"""
+
+
+def test_tsurgeon_returning_too_few_trees(tmp_path, monkeypatch):
+    rules_fname = str(tmp_path / "post_proc_rules")
+    with open(rules_fname, "w") as outf:
+        outf.write(RULES)
+
+    matches = pd.DataFrame({"pat_name": "p1",
+                            "subtree": ["(NP (DT the) (NN effect))",
+                                        "(NP (DT a) (NN decrease))"],
+                            "substr": ["the effect", "a decrease"]})
+
+    def edit_trees_chain(trees, rules):
+        return ["(NP (NN effect))"]
+
+    monkeypatch.setattr(baleen.postproc, "edit_trees_chain",
+                        edit_trees_chain)
+    cache = EditCache()
+
+    with pytest.raises(ValueError):
+        post_process(matches, rules_fname, cache=cache)
+
+    # no edits are paired with the wrong trees
+    assert not cache.memory
+    assert matches["subtree"].tolist() == ["(NP (DT the) (NN effect))",
+                                           "(NP (DT a) (NN decrease))"]
+
+
+def test_rule_metrics(tmp_path, monkeypatch):
+    rules_fname = str(tmp_path / "post_proc_rules")
+    with open(rules_fname, "w") as outf:
+        outf.write(RULES + """
+[relabel noun]
+targets = p1
+pattern = NN=n1
+script = relabel n1 NNX
+""")
+
+    matches = pd.DataFrame({"pat_name": "p1",
+                            "subtree": ["(NP (DT the) (NN effect))",
+                                        "(NP (NNS values))"],
+                            "substr": ["the effect", "values"]})
+    calls = []
+
+    # stand-in for Tsurgeon deleting determiners and relabeling nouns
+    def edit_trees_chain(trees, rules):
+        calls.append(len(rules))
+        for pattern, _ in rules:
+            old, new = ("(DT the) ", "") if "DT" in pattern else ("(NN ",
+                                                                  "(NNX ")
+            trees = [tree.replace(old, new) for tree in trees]
+        return trees
+
+    monkeypatch.setattr(baleen.postproc, "edit_trees_chain",
+                        edit_trees_chain)
+
+    with Collector() as collector:
+        post_process(matches, rules_fname)
+
+    # rules are applied one at a time
+    assert calls == [1, 1]
+    assert matches["subtree"].tolist() == ["(NP (NNX effect))",
+                                           "(NP (NNS values))"]
+    for name in ("delete determiner", "relabel noun"):
+        assert collector.get("post_process", "rule", name, "trees") == 2
+        assert collector.get("post_process", "rule", name, "changed") == 1
+        assert collector.get("post_process", "rule", name, "seconds") > 0
+    assert collector.get("post_process", "chain",
+                         "delete determiner + relabel noun", "changed") == 1
@@ -0,0 +1,87 @@
+from os.path import abspath, dirname, join
+import sys
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("tredev")
+
+import baleen.postproc
+from baleen.extract import Matches
+from baleen.postproc import post_process
+from baleen.shard import make_manifest, merge_shards, run_shards
+from baleen.store import CorpusStore
+from baleen.trans.wrap import TransformWorker, transform_matches
+
+
+FAKE_TRANSFORM = join(dirname(abspath(__file__)), "fake_transform.py")
+
+RULES = """
+[relabel adjective]
+targets = p1, p3
+pattern = JJ=n1
+script = relabel n1 ADJ
+"""
+
+
+class FakeTransformWorker(TransformWorker):
+
+    def __init__(self):
+        TransformWorker.__init__(self, FAKE_TRANSFORM,
+                                 jython_exec=sys.executable)
+
+    def script_args(self):
+        return [FAKE_TRANSFORM]
+
+
+def edit_trees_chain(trees, rules):
+    # stand-in for Tsurgeon applying the rule above
+    return [tree.replace("(JJ ", "(ADJ ") for tree in trees]
+
+
+@pytest.fixture
+def patterns():
+    return pd.DataFrame({"pattern": ["NP < DT", "NP < NN", "NP < JJ"],
+                         "label": ["det", "noun", "adj"]},
+                        index=["p1", "p2", "p3"])
+
+
+@pytest.fixture
+def rules_fname(tmp_path, monkeypatch):
+    monkeypatch.setattr(baleen.postproc, "edit_trees_chain",
+                        edit_trees_chain)
+    fname = str(tmp_path / "post_proc_rules")
+    with open(fname, "w") as outf:
+        outf.write(RULES)
+    return fname
+
+
+@pytest.mark.parametrize("transform", [False, True])
+@pytest.mark.parametrize("with_nodes", [False, True])
+def test_merge_shards(parse_dir, tmp_path, patterns, rules_fname, transform,
+                      with_nodes):
+    store = CorpusStore.open(parse_dir)
+    expected = Matches.from_patterns(patterns, store, parse_dir,
+                                     tree_info=store, engine="native")
+    post_process(expected, rules_fname)
+    assert expected["subtree"].str.contains("ADJ").any()
+
+    manifest = make_manifest(parse_dir, 2)
+    assert len(manifest["shards"]) == 2
+    out_dir = str(tmp_path / "shards")
+
+    with FakeTransformWorker() as worker:
+        if transform:
+            expected = transform_matches(expected, FAKE_TRANSFORM,
+                                         worker=worker)
+            assert expected["trans_name"].notnull().any()
+        run_shards(manifest, patterns, out_dir,
+                   nodes=store if with_nodes else None,
+                   rules_fname=rules_fname, engine="native",
+                   transform_fname=FAKE_TRANSFORM if transform else None,
+                   transform_worker=worker)
+
+    merged = merge_shards(manifest, out_dir)
+    columns = sorted(expected.columns)
+    pd.testing.assert_frame_equal(merged[columns], expected[columns],
+                                  check_categorical=False)
@@ -0,0 +1,88 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("tredev")
+
+from baleen.trans.trace import (DerivationGraph, get_depths,
+                                print_derivations)
+
+
+@pytest.fixture
+def merged():
+    # m1 -t1-> m3 -t2-> m4 and m1 -t2-> m5; m2 and m6 are not transformed
+    return pd.DataFrame(
+        {"ancestor": [None, None, "m1", "m3", "m1", None],
+         "trans_name": [None, None, "t1", "t2", "t2", None],
+         "label": ["a", "b", "a", "a", "a", "c"],
+         "substr": ["s1", "s2", "s3", "s4", "s5", "s6"]},
+        index=["m1", "m2", "m3", "m4", "m5", "m6"])
+
+
+def test_get_depths():
+    ancestors = np.array([-1, -1, 0, 2, 0, -1, 3])
+    assert get_depths(ancestors).tolist() == [0, 0, 1, 2, 1, 0, 3]
+
+
+def test_from_matches(merged):
+    graph = DerivationGraph.from_matches(merged)
+
+    assert len(graph) == 6
+    assert graph.ancestors.tolist() == [-1, -1, 0, 2, 0, -1]
+    assert graph.origins.tolist() == [0, 1, 0, 0, 0, 5]
+    assert graph.depths.tolist() == [0, 0, 1, 2, 1, 0]
+    assert graph.trans_names == ["t1", "t2"]
+    assert graph.trans_ids.tolist() == [-1, -1, 0, 1, 1, -1]
+    assert list(graph.roots()) == ["m1"]
+    assert list(graph.roots(derived_only=False)) == ["m1", "m2", "m6"]
+
+
+def check_queries(graph):
+    assert list(graph.children("m1")) == ["m3", "m5"]
+    assert list(graph.derived_from("m1")) == ["m3", "m4", "m5"]
+    assert list(graph.derived_from("m3")) == ["m4"]
+    assert list(graph.derived_from("m2")) == []
+    assert list(graph.produced_by("t2")) == ["m4", "m5"]
+    assert list(graph.produced_by("t3")) == []
+    labels, names = graph.path("m4")
+    assert list(labels) == ["m1", "m3", "m4"] and names == ["t1", "t2"]
+    labels, names = graph.path("m2")
+    assert list(labels) == ["m2"] and names == []
+
+
+def test_queries(merged):
+    check_queries(DerivationGraph.from_matches(merged))
+
+
+def test_save_load(merged, tmp_path):
+    path = str(tmp_path / "derivations")
+    DerivationGraph.from_matches(merged).save(path)
+    graph = DerivationGraph.load(path)
+
+    assert isinstance(graph.ancestors, np.memmap)
+    check_queries(graph)
+
+
+def test_save_load_numeric_index(merged, tmp_path):
+    merged.index = [10, 20, 30, 40, 50, 60]
+    merged["ancestor"] = [None, None, 10, 30, 10, None]
+    path = str(tmp_path / "derivations")
+    DerivationGraph.from_matches(merged).save(path)
+    graph = DerivationGraph.load(path)
+
+    assert isinstance(graph.index.values, np.memmap)
+    assert list(graph.derived_from(10)) == [30, 40, 50]
+    assert graph.path(40)[1] == ["t1", "t2"]
+
+
+def test_print_derivations(merged):
+    outf = io.StringIO()
+    print_derivations(merged, outf)
+    lines = outf.getvalue().splitlines()
+
+    assert lines[1] == "1 : a ( m1 )"
+    assert [line.strip() for line in lines[3:]] == [
+        "s1", "=== t1 ===>", "s3", "=== t2 ===>", "s4", "=== t2 ===>", "s5",
+        ""]
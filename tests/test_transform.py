@@ -0,0 +1,103 @@
+from os.path import abspath, dirname, join
+import sys
+
+import pytest
+
+pytest.importorskip("tredev")
+
+from baleen.trans.wrap import (TransformWorker, renumber_tuples,
+                               transform_tuples)
+
+
+FAKE_TRANSFORM = join(dirname(abspath(__file__)), "fake_transform.py")
+
+TREE = "(NP (JJ x) (NN y))"
+
+# original tuples with different numbers of derivations, including none
+# and ill-formed ones, the last of which has the highest index
+ORG_TUPLES = [(index, None, None, subtree) for index, subtree in [
+    (3, "(NP (DT the) (NN effect))"),
+    (5, "(NP (PRP We))"),
+    (6, TREE),
+    (8, "(NP (NN BAD) (NNS values))"),
+    (9, "(NP (JJ Sea) (NN level))"),
+    (12, "(NP (DT a) (NN decrease))"),
+    (14, "(NP (NN BAD))")]]
+
+
+class FakeTransformWorker(TransformWorker):
+
+    def __init__(self):
+        TransformWorker.__init__(self, FAKE_TRANSFORM,
+                                 jython_exec=sys.executable)
+
+    def script_args(self):
+        return [FAKE_TRANSFORM]
+
+
+def derive(max_depth=None, max_derived=None):
+    with FakeTransformWorker() as worker:
+        worker.set_budget(max_depth, max_derived)
+        tuples = list(worker.transform([(0, None, None, TREE)]))
+    assert tuples[0] == (0, None, None, TREE)
+    return tuples[1:]
+
+
+def test_fixpoint():
+    derived = derive()
+    subtrees = [subtree for _, _, _, subtree in derived]
+    ancestors = {index: (ancestor, name)
+                 for index, ancestor, name, _ in derived}
+
+    # derived from the tree relabeled by t4 in the second round
+    index = derived[subtrees.index("(NP (NNY x) (NNY y))")][0]
+    path = []
+    while index:
+        index, name = ancestors[index]
+        path.insert(0, name)
+    assert path == ["t4", "t1", "t2"]
+
+    # trees reached through several paths are kept once, e.g.
+    # (NP (NNX x) (NNX y)) through t4 + t1 and t1 + t4 + t1
+    assert len(set(subtrees)) == len(subtrees) == 8
+    assert TREE not in subtrees
+
+
+def test_budget():
+    derived = derive(max_depth=1)
+    assert [(ancestor, name) for _, ancestor, name, _ in derived] == [
+        (0, "t1"), (0, "t4")]
+
+    derived = derive(max_derived=3)
+    assert [name for _, _, name, _ in derived] == ["t1", "t2", "t4"]
+
+
+@pytest.mark.parametrize("n_workers, batch_size", [(2, 1), (3, 2), (7, 10)])
+def test_shards_equal_single_worker(n_workers, batch_size):
+    with FakeTransformWorker() as worker:
+        expected = transform_tuples(ORG_TUPLES, FAKE_TRANSFORM, worker=worker)
+    workers = [FakeTransformWorker() for _ in range(n_workers)]
+    try:
+        trans_tuples = transform_tuples(ORG_TUPLES, FAKE_TRANSFORM,
+                                        worker=workers, batch_size=batch_size)
+    finally:
+        for worker in workers:
+            worker.close()
+
+    assert trans_tuples == expected
+    # derived tuples are numbered after the dropped original with index 14
+    assert [index for index, _, _, _ in expected] == (
+        [3, 5, 6, 9, 12] + list(range(15, len(expected) + 10)))
+    ancestors = {index: ancestor for index, ancestor, _, _ in expected}
+    assert all(ancestors[index] is None or ancestors[index] < index
+               for index in ancestors)
+
+
+def test_renumber_tuples():
+    # derivations of two originals, interleaved as a worker might return
+    tuples = [(1, None, None, "a"), (2, None, None, "b"),
+              (3, 2, "t1", "b1"), (4, 1, "t1", "a1"), (5, 3, "t2", "b2"),
+              (6, 4, "t2", "a2")]
+    assert renumber_tuples(tuples, 10) == [
+        (11, 1, "t1", "a1"), (12, 11, "t2", "a2"), (13, 2, "t1", "b1"),
+        (14, 13, "t2", "b2")]
@@ -0,0 +1,71 @@
+import os
+from os.path import join
+import pickle
+
+import baleen.tree
+from baleen.index import TreeIndex
+from baleen.pattern import compile_pattern
+from baleen.tree import Tree, clear_vocabulary, read_corpus
+
+
+LBS = "(S (NP (DT the) (NN change)) (VP (VBD came)))"
+
+
+def test_vocabulary_per_corpus(parse_dir):
+    trees = read_corpus(parse_dir)
+    tree = Tree.from_string(trees[0].to_string())
+
+    assert tree.vocabulary is baleen.tree.vocabulary
+    assert trees[0].vocabulary is not tree.vocabulary
+    assert all(t.vocabulary is trees[0].vocabulary for t in trees)
+    # trees are equal whatever the vocabulary of their labels
+    assert tree == trees[0] and hash(tree) == hash(trees[0])
+    assert tree != trees[1]
+    assert pickle.loads(pickle.dumps(trees[0])) == tree
+
+
+def test_clear_vocabulary():
+    old = Tree.from_string(LBS)
+    clear_vocabulary()
+    new = Tree.from_string(LBS)
+
+    assert len(baleen.tree.vocabulary) == len(set(new.labels))
+    assert old.vocabulary is not new.vocabulary
+    assert old.to_string() == LBS
+    assert old == new and hash(old) == hash(new)
+    assert new.subtree(1).vocabulary is new.vocabulary
+
+
+def test_corpus_cache_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(baleen.tree, "MAX_CACHED_CORPORA", 2)
+    dirs = []
+    for i in range(3):
+        path = str(tmp_path / str(i))
+        os.mkdir(path)
+        with open(join(path, "a.parse"), "w") as outf:
+            outf.write(LBS + "\n")
+        dirs.append(path)
+
+    first = read_corpus(dirs[0])
+    assert read_corpus(dirs[0]) is first
+    read_corpus(dirs[1])
+    read_corpus(dirs[2])
+
+    assert len(baleen.tree._corpus_cache) == 2
+    assert read_corpus(dirs[0]) is not first
+
+
+def test_blank_lines(tmp_path):
+    path = str(tmp_path / "parses")
+    os.mkdir(path)
+    with open(join(path, "a.parse"), "w") as outf:
+        outf.write(LBS + "\n\n" + LBS + "\n  \n" + LBS)
+
+    trees = read_corpus(path)
+    assert trees[1] is None and trees[3] is None
+    assert trees[0] == trees[2] == trees[4] == Tree.from_string(LBS)
+    # trees are numbered like in the tree index
+    index = TreeIndex.build(path, str(tmp_path / "index"))
+    assert len(index) == len(trees)
+    assert compile_pattern("NP < DT").get_matches(trees) == [
+        (1, 2), (3, 2), (5, 2)]
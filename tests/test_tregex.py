@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+import shutil
+
+import pytest
+
+pytest.importorskip("tredev")
+
+import baleen.tregex
+from baleen.pattern import PatternSet
+from baleen.tregex import (check_conformance, get_matches, get_matches_multi,
+                           get_matches_parallel)
+
+
+# (absolute tree number, node number) of matches in the fixture corpus,
+# with nodes numbered in pre-order from 1, including words. Like Tregex, a
+# node is matched once for every way in which it matches the pattern.
+EXPECTED = {
+    "NP < DT": [(1, 3), (3, 4), (4, 9)],
+    "NP < NN": [(1, 3), (1, 14), (2, 3), (3, 4), (3, 12), (3, 12), (4, 9),
+                (4, 17)],
+    "NP << change": [(3, 3), (3, 12)],
+    "NP !< DT": [(1, 14), (2, 3), (3, 3), (3, 12), (4, 3), (4, 17)],
+    "NP [< DT | < JJ]": [(1, 3), (2, 3), (3, 4), (4, 9)],
+    "VP < /^VB[DZ]$/": [(1, 8), (2, 8), (3, 17), (4, 6)],
+    "NP $ VP": [(1, 3), (2, 3), (3, 3), (4, 3)],
+    "NP $.. PP": [(3, 4), (4, 9)],
+    "PP > VP": [(1, 11), (4, 14)],
+    "@NP < NNS": [(4, 17)],
+    "NP < (NN < decrease)": [(4, 9)],
+    "S < (NP !< PRP) < VP": [(1, 2), (2, 2), (3, 2)],
+    "ADJP < (JJ < large) > VP": [(3, 20)],
+}
+
+
+@pytest.mark.parametrize("pattern", sorted(EXPECTED))
+def test_native_matches(parse_dir, pattern):
+    matches = get_matches(pattern, parse_dir, engine="native")
+    assert sorted(matches) == EXPECTED[pattern]
+
+
+def test_batched_matches(parse_dir):
+    matches = get_matches_multi(sorted(EXPECTED), parse_dir, engine="native")
+    assert dict((pattern, sorted(pairs))
+                for pattern, pairs in matches.items()) == EXPECTED
+
+
+def test_shared_subexpressions():
+    patterns = PatternSet(["NP < (NN < decrease)", "VP < (NP < (NN<decrease))",
+                           "NP < DT", "S < (NP < DT)"])
+    # NP < (NN < decrease), NN < decrease and NP < DT, but not the nodes 
+    # without relations
+    assert len(set(patterns.shared_ids.values())) == 3
+    assert len(patterns.shared_ids) == 6
+
+
+@pytest.mark.skipif(shutil.which("tregex.sh") is None,
+                    reason="requires tregex.sh")
+def test_native_conforms_to_tregex(parse_dir):
+    assert check_conformance(sorted(EXPECTED), parse_dir) == {}
+
+
+def test_external_engine_is_default(parse_dir, monkeypatch):
+    calls = []
+
+    def call_tregex(pattern, file_path, exec_path="tregex.sh"):
+        calls.append(pattern)
+        return EXPECTED[pattern]
+
+    monkeypatch.setattr(baleen.tregex, "call_tregex", call_tregex)
+    assert get_matches("NP < DT", parse_dir) == EXPECTED["NP < DT"]
+    assert calls == ["NP < DT"]
+
+
+@pytest.mark.parametrize("engine", ["native", "external"])
+def test_parallel_repeated_pattern(parse_dir, monkeypatch, engine):
+    def call_tregex(pattern, file_path, exec_path="tregex.sh"):
+        return get_matches(pattern, file_path, engine="native")
+
+    monkeypatch.setattr(baleen.tregex, "call_tregex", call_tregex)
+    patterns = ["NP < DT", "NP < NN", "NP < DT"]
+
+    # threads, so that the patched tregex.sh is used by all work units
+    with ThreadPoolExecutor(2) as executor:
+        matches = get_matches_parallel(patterns, parse_dir, engine=engine,
+                                       executor=executor, shards_per_job=1)
+
+    assert matches == {"NP < DT": EXPECTED["NP < DT"],
+                       "NP < NN": EXPECTED["NP < NN"]}
@@ -0,0 +1,86 @@
+from os.path import abspath, basename, dirname, join
+import sys
+
+import pytest
+
+pytest.importorskip("tredev")
+
+import baleen.tregex
+from baleen import jython_common
+from baleen.extract import Matches
+from baleen.index import TreeIndex
+from baleen.jython_common import tree_files
+from baleen.tregex import get_matches
+from baleen.worker import Worker, WorkerError, escape, unescape
+
+
+FAKE_SERVER = join(dirname(abspath(__file__)), "fake_server.py")
+
+
+FIELDS = ["(NP (NN a\\b))", "tab\there", "new\nline", "\\t", "\\\\n\t\\", ""]
+
+
+@pytest.mark.parametrize("field", FIELDS)
+def test_escape_round_trip(field):
+    assert unescape(escape(field)) == field
+    assert "\t" not in escape(field) and "\n" not in escape(field)
+
+
+@pytest.mark.parametrize("field", FIELDS)
+def test_same_escaping_as_jython(field):
+    # the Jython scripts speak the same line protocol
+    assert jython_common.escape(field) == escape(field)
+    assert jython_common.unescape(escape(field)) == field
+    assert unescape(jython_common.escape(field)) == field
+
+
+class FakeWorker(Worker):
+
+    def __init__(self, file_path=None):
+        Worker.__init__(self, file_path, jython_exec=sys.executable)
+
+    def script_args(self):
+        return [FAKE_SERVER]
+
+
+def test_lazy_load(parse_dir):
+    with FakeWorker(parse_dir) as worker:
+        assert worker.process is None
+        assert worker.serves(parse_dir)
+        assert worker.get_matches("__") == [(1, 1), (2, 1), (3, 1), (4, 1)]
+        assert worker.n_trees == 4
+
+
+def test_reload_after_restart(parse_dir):
+    with FakeWorker(parse_dir) as worker:
+        worker.get_matches("__")
+        worker.process.kill()
+        worker.process.wait()
+        assert worker.get_matches("__") == [(1, 1), (2, 1), (3, 1), (4, 1)]
+
+
+def test_fallback_without_jython(parse_dir, monkeypatch):
+    def call_tregex(pattern, file_path, exec_path="tregex.sh"):
+        return [(1, 1)]
+
+    monkeypatch.setattr(baleen.tregex, "call_tregex", call_tregex)
+
+    with Worker(parse_dir, jython_exec="no-such-jython") as worker:
+        assert get_matches("__", parse_dir) == [(1, 1)]
+        assert not worker.serves(parse_dir)
+        with pytest.raises(WorkerError):
+            worker.get_matches("__")
+
+
+def test_hidden_files_are_skipped(parse_dir):
+    with open(join(parse_dir, ".DS_Store"), "w") as outf:
+        outf.write("(X (Y z))\n")
+
+    fnames = [basename(fname) for fname in tree_files(parse_dir)]
+    assert fnames == sorted(set(fname for _, fname in
+                                Matches.get_tree_info(parse_dir).values()))
+    assert fnames == [fname for fname, _, _ in TreeIndex.scan_files(parse_dir)]
+
+    with FakeWorker(parse_dir) as worker:
+        worker.get_matches("__")
+        assert worker.n_trees == len(Matches.get_tree_info(parse_dir)) == 4